@@ -28,6 +28,9 @@ config.set_section_option(section, "DATABASE_URL", DATABASE_URL)
 
 target_metadata = Base.metadata
 
+# extensions the models rely on (pg_trgm for the identity search indexes), created ahead of any revision
+REQUIRED_EXTENSIONS = ("pg_trgm",)
+
 
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
@@ -47,6 +50,11 @@ target_metadata = Base.metadata
 # ... etc.
 
 
+def create_extensions() -> None:
+    for extension in REQUIRED_EXTENSIONS:
+        context.execute(f"CREATE EXTENSION IF NOT EXISTS {extension}")
+
+
 def run_migrations_offline() -> None:
     """Run migrations in 'offline' mode.
 
@@ -68,6 +76,7 @@ def run_migrations_offline() -> None:
     )
 
     with context.begin_transaction():
+        create_extensions()
         context.run_migrations()
 
 
@@ -90,6 +99,7 @@ def run_migrations_online() -> None:
         )
 
         with context.begin_transaction():
+            create_extensions()
             context.run_migrations()
 
 
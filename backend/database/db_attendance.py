@@ -7,6 +7,7 @@ from sqlalchemy.orm import joinedload, selectinload
 from sqlalchemy.orm.session import Session
 
 from models import Attendance, Identity, TenantEntity
+from utils.search import text_search
 
 
 def get_attendances(db: Session, identity_id: int):
@@ -66,9 +67,9 @@ def get_attendance_with_filters(
         query = query.filter(Attendance.by_mobile == by_mobile)
     if search:
         query = query.filter(
-            Identity.first_name.ilike(f"%{search}%")
-            | Identity.last_name.ilike(f"%{search}%")
-            | Identity.pinfl.ilike(f"%{search}%")
+            text_search(
+                search, (Identity.first_name, Identity.last_name, Identity.pinfl), exact_columns=(Identity.pinfl,)
+            )
         )
     if unique is True:
         query = query.distinct(Attendance.identity_id).order_by(Attendance.identity_id.desc())
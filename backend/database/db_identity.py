@@ -18,6 +18,7 @@ from services.face_auth import verify_insight_face_async
 from tasks import send_updated_identity_photo_task
 from utils.image_processing import extract_minio_url
 from utils.kindergarten import get_birth_date_from_pinfl
+from utils.search import text_search
 
 
 def upload_identity_photo_to_platon(identity: Type[Identity], photo_pk: int, username: Optional[str] = None):
@@ -136,10 +137,11 @@ def get_identities(
             query = query.filter_by(group_id=group_id)
         if search:
             query = query.filter(
-                Identity.first_name.ilike(f"%{search}%")
-                | Identity.last_name.ilike(f"%{search}%")
-                | Identity.pinfl.ilike(f"%{search}%")
-                | Identity.external_id.ilike(f"%{search}%")
+                text_search(
+                    search,
+                    (Identity.first_name, Identity.last_name, Identity.pinfl, Identity.external_id),
+                    exact_columns=(Identity.pinfl,),
+                )
             )
     except Exception as e:
         print(e)
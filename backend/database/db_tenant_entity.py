@@ -4,6 +4,7 @@ from operator import itemgetter
 from typing import Literal, Optional
 
 from fastapi import HTTPException, status
+from redis import Redis
 from sqlalchemy import and_, case, distinct, func
 from sqlalchemy.orm import joinedload, selectinload
 from sqlalchemy.orm.session import Session
@@ -24,6 +25,14 @@ from models import (
     WantedAttendance,
 )
 from schemas.tenant_hierarchy_entity import TenantEntityCreate, TenantEntityUpdate
+from utils.segment_cache import get_day_segment, invalidate_on_backfill, segment_scope
+
+# mobile clients sync attendance recorded offline, which lands in days that are already cached
+invalidate_on_backfill(
+    Attendance, "attendance_datetime", "tenant_entity_attendance_counts", "tenant_entity_attendance_statistics"
+)
+invalidate_on_backfill(VisitorAttendance, "attendance_datetime", "tenant_entity_attendance_statistics")
+invalidate_on_backfill(WantedAttendance, "attendance_datetime", "tenant_entity_attendance_statistics")
 
 
 def create_tenant_entity(db: Session, tenant_id, tenant_entity: TenantEntityCreate):
@@ -411,8 +420,12 @@ def get_tenant_entity_analytics(
     entity_name_search: str = None,
     attendance_ratio_from: int = None,
     attendance_ratio_to: int = None,
+    redis_client: Redis = None,
 ):
-    filtered_tenant_entities = db.query(TenantEntity.id).filter(TenantEntity.is_active)
+    # names and active state change at any time, so the entities are selected fresh and only the counts are cached
+    filtered_tenant_entities = db.query(TenantEntity.id, TenantEntity.name, TenantEntity.external_id).filter(
+        TenantEntity.is_active
+    )
 
     if region_id:
         filtered_tenant_entities = filtered_tenant_entities.filter_by(region_id=region_id)
@@ -423,51 +436,68 @@ def get_tenant_entity_analytics(
     if entity_name_search:
         filtered_tenant_entities = filtered_tenant_entities.filter(TenantEntity.name.ilike(f"%{entity_name_search}%"))
 
-    filtered_tenant_entities = filtered_tenant_entities.subquery()
+    entities = {row.id: (row.name, row.external_id) for row in filtered_tenant_entities}
 
-    attendance_analytics = (
-        db.query(
-            Attendance.tenant_entity_id,
-            TenantEntity.name.label("entity_name"),
-            TenantEntity.external_id.label("entity_external_id"),
-            Identity.identity_group.label("identity_group"),
-            func.count(distinct(Attendance.identity_id)).label("identity_count"),
-        )
-        .join(TenantEntity, Attendance.tenant_entity_id == TenantEntity.id)
-        .join(Identity, Attendance.identity_id == Identity.id)
-        .filter(
-            Attendance.tenant_entity_id.in_(filtered_tenant_entities),
-            Attendance.attendance_datetime.between(f"{attedance_date} 00:00:00", f"{attedance_date} 23:59:59"),
+    def load_attendance_counts():
+        query = (
+            db.query(
+                Attendance.tenant_entity_id,
+                Identity.identity_group.label("identity_group"),
+                func.count(distinct(Attendance.identity_id)).label("identity_count"),
+            )
+            .join(Identity, Attendance.identity_id == Identity.id)
+            .filter(
+                Attendance.attendance_datetime.between(f"{attedance_date} 00:00:00", f"{attedance_date} 23:59:59"),
+            )
         )
-        .group_by(
-            Attendance.tenant_entity_id,
-            TenantEntity.name,
-            TenantEntity.external_id,
-            Identity.identity_group,
+        if region_id or district_id:
+            query = query.join(TenantEntity, Attendance.tenant_entity_id == TenantEntity.id)
+            if region_id:
+                query = query.filter(TenantEntity.region_id == region_id)
+            if district_id:
+                query = query.filter(TenantEntity.district_id == district_id)
+        rows = query.group_by(Attendance.tenant_entity_id, Identity.identity_group).all()
+        return [list(row) for row in rows]
+
+    # attendance of a closed day does not change, so its per-entity counts are cached; identity totals are not
+    if redis_client is None:
+        attendance_analytics = load_attendance_counts()
+    else:
+        attendance_analytics = get_day_segment(
+            redis_client,
+            "tenant_entity_attendance_counts",
+            segment_scope(region_id, district_id),
+            attedance_date,
+            load_attendance_counts,
         )
-        .all()
-    )
 
     TENANT_ENTITY_ID_INDEX = 0
-    IDENTITY_GROUP_INDEX = 3
-    IDENTITY_COUNT_INDEX = 4
+    IDENTITY_GROUP_INDEX = 1
+    IDENTITY_COUNT_INDEX = 2
 
+    attendance_analytics = [row for row in attendance_analytics if row[TENANT_ENTITY_ID_INDEX] in entities]
     attendance_analytics.sort(key=itemgetter(TENANT_ENTITY_ID_INDEX))
     attendance_analytics = {
         key: list(group) for key, group in groupby(attendance_analytics, key=itemgetter(TENANT_ENTITY_ID_INDEX))
     }
 
+    total_counts = {
+        row.tenant_entity_id: row
+        for row in db.query(
+            Identity.tenant_entity_id,
+            func.count(case((Identity.identity_group == 0, 1))).label("total_kids_count"),
+            func.count(case((Identity.identity_group == 1, 1))).label("total_employees_count"),
+        )
+        .filter(Identity.tenant_entity_id.in_(list(attendance_analytics)))
+        .group_by(Identity.tenant_entity_id)
+    }
+
     analytics_reports = []
 
     for tenant_entity_id, group in attendance_analytics.items():
-        total_count = (
-            db.query(
-                func.count(case((Identity.identity_group == 0, 1))).label("total_kids_count"),
-                func.count(case((Identity.identity_group == 1, 1))).label("total_employees_count"),
-            )
-            .filter(Identity.tenant_entity_id == tenant_entity_id)
-            .one()
-        )
+        total_count = total_counts.get(tenant_entity_id)
+        if total_count is None:
+            continue
 
         kids_attendance_count = 0
         employees_attendance_count = 0
@@ -484,16 +514,16 @@ def get_tenant_entity_analytics(
         kids_attendance_ratio = round((kids_attendance_count / total_count.total_kids_count) * 100, 2)
         employees_attendance_ratio = round((employees_attendance_count / total_count.total_employees_count) * 100, 2)
 
-        current_analytics_data = group[0]
+        entity_name, entity_external_id = entities[tenant_entity_id]
 
         if (attendance_ratio_from is not None) and (attendance_ratio_to is not None):
             if attendance_sort_role == "kid":
                 if attendance_ratio_from <= kids_attendance_ratio <= attendance_ratio_to:
                     analytics_reports.append(
                         {
-                            "tenant_entity_id": current_analytics_data.tenant_entity_id,
-                            "tenant_entity_name": current_analytics_data.entity_name,
-                            "external_id": current_analytics_data.entity_external_id,
+                            "tenant_entity_id": tenant_entity_id,
+                            "tenant_entity_name": entity_name,
+                            "external_id": entity_external_id,
                             "kids_attendance_count": kids_attendance_count,
                             "employees_attendance_count": employees_attendance_count,
                             "kids_total_count": total_count.total_kids_count,
@@ -506,9 +536,9 @@ def get_tenant_entity_analytics(
                 if attendance_ratio_from <= employees_attendance_ratio <= attendance_ratio_to:
                     analytics_reports.append(
                         {
-                            "tenant_entity_id": current_analytics_data.tenant_entity_id,
-                            "tenant_entity_name": current_analytics_data.entity_name,
-                            "external_id": current_analytics_data.entity_external_id,
+                            "tenant_entity_id": tenant_entity_id,
+                            "tenant_entity_name": entity_name,
+                            "external_id": entity_external_id,
                             "kids_attendance_count": kids_attendance_count,
                             "employees_attendance_count": employees_attendance_count,
                             "kids_total_count": total_count.total_kids_count,
@@ -519,9 +549,9 @@ def get_tenant_entity_analytics(
         else:
             analytics_reports.append(
                 {
-                    "tenant_entity_id": current_analytics_data.tenant_entity_id,
-                    "tenant_entity_name": current_analytics_data.entity_name,
-                    "external_id": current_analytics_data.entity_external_id,
+                    "tenant_entity_id": tenant_entity_id,
+                    "tenant_entity_name": entity_name,
+                    "external_id": entity_external_id,
                     "kids_attendance_count": kids_attendance_count,
                     "employees_attendance_count": employees_attendance_count,
                     "kids_total_count": total_count.total_kids_count,
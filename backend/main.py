@@ -15,7 +15,7 @@ from starlette.middleware.authentication import AuthenticationMiddleware
 from auth.authentication import router as sys_admin_auth_router
 from auth.base import JWTAuthBackend
 from config import MONGO_DB_URL
-from database.database import init_db
+from database.database import SessionLocal, get_mongo_db, init_db
 from middleware import LogMiddleware
 from routers import (
     activity_logs,
@@ -53,6 +53,8 @@ from routers import (
     wanted,
 )
 from routers.relative import relative_routers
+from services.attendance_partitions import ensure_attendance_partitions
+from services.poll_analytics import create_poll_analytics_indexes
 
 OPENAPI_DASHBOARD_LOGIN = os.getenv("USERNAME", "admin")
 OPENAPI_DASHBOARD_PASSWORD = os.getenv("PASSWORD", "ping1234")
@@ -160,6 +162,19 @@ async def startup():
         await init_db()
     except Exception as e:
         print(e)
+    # init_db fails once its collections exist, so the idempotent index setup runs on its own
+    try:
+        await create_poll_analytics_indexes(get_mongo_db())
+    except Exception as e:
+        print(e)
+    # attendance inserts fail without a partition to land in, so do not wait for the nightly beat task
+    db = SessionLocal()
+    try:
+        ensure_attendance_partitions(db)
+    except Exception as e:
+        print(e)
+    finally:
+        db.close()
 
 
 @app.on_event("shutdown")
@@ -53,6 +53,7 @@ from models.similarity import SimilarityAttendancePhotoInArea as SimilarityAtten
 from models.similarity import SimilarityAttendancePhotoInEntity as SimilarityAttendancePhotoInEntity
 from models.similarity import SimilarityMainPhotoInArea as SimilarityMainPhotoInArea
 from models.similarity import SimilarityMainPhotoInEntity as SimilarityMainPhotoInEntity
+from models.task_outbox import TaskOutbox as TaskOutbox
 from models.tenant import GuessMessage as GuessMessage
 from models.tenant import Tenant as Tenant
 from models.tenant_admin import TenantAdmin as TenantAdmin
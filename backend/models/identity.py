@@ -1,8 +1,9 @@
 import uuid
 
-from sqlalchemy import ARRAY, BigInteger, Boolean, Column, Date, DateTime, Float, Integer, String, Text
+from sqlalchemy import ARRAY, BigInteger, Boolean, Column, Date, DateTime, Float, Index, Integer, String, Text
 from sqlalchemy.orm import relationship
 from sqlalchemy.schema import UniqueConstraint
+from sqlalchemy.sql import func
 from sqlalchemy.sql.schema import ForeignKey
 
 from models.base import BaseModel
@@ -16,7 +17,7 @@ class Identity(BaseModel):
     photo = Column(String)
     email = Column(String)
     phone = Column(String)
-    pinfl = Column(String)
+    pinfl = Column(String, index=True)
     identity_group = Column(Integer, default=0)
     identity_type = Column(String)
     tenant_id = Column(Integer, ForeignKey("tenant.id"), index=True)
@@ -53,6 +54,11 @@ class Identity(BaseModel):
     errors = relationship("ErrorSmartCamera", back_populates="identity")
     photos = relationship("IdentityPhoto", back_populates="identity")
     extra_attendances = relationship("ExtraAttendance", back_populates="identity")
+    # pg_trgm GIN indexes serve the ilike '%term%' searches in utils/search.py, the extension is created by alembic
+    __table_args__ = tuple(
+        Index(f"identity_{column}_trgm_idx", column, postgresql_using="gin", postgresql_ops={column: "gin_trgm_ops"})
+        for column in ("first_name", "last_name", "pinfl", "external_id")
+    )
 
 
 class IdentityPhoto(BaseModel):
@@ -104,8 +110,11 @@ class CustomLocation(BaseModel):
 
 class Attendance(BaseModel):
     __tablename__ = "attendance"
+    # partitioned by month on attendance_datetime, which is therefore part of the primary key
+    # (partitions are managed by services/attendance_partitions.py)
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
     attendance_type = Column(String, default="enter")
-    attendance_datetime = Column(DateTime)
+    attendance_datetime = Column(DateTime, primary_key=True, default=func.now())
     snapshot_url = Column(String)
     background_image_url = Column(String)
     body_image_url = Column(String)
@@ -142,11 +151,33 @@ class Attendance(BaseModel):
     attestation_id = Column(Integer, index=True)
     username = Column(String)
     app_source = Column(String)
+    # "<package_uuid>:<identity_id>" for mobile submissions, so retries of the same package collapse into one row;
+    # retries carry the same capture time, which the unique constraint has to include on a partitioned table
+    idempotency_key = Column(String, nullable=True)
 
     identity = relationship("Identity")
-    spoofing = relationship("AttendanceAntiSpoofing", back_populates="attendance", uselist=False)
-    report = relationship("AttendanceReport", back_populates="attendance")
+    # tables referring to attendance cannot have foreign keys to it, a partitioned table's id alone is not unique
+    spoofing = relationship(
+        "AttendanceAntiSpoofing",
+        primaryjoin="Attendance.id == foreign(AttendanceAntiSpoofing.attendance_id)",
+        back_populates="attendance",
+        uselist=False,
+    )
+    report = relationship(
+        "AttendanceReport",
+        primaryjoin="Attendance.id == foreign(AttendanceReport.attendance_id)",
+        back_populates="attendance",
+    )
     package = relationship("Package", back_populates="attendance")
+    __table_args__ = (
+        UniqueConstraint("idempotency_key", "attendance_datetime", name="attendance_idempotency_key_key"),
+        # keyset pagination of attendance lists, newest first (backward index scans serve the DESC order)
+        Index("attendance_tenant_id_attendance_datetime_id_idx", "tenant_id", "attendance_datetime", "id"),
+        Index(
+            "attendance_tenant_entity_id_attendance_datetime_id_idx", "tenant_entity_id", "attendance_datetime", "id"
+        ),
+        {"postgresql_partition_by": "RANGE (attendance_datetime)"},
+    )
 
 
 class WantedAttendance(BaseModel):
@@ -181,13 +212,17 @@ class IdentitySmartCamera(BaseModel):
 
 class AttendanceAntiSpoofing(BaseModel):
     __tablename__ = "attendance_anti_spoofing"
-    attendance_id = Column(Integer, ForeignKey("attendance.id"), index=True)
+    attendance_id = Column(Integer, index=True)
     is_spoofed = Column(Boolean)
     score = Column(Float)
     real_score = Column(Float)
     fake_score = Column(Float)
 
-    attendance = relationship("Attendance", back_populates="spoofing")
+    attendance = relationship(
+        "Attendance",
+        primaryjoin="foreign(AttendanceAntiSpoofing.attendance_id) == Attendance.id",
+        back_populates="spoofing",
+    )
 
 
 class Relative(BaseModel):
@@ -265,7 +300,7 @@ class RelativeAttendance(BaseModel):
 class AttendanceReport(BaseModel):
     __tablename__ = "attendance_report"
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True, index=True)
-    attendance_id = Column(Integer, ForeignKey("attendance.id"), nullable=False, index=True)
+    attendance_id = Column(Integer, nullable=False, index=True)
     tenant_entity_id = Column(Integer, ForeignKey("tenant_entity.id"), nullable=True, index=True)
     description = Column(String, nullable=False)
     status = Column(String, default="IN_PROGRESS")
@@ -278,7 +313,9 @@ class AttendanceReport(BaseModel):
     device_model = Column(String)
     moderator_note = Column(String)
 
-    attendance = relationship("Attendance", back_populates="report")
+    attendance = relationship(
+        "Attendance", primaryjoin="foreign(AttendanceReport.attendance_id) == Attendance.id", back_populates="report"
+    )
 
 
 class ErrorRelativeSmartCamera(BaseModel):
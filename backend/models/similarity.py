@@ -30,7 +30,7 @@ class SimilarityMainPhotoInEntity(BaseModel):
 class SimilarityAttendancePhotoInArea(BaseModel):
     __tablename__ = "similarity_attendance_photo_in_area"
     identity_id = Column(Integer, ForeignKey("identity.id"), index=True)
-    attendance_id = Column(Integer, ForeignKey("attendance.id"), index=True)
+    attendance_id = Column(Integer, index=True)
     image_url = Column(String)
     capture_timestamp = Column(Integer)
     similar_attendance_id = Column(Integer)
@@ -43,7 +43,7 @@ class SimilarityAttendancePhotoInEntity(BaseModel):
     __tablename__ = "similarity_attendance_photo_in_entity"
     identity_id = Column(Integer, ForeignKey("identity.id"), index=True)
     tenant_entity_id = Column(Integer, ForeignKey("tenant_entity.id"), index=True)
-    attendance_id = Column(Integer, ForeignKey("attendance.id"), index=True)
+    attendance_id = Column(Integer, index=True)
     image_url = Column(String)
     capture_timestamp = Column(Integer)
     similar_attendance_id = Column(Integer)
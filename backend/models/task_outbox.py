@@ -0,0 +1,13 @@
+from sqlalchemy import Column, DateTime, String
+from sqlalchemy.dialects.postgresql import JSONB
+
+from models.base import BaseModel
+
+
+class TaskOutbox(BaseModel):
+    """Celery tasks written in the same transaction as the rows they are about, sent only after commit."""
+
+    __tablename__ = "task_outbox"
+    task_name = Column(String, nullable=False)
+    payload = Column(JSONB, nullable=False)
+    dispatched_at = Column(DateTime, nullable=True, index=True)
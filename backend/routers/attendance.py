@@ -8,12 +8,16 @@ from sqlalchemy.orm import Session
 from auth.oauth2 import get_current_tenant_admin, get_tenant_entity_user
 from database import db_attendance, db_smartcamera, db_tenant_entity
 from database.database import get_pg_db
+from models import Attendance
 from schemas.attendance import AttendanceInDB, WantedAttendanceInDB
 from schemas.visitor import VisitorAttendanceInDB
-from utils.pagination import CustomPage
+from utils.pagination import CountMode, CursorPage, CustomPage, keyset_paginate
 
 router = APIRouter(prefix="/attendance", tags=["attendance"])
 
+# the /cursor lists page by this key instead of by offset; pass next_cursor back as cursor for the next page
+ATTENDANCE_KEYSET = (Attendance.attendance_datetime, Attendance.id)
+
 customer_router = APIRouter(prefix="/attendances", tags=["attendances"])
 tenant_router = APIRouter(prefix="/attendances", tags=["attendances"])
 
@@ -137,3 +141,74 @@ def get_attendances(
     except Exception as e:
         print(e)
         raise HTTPException(status_code=400, detail="Ouch! Something went wrong") from e
+
+
+@customer_router.get("/cursor", response_model=CursorPage[AttendanceInDB])
+def get_customer_attendances_by_cursor(
+    identity_group: Optional[int] = None,
+    event_type: Optional[str] = None,
+    start_date: datetime = Query(None, description="Date in YYYY-MM-DD format"),
+    end_date: datetime = Query(None, description="Date in YYYY-MM-DD format"),
+    from_comp_score: Optional[float] = None,
+    to_comp_score: Optional[float] = None,
+    by_mobile: Optional[bool] = None,
+    search: Optional[str] = None,
+    cursor: Optional[str] = None,
+    size: int = Query(20, ge=1, le=100),
+    count: CountMode = "none",
+    db: Session = Depends(get_pg_db),
+    user=Security(get_tenant_entity_user),
+):
+    query_set = db_attendance.get_attendance_with_filters(
+        db=db,
+        tenant_id=user.tenant_id,
+        tenant_entity_id=user.tenant_entity_id,
+        identity_group=identity_group,
+        event_type=event_type,
+        start_date=start_date,
+        end_date=end_date,
+        from_comp_score=from_comp_score,
+        to_comp_score=to_comp_score,
+        by_mobile=by_mobile,
+        search=search,
+    ).filter(Attendance.attendance_datetime.is_not(None))
+    return keyset_paginate(query_set, ATTENDANCE_KEYSET, cursor, size, count)
+
+
+@tenant_router.get("/cursor", response_model=CursorPage[AttendanceInDB])
+def get_attendances_by_cursor(
+    tenant_entity_id: Optional[int] = None,
+    identity_group: Optional[int] = None,
+    region_id: Optional[int] = None,
+    district_id: Optional[int] = None,
+    event_type: Optional[str] = None,
+    start_date: datetime = Query(None, description="Date in YYYY-MM-DD format"),
+    end_date: datetime = Query(None, description="Date in YYYY-MM-DD format"),
+    from_comp_score: Optional[float] = None,
+    to_comp_score: Optional[float] = None,
+    by_mobile: Optional[bool] = None,
+    search: Optional[str] = None,
+    cursor: Optional[str] = None,
+    size: int = Query(20, ge=1, le=100),
+    count: CountMode = "none",
+    db: Session = Depends(get_pg_db),
+    tenant_admin=Security(get_current_tenant_admin),
+):
+    if tenant_entity_id:
+        db_tenant_entity.get_tenant_entity(db, tenant_admin.tenant_id, tenant_entity_id)
+    query_set = db_attendance.get_attendance_with_filters(
+        db=db,
+        tenant_id=tenant_admin.tenant_id,
+        tenant_entity_id=tenant_entity_id,
+        identity_group=identity_group,
+        region_id=region_id,
+        district_id=district_id,
+        event_type=event_type,
+        start_date=start_date,
+        end_date=end_date,
+        from_comp_score=from_comp_score,
+        to_comp_score=to_comp_score,
+        by_mobile=by_mobile,
+        search=search,
+    ).filter(Attendance.attendance_datetime.is_not(None))
+    return keyset_paginate(query_set, ATTENDANCE_KEYSET, cursor, size, count)
@@ -1,5 +1,6 @@
-from datetime import datetime, timedelta
-from typing import List
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+from typing import Dict, List
 
 from fastapi import APIRouter, Depends, HTTPException, Query, Security
 from sqlalchemy import and_, or_
@@ -15,6 +16,8 @@ from schemas.dashboard import (
     VisitsBreakdownSchema,
 )
 from schemas.tenant_hierarchy_entity import TenantEntityInDB
+from utils.redis_cache import get_async_redis_connection
+from utils.segment_cache import get_day_segment_async, get_day_segments, segment_scope
 
 router = APIRouter(prefix="/dashboard", tags=["dashboard"])
 
@@ -178,6 +181,40 @@ async def get_entity_visitor_data(db, mongo_client, ids: list, date: datetime) -
     return result
 
 
+async def get_daily_sex_counts(
+    mongo_client, redis_client, device_ids: list, start: date, end: date
+) -> Dict[date, dict]:
+    """Visitor counts per day and sex for ``start``..``end``; visitors without a sex are counted under ""."""
+
+    async def compute(first: date, last: date) -> Dict[date, dict]:
+        pipeline = [
+            {
+                "$match": {
+                    "capture_time": {
+                        "$gte": datetime.combine(first, time.min),
+                        "$lt": datetime.combine(last + timedelta(days=1), time.min),
+                    },
+                    "device_id": {"$in": device_ids},
+                }
+            },
+            {
+                "$group": {
+                    "_id": {"day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$capture_time"}}, "sex": "$sex"},
+                    "count": {"$sum": 1},
+                }
+            },
+        ]
+        result = {}
+        for row in await mongo_client["visitor_analytics"].aggregate(pipeline).to_list(None):
+            sex = row["_id"].get("sex")
+            result.setdefault(date.fromisoformat(row["_id"]["day"]), {})[sex if sex is not None else ""] = row["count"]
+        return result
+
+    return await get_day_segments(
+        redis_client, "visits_by_sex", segment_scope(sorted(device_ids)), start, end, compute, empty={}
+    )
+
+
 def max_month_days(date: datetime) -> int:
     if date.month in [1, 3, 5, 7, 8, 10, 12]:
         return 31
@@ -234,22 +271,9 @@ async def get_visits(
     tenant_entity_id: int = Query(None, description="Tenant Entity ID"),
     mongo_client=Depends(get_mongo_db),
     db: Session = Depends(get_pg_db),
+    redis_client=Depends(get_async_redis_connection),
     user=Security(get_tenant_entity_user),
 ):
-    def reformat_period_stats(stats: list) -> dict:
-        result = {}
-        for stat in stats:
-            if stat["_id"] == "male":
-                result["male"] = stat["count"]
-            elif stat["_id"] == "female":
-                result["female"] = stat["count"]
-            elif stat["_id"] == "undefined":
-                result["undefined"] = stat["count"]
-        for key in ["male", "female", "undefined"]:
-            if key not in result:
-                result[key] = 0
-        return result
-
     if tenant_entity_id:
         query = (
             db.query(SmartCamera)
@@ -276,47 +300,23 @@ async def get_visits(
     devices_id = [smart_camera.device_id for smart_camera in smart_cameras]
 
     try:
-        # Adjust the start_date and end_date to include the entire day
-        start_date = datetime(start_date.year, start_date.month, start_date.day)
-        end_date = datetime(end_date.year, end_date.month, end_date.day, 23, 59, 59)
-
-        match_criteria = {"capture_time": {"$gte": start_date, "$lte": end_date}}
-        if devices_id:
-            match_criteria["device_id"] = {"$in": devices_id}
-
-        current_period_pipeline = [
-            {
-                "$match": {"capture_time": {"$gte": start_date, "$lte": end_date}, "device_id": {"$in": devices_id}},
-            },
-            {"$group": {"_id": "$sex", "count": {"$sum": 1}}},
-        ]
-        current_period_stats = await mongo_client["visitor_analytics"].aggregate(current_period_pipeline).to_list(None)
-        current_total = sum(stat["count"] for stat in current_period_stats)
-
-        # Calculate stats for the previous period
-        previous_period_length = end_date - start_date
-        previous_start_date = start_date - previous_period_length
-        previous_end_date = start_date
+        # whole days of the requested period, compared with the same number of days right before it
+        start_day, end_day = start_date.date(), end_date.date()
+        previous_start_day = start_day - timedelta(days=(end_day - start_day).days + 1)
+        daily_counts = await get_daily_sex_counts(mongo_client, redis_client, devices_id, previous_start_day, end_day)
 
-        previous_period_pipeline = [
-            {
-                "$match": {
-                    "capture_time": {"$gte": previous_start_date, "$lt": previous_end_date},
-                    "device_id": {"$in": devices_id},
-                },
-            },
-            {"$group": {"_id": "$sex", "count": {"$sum": 1}}},
-        ]
-        previous_period_stats = (
-            await mongo_client["visitor_analytics"].aggregate(previous_period_pipeline).to_list(None)
-        )
-        previous_total = sum(stat["count"] for stat in previous_period_stats)
+        current_period_stats, previous_period_stats = Counter(), Counter()
+        for day, counts in daily_counts.items():
+            (current_period_stats if day >= start_day else previous_period_stats).update(counts)
+        current_total = sum(current_period_stats.values())
+        previous_total = sum(previous_period_stats.values())
 
         try:
             trend = round((current_total - previous_total) / previous_total * 100, 2)
         except ZeroDivisionError:
             trend = 0
-        return {"total": current_total, "trend": trend, "gender": reformat_period_stats(current_period_stats)}
+        gender = {key: current_period_stats.get(key, 0) for key in ["male", "female", "undefined"]}
+        return {"total": current_total, "trend": trend, "gender": gender}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e)) from e
 
@@ -328,6 +328,7 @@ async def get_monthly_daily_breakdown(
     tenant_entity_id: int = Query(None, description="Tenant Entity ID"),
     mongo_client=Depends(get_mongo_db),
     db: Session = Depends(get_pg_db),
+    redis_client=Depends(get_async_redis_connection),
     user=Security(get_tenant_entity_user),
 ):
     if tenant_entity_id:
@@ -356,22 +357,18 @@ async def get_monthly_daily_breakdown(
     devices_id = [smart_camera.device_id for smart_camera in smart_cameras]
 
     try:
-        pipeline = [
-            {"$match": {"capture_time": {"$gte": start_date, "$lt": end_date}, "device_id": {"$in": devices_id}}},
-            {"$project": {"day": {"$dayOfMonth": "$capture_time"}, "sex": {"$ifNull": ["$sex", "undefined"]}}},
-            {"$group": {"_id": {"day": "$day", "sex": "$sex"}, "count": {"$sum": 1}}},
-            {"$group": {"_id": "$_id.day", "counts": {"$push": {"sex": "$_id.sex", "count": "$count"}}}},
-            {"$sort": {"_id": 1}},
-        ]
-        results = await mongo_client["visitor_analytics"].aggregate(pipeline).to_list(None)
+        # end_date is exclusive
+        daily_counts = await get_daily_sex_counts(
+            mongo_client, redis_client, devices_id, start_date.date(), (end_date - timedelta(microseconds=1)).date()
+        )
 
-        # Transform results to required format
-        formatted_results = [
-            {"date": result["_id"], "counts": {count["sex"]: count["count"] for count in result["counts"]}}
-            for result in results
-        ]
+        counts_by_day_of_month = {}
+        for day, counts in daily_counts.items():
+            for sex, count in counts.items():
+                day_counts = counts_by_day_of_month.setdefault(day.day, {})
+                day_counts[sex or "undefined"] = day_counts.get(sex or "undefined", 0) + count
 
-        return formatted_results
+        return [{"date": day, "counts": counts_by_day_of_month[day]} for day in sorted(counts_by_day_of_month)]
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e)) from e
 
@@ -382,6 +379,7 @@ async def get_today_hourly_visits(
     tenant_entity_id: int = Query(None, description="Tenant Entity ID"),
     mongo_client=Depends(get_mongo_db),
     db: Session = Depends(get_pg_db),
+    redis_client=Depends(get_async_redis_connection),
     user=Security(get_tenant_entity_user),
 ):
     if tenant_entity_id:
@@ -424,7 +422,13 @@ async def get_today_hourly_visits(
             {"$group": {"_id": "$hour", "count": {"$sum": 1}}},
             {"$sort": {"_id": 1}},
         ]
-        results = await mongo_client["visitor_analytics"].aggregate(pipeline).to_list(None)
+        results = await get_day_segment_async(
+            redis_client,
+            "visits_by_hour",
+            segment_scope(sorted(device_ids)),
+            start_of_today.date(),
+            lambda: mongo_client["visitor_analytics"].aggregate(pipeline).to_list(None),
+        )
 
         # Format the results to fill in any missing hours with zero visitors
         hourly_counts = {result["_id"]: result["count"] for result in results}
@@ -441,6 +445,7 @@ async def get_age_gender_breakdown(
     tenant_entity_id: int = Query(None, description="Tenant Entity ID"),
     mongo_client=Depends(get_mongo_db),
     db: Session = Depends(get_pg_db),
+    redis_client=Depends(get_async_redis_connection),
     user=Security(get_tenant_entity_user),
 ):
     if tenant_entity_id:
@@ -487,7 +492,13 @@ async def get_age_gender_breakdown(
             },
             {"$sort": {"_id": 1}},
         ]
-        results = await mongo_client["visitor_analytics"].aggregate(pipeline).to_list(None)
+        results = await get_day_segment_async(
+            redis_client,
+            "visits_by_age_gender",
+            segment_scope(sorted(device_ids), date.time()),
+            date.date(),
+            lambda: mongo_client["visitor_analytics"].aggregate(pipeline).to_list(None),
+        )
 
         # Define the boundaries for formatting age groups
         age_boundaries = [0, 15, 20, 25, 30, 35, 40, 45, 50, 55]
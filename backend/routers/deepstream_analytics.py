@@ -6,7 +6,6 @@ from datetime import date, datetime, time, timedelta
 from typing import Literal
 
 from fastapi import APIRouter, Depends, HTTPException, Request, Security, WebSocket, WebSocketDisconnect, status
-from minio.error import S3Error
 from motor.motor_asyncio import AsyncIOMotorDatabase
 from sqlalchemy.orm import Session
 
@@ -17,13 +16,13 @@ from database.minio_client import get_minio_client
 from models import Camera, Identity, JetsonDevice, Line, Roi, RoiLabel
 from schemas.nvdsanalytics import RawRoiAnalytics
 from config import MINIO_PROTOCOL, MINIO_HOST
+from services.analytics_bus import listen_notifications, publish_notification
+from utils.redis_cache import get_async_redis_connection, get_redis_connection
 
 BUCKET_NAME = "deepstream-analytics"
 
 router = APIRouter(prefix="/deepstream_analytics", tags=["deepstream_analytics"])
 
-analytics_exchange = []
-
 
 @router.post("/analytics_receiver", include_in_schema=False)
 def event_consumer_analytics_receiver(
@@ -31,6 +30,7 @@ def event_consumer_analytics_receiver(
     analytics: RawRoiAnalytics,
     db: Session = Depends(get_pg_db),
     minio_client=Depends(get_minio_client),
+    redis_client=Depends(get_redis_connection),
 ):
     current_roi = nvdsanalytics.get_roi(db=db, pk=analytics.roi_id)
 
@@ -88,7 +88,8 @@ def event_consumer_analytics_receiver(
                             content_type="image/png",
                         )
 
-                    analytics_exchange.append(
+                    publish_notification(
+                        redis_client,
                         {
                             "report_id": analytics.report_id,
                             "notification_type": "safe-zone",
@@ -96,7 +97,7 @@ def event_consumer_analytics_receiver(
                             "timestamp": analytics.timestamp,
                             "jetson_device_id": analytics.jetson_device_id,
                             "camera_name": current_camera_name,
-                        }
+                        },
                     )
             elif each_lable.label_title == "overcrowd-detection":
                 if analytics.frame_image:
@@ -116,7 +117,8 @@ def event_consumer_analytics_receiver(
                     )
 
                 if analytics.number_of_people > current_roi.people_count_threshold:
-                    analytics_exchange.append(
+                    publish_notification(
+                        redis_client,
                         {
                             "report_id": analytics.report_id,
                             "notification_type": "overcrowd-detection",
@@ -124,42 +126,40 @@ def event_consumer_analytics_receiver(
                             "timestamp": analytics.timestamp,
                             "jetson_device_id": analytics.jetson_device_id,
                             "camera_name": current_camera_name,
-                        }
+                        },
                     )
 
 
-def handle_notification_messages(jetson_device_id: str):
-    for index, each_exchange in enumerate(analytics_exchange):
-        if each_exchange["jetson_device_id"] == jetson_device_id:
-            analytics_exchange.pop(index)
-            return each_exchange
+async def forward_notifications(websocket: WebSocket, redis_client, jetson_device_id: str):
+    async for current_notification in listen_notifications(redis_client, jetson_device_id):
+        current_notification["frame_image"] = (
+            f"{MINIO_PROTOCOL}://{MINIO_HOST}/{BUCKET_NAME}/{current_notification['report_id']}.jpg"
+        )
+        await websocket.send_json(current_notification)
 
-    return None
+
+async def wait_disconnect(websocket: WebSocket):
+    while (await websocket.receive())["type"] != "websocket.disconnect":
+        pass
 
 
 @router.websocket("/notification_center/{jetson_device_id}")
-async def websocket_endpoint(jetson_device_id: str, websocket: WebSocket, minio_client=Depends(get_minio_client)):
+async def websocket_endpoint(jetson_device_id: str, websocket: WebSocket):
     await websocket.accept()
+    redis_client = get_async_redis_connection()
+    # the stream reader only notices a closed client when it writes to it, so the socket is watched alongside it
+    forwarder = asyncio.create_task(forward_notifications(websocket, redis_client, jetson_device_id))
+    watcher = asyncio.create_task(wait_disconnect(websocket))
     try:
-        while True:
-            current_notification = handle_notification_messages(jetson_device_id)
-
-            if current_notification:
-                try:
-                    current_frame_image = (
-                        f"{MINIO_PROTOCOL}://{MINIO_HOST}/{BUCKET_NAME}/{current_notification['report_id']}.jpg"
-                    )
-                    current_notification["frame_image"] = current_frame_image
-                except S3Error:
-                    current_notification["frame_image"] = None
-                await websocket.send_json(current_notification)
-
-            await asyncio.sleep(10)
-
-    except WebSocketDisconnect:
-        pass
-    except Exception as e:
-        print(f"notification_center, websocket error: {e}")
+        done, _ = await asyncio.wait({forwarder, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if not task.cancelled() and task.exception() and not isinstance(task.exception(), WebSocketDisconnect):
+                print(f"notification_center, websocket error: {task.exception()}")
+    finally:
+        forwarder.cancel()
+        watcher.cancel()
+        await asyncio.gather(forwarder, watcher, return_exceptions=True)
+        await redis_client.aclose()
 
 
 @router.get("/line_crossing/daily_report")
@@ -9,6 +9,7 @@ from typing import List, Literal, Optional
 
 import requests
 from fastapi import APIRouter, Depends, Header, HTTPException, Query, Security, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi_pagination.ext.sqlalchemy import paginate
 from pydantic import BaseModel
 from sqlalchemy import and_
@@ -59,7 +60,7 @@ from tasks import (
     add_identity_to_camera,
     delete_identity_from_smart_camera,
 )
-from utils.image_processing import MINIO_HOST3, get_image_from_query, is_image_url, make_minio_url_from_image
+from utils.image_processing import MINIO_HOST3, is_image_url, make_minio_urls_from_images, remove_minio_urls
 from utils.kindergarten import BASIC_AUTH
 from utils.log import timeit
 from utils.pagination import CustomPage
@@ -69,6 +70,9 @@ notification_service_one_system = FirebaseNotificationService(cert_one_system)
 router = APIRouter(prefix="/identity", tags=["identity"])
 
 IDENTITY_BUCKET = os.getenv("MINIO_BUCKET_IDENTITY", "identity")
+IDENTITY_PHOTO_FIELDS = ("photo", "left_side_photo", "right_side_photo", "top_side_photo")
+# crops come from the client pipeline and are stored as they are
+IDENTITY_CROP_FIELDS = ("cropped_image", "cropped_image512", "i_cropped_image512")
 
 NODAVLAT_BASE_URL = os.getenv("NODAVLAT_BASE_URL")
 
@@ -590,66 +594,26 @@ async def create_identity(
     minio_ssd_client=Depends(get_minio_ssd_client),
 ):
     recieved_photo_url = data.photo if is_image_url(data.photo) else None
-    main_image = get_image_from_query(data.photo)
-    main_photo_url = make_minio_url_from_image(
-        minio_ssd_client, main_image, IDENTITY_BUCKET, data.pinfl, minio_host=MINIO_HOST3
+    # the main photo is required, get_image_from_query rejects a missing one
+    photos = {"photo": data.photo}
+    photos.update({name: getattr(data, name) for name in IDENTITY_PHOTO_FIELDS[1:] if getattr(data, name)})
+    photos.update({name: getattr(data, name) for name in IDENTITY_CROP_FIELDS if getattr(data, name)})
+    photo_urls = await run_in_threadpool(
+        make_minio_urls_from_images,
+        minio_ssd_client,
+        photos,
+        IDENTITY_BUCKET,
+        data.pinfl,
+        unchecked=IDENTITY_CROP_FIELDS,
+        minio_host=MINIO_HOST3,
     )
-    data.photo = main_photo_url
-    if data.left_side_photo:
-        left_image = get_image_from_query(data.left_side_photo)
-        left_photo_url = make_minio_url_from_image(
-            minio_ssd_client, left_image, IDENTITY_BUCKET, data.pinfl, minio_host=MINIO_HOST3
-        )
-        data.left_side_photo = left_photo_url
-    if data.right_side_photo:
-        right_image = get_image_from_query(data.right_side_photo)
-        right_photo_url = make_minio_url_from_image(
-            minio_ssd_client, right_image, IDENTITY_BUCKET, data.pinfl, minio_host=MINIO_HOST3
-        )
-        data.right_side_photo = right_photo_url
-    if data.top_side_photo:
-        top_image = get_image_from_query(data.top_side_photo)
-        top_photo_url = make_minio_url_from_image(
-            minio_ssd_client, top_image, IDENTITY_BUCKET, data.pinfl, minio_host=MINIO_HOST3
-        )
-        data.top_side_photo = top_photo_url
-    if data.cropped_image:
-        cropped_image = get_image_from_query(data.cropped_image)
-        cropped_photo_url = make_minio_url_from_image(
-            minio_ssd_client,
-            cropped_image,
-            IDENTITY_BUCKET,
-            data.pinfl,
-            is_check_hd=False,
-            is_check_size=False,
-            minio_host=MINIO_HOST3,
-        )
-        data.cropped_image = cropped_photo_url
-    if data.cropped_image512:
-        cropped_image512 = get_image_from_query(data.cropped_image512)
-        cropped_photo512_url = make_minio_url_from_image(
-            minio_ssd_client,
-            cropped_image512,
-            IDENTITY_BUCKET,
-            data.pinfl,
-            is_check_hd=False,
-            is_check_size=False,
-            minio_host=MINIO_HOST3,
-        )
-        data.cropped_image512 = cropped_photo512_url
-    if data.i_cropped_image512:
-        i_cropped_image512 = get_image_from_query(data.i_cropped_image512)
-        i_cropped_photo512_url = make_minio_url_from_image(
-            minio_ssd_client,
-            i_cropped_image512,
-            IDENTITY_BUCKET,
-            data.pinfl,
-            is_check_hd=False,
-            is_check_size=False,
-            minio_host=MINIO_HOST3,
-        )
-        data.i_cropped_image512 = i_cropped_photo512_url
-    identity = db_identity.create_identity(db, tenant_admin.tenant_id, data, recieved_photo_url)
+    for name, url in photo_urls.items():
+        setattr(data, name, url)
+    try:
+        identity = db_identity.create_identity(db, tenant_admin.tenant_id, data, recieved_photo_url)
+    except Exception:
+        remove_minio_urls(minio_ssd_client, photo_urls.values())
+        raise
     smart_camera_ids = (
         db.query(SmartCamera.id).filter_by(tenant_entity_id=identity.tenant_entity_id, is_active=True).all()
     )
@@ -753,73 +717,33 @@ async def update_identity(
     identity = db.query(Identity).filter_by(id=pk, tenant_id=tenant_admin.tenant_id).first()
     if not identity:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Identity not found")
-    if identity.recieved_photo_url != data.photo:
-        main_image = get_image_from_query(data.photo)
-        main_photo_url = make_minio_url_from_image(
-            minio_ssd_client, main_image, IDENTITY_BUCKET, data.pinfl, minio_host=MINIO_HOST3
-        )
-        data.photo = main_photo_url
-    if data.left_side_photo and identity.left_side_photo != data.left_side_photo:
-        left_image = get_image_from_query(data.left_side_photo)
-        left_photo_url = make_minio_url_from_image(
-            minio_ssd_client, left_image, IDENTITY_BUCKET, data.pinfl, minio_host=MINIO_HOST3
-        )
-        data.left_side_photo = left_photo_url
-    if data.right_side_photo and identity.right_side_photo != data.right_side_photo:
-        right_image = get_image_from_query(data.right_side_photo)
-        right_photo_url = make_minio_url_from_image(
-            minio_ssd_client, right_image, IDENTITY_BUCKET, data.pinfl, minio_host=MINIO_HOST3
-        )
-        data.right_side_photo = right_photo_url
-    if data.top_side_photo and identity.top_side_photo != data.top_side_photo:
-        top_image = get_image_from_query(data.top_side_photo)
-        top_photo_url = make_minio_url_from_image(
-            minio_ssd_client, top_image, IDENTITY_BUCKET, data.pinfl, minio_host=MINIO_HOST3
-        )
-        data.top_side_photo = top_photo_url
-    if data.cropped_image:
-        cropped_image = get_image_from_query(data.cropped_image)
-        cropped_photo_url = make_minio_url_from_image(
-            minio_ssd_client,
-            cropped_image,
-            IDENTITY_BUCKET,
-            data.pinfl,
-            is_check_hd=False,
-            is_check_size=False,
-            minio_host=MINIO_HOST3,
-        )
-        data.cropped_image = cropped_photo_url
-    if data.cropped_image512:
-        cropped_image512 = get_image_from_query(data.cropped_image512)
-        cropped_photo512_url = make_minio_url_from_image(
-            minio_ssd_client,
-            cropped_image512,
-            IDENTITY_BUCKET,
-            data.pinfl,
-            is_check_hd=False,
-            is_check_size=False,
-            minio_host=MINIO_HOST3,
-        )
-        data.cropped_image512 = cropped_photo512_url
-    if data.i_cropped_image512:
-        i_cropped_image512 = get_image_from_query(data.i_cropped_image512)
-        i_cropped_photo512_url = make_minio_url_from_image(
-            minio_ssd_client,
-            i_cropped_image512,
-            IDENTITY_BUCKET,
-            data.pinfl,
-            is_check_hd=False,
-            is_check_size=False,
-            minio_host=MINIO_HOST3,
-        )
-        data.i_cropped_image512 = i_cropped_photo512_url
+    photos = {"photo": data.photo} if identity.recieved_photo_url != data.photo else {}
+    for name in IDENTITY_PHOTO_FIELDS[1:]:
+        if getattr(data, name) and getattr(identity, name) != getattr(data, name):
+            photos[name] = getattr(data, name)
+    photos.update({name: getattr(data, name) for name in IDENTITY_CROP_FIELDS if getattr(data, name)})
+    photo_urls = await run_in_threadpool(
+        make_minio_urls_from_images,
+        minio_ssd_client,
+        photos,
+        IDENTITY_BUCKET,
+        data.pinfl,
+        unchecked=IDENTITY_CROP_FIELDS,
+        minio_host=MINIO_HOST3,
+    )
+    for name, url in photo_urls.items():
+        setattr(data, name, url)
 
     identity_scamera = db.query(ErrorSmartCamera).filter_by(identity_id=pk, is_active=True).all()
     if identity_scamera:
         for error in identity_scamera:
             db.delete(error)
         db.commit()
-    identity = db_identity.update_identity(db, tenant_admin.tenant_id, pk, data)
+    try:
+        identity = db_identity.update_identity(db, tenant_admin.tenant_id, pk, data)
+    except Exception:
+        remove_minio_urls(minio_ssd_client, photo_urls.values())
+        raise
 
     smart_camera_ids = (
         db.query(SmartCamera.id).filter_by(tenant_entity_id=identity.tenant_entity_id, is_active=True).all()
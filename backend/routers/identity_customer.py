@@ -31,13 +31,11 @@ from auth.oauth2 import get_entity_user_for_attendance_2, get_tenant_entity_user
 from config import NODAVLAT_BOGCHA_BASE_URL
 from database import db_identity
 from database.database import get_pg_db
-from database.db_attestation import get_attestation, get_attestation2
 from database.db_identity import delete_extra_attendances, get_package_by_uuid
 from database.db_smartcamera import create_task_to_scamera
 from database.hash import verify_api_signature
 from database.minio_client import get_minio_client, get_minio_ssd_client
 from models import (
-    AllowedEntity,
     Attendance,
     AttendanceAntiSpoofing,
     ErrorSmartCamera,
@@ -83,16 +81,45 @@ from schemas.identity import (
     SimpleResponse,
 )
 from schemas.kindergarten import ExtraAttendanceCreate
+from services.attendance_ingest import StagedTasks, save_attendance
+from services.attendance_reference import (
+    get_allowed_entity_ids,
+    get_attestation_id,
+    get_identity_ref,
+    get_package_ref,
+    get_tenant_entity_ref,
+)
+from tasks import app as celery_app
 from tasks import send_express_attendance_batch, spoofing_check_task
 from utils import kindergarten
 from utils.generator import extract_attestation, extract_jwt_token
 from utils.image_processing import get_image_from_query, is_image_url, make_minio_url_from_image
 from utils.kindergarten import BASIC_AUTH
 from utils.pagination import CustomPage
-from utils.redis_cache import get_from_redis, get_redis_connection, set_to_redis
+from utils.redis_cache import entity_tag, invalidate_on_write
+from utils.response_cache import cached_response
 
 logger = logging.getLogger(__name__)
 
+invalidate_on_write(Identity, "identities")
+invalidate_on_write(Attendance, "attendances")
+
+
+def entity_scope(kwargs: dict):
+    return kwargs["user"].tenant_entity_id
+
+
+def identity_tags(kwargs: dict):
+    return [entity_tag("identities", kwargs["user"].tenant_entity_id)]
+
+
+def attendance_tags(kwargs: dict):
+    return [entity_tag("attendances", kwargs["user"].tenant_entity_id)]
+
+
+def use_cache_enabled(kwargs: dict) -> bool:
+    return kwargs["use_cache"]
+
 router = APIRouter(prefix="/identity", tags=["identity"])
 mobile_router = APIRouter(prefix="/identity", tags=["Mobile"])
 
@@ -628,18 +655,19 @@ def get_identities(
 
 
 @mobile_router.get("/all", response_model=List[IdentitySelect], description="Get all without pagination")
+@cached_response(
+    "identity:no_pagination",
+    List[IdentitySelect],
+    expire=1800,
+    scope=entity_scope,
+    tags=identity_tags,
+    enabled=use_cache_enabled,
+)
 def get_identities_without_pagination(
     use_cache: bool = False,
     db: Session = Depends(get_pg_db),
     user=Security(get_tenant_entity_user_2),
-    redis_client=Depends(get_redis_connection),
 ):
-    cache_key = f"identity:{user.tenant_entity_id}:no_pagination"
-    if use_cache:
-        cached_data = get_from_redis(redis_client, cache_key)
-        if cached_data:
-            return cached_data
-
     kids = (
         db.query(Identity)
         .options(selectinload(Identity.extra_attendances))
@@ -672,27 +700,23 @@ def get_identities_without_pagination(
 
                 staff_model.passport_verification_result = verification_result
 
-    result = staffs_result + kids_result
-
-    if use_cache:
-        set_to_redis(redis_client, cache_key, result)
-
-    return result
+    return staffs_result + kids_result
 
 
 @mobile_router.get("/all_with_photos", response_model=List[IdentitySelectWithPhotos])
+@cached_response(
+    "identity:no_pagination:with_photos",
+    List[IdentitySelectWithPhotos],
+    expire=1800,
+    scope=entity_scope,
+    tags=identity_tags,
+    enabled=use_cache_enabled,
+)
 def get_identities_without_pagination_with_photos(
     use_cache: bool = False,
     db: Session = Depends(get_pg_db),
     user=Security(get_tenant_entity_user_2),
-    redis_client=Depends(get_redis_connection),
 ):
-    cache_key = f"identity:{user.tenant_entity_id}:no_pagination"
-    if use_cache:
-        cached_data = get_from_redis(redis_client, cache_key)
-        if cached_data:
-            return cached_data
-
     kids_query = (
         db.query(Identity)
         .options(selectinload(Identity.extra_attendances), selectinload(Identity.photos))
@@ -727,12 +751,7 @@ def get_identities_without_pagination_with_photos(
 
                 staff_model.passport_verification_result = verification_result
 
-    result = staffs_result + kids_result
-
-    if use_cache:
-        set_to_redis(redis_client, cache_key, result)
-
-    return result
+    return staffs_result + kids_result
 
 
 @router.get("/by_pinfl", response_model=IdentityInDB)
@@ -910,16 +929,9 @@ async def create_identity_attendance(
     payload = extract_jwt_token(access_token)
     attestation_unique_id = payload.get("attestation_id", None)
     token_id = payload.get("token_id")
-    if token_id:
-        attestation = get_attestation2(db, user.id, token_id)
-    else:
-        attestation = get_attestation(db, user.id, access_token, attestation_unique_id)
+    attestation_id = get_attestation_id(db, user.id, token_id, access_token, attestation_unique_id)
 
-    tenant_entity = (
-        db.query(TenantEntity.id, TenantEntity.external_id, TenantEntity.spoofing_threshold, TenantEntity.signature_key)
-        .filter_by(id=user.tenant_entity_id, is_active=True)
-        .first()
-    )
+    tenant_entity = get_tenant_entity_ref(db, user.tenant_entity_id)
     if not tenant_entity:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Tenant entity not found.")
     is_valid = False
@@ -938,15 +950,18 @@ async def create_identity_attendance(
                 logger.info("Signature successfully verified.")
         except UnicodeDecodeError:
             logger.warning("Payload is not valid UTF-8.")
-    identity = (
-        db.query(Identity).filter_by(id=attendance_data.identity_id, tenant_entity_id=user.tenant_entity_id).first()
-    )
-    mismatch_entity = False
+    identity = get_identity_ref(db, attendance_data.identity_id)
     if not identity:
-        identity = db.query(Identity).filter_by(id=attendance_data.identity_id).first()
-        if not identity:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Identity not found")
-        mismatch_entity = True
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Identity not found")
+    mismatch_entity = identity.tenant_entity_id != user.tenant_entity_id
+    idempotency_key = f"{attendance_data.package_id}:{identity.id}" if attendance_data.package_id else None
+    if idempotency_key:
+        # the capture time is part of the unique key, it confines the lookup to one attendance partition
+        existing_attendance = (
+            db.query(Attendance).filter_by(idempotency_key=idempotency_key, attendance_datetime=capture_time).first()
+        )
+        if existing_attendance:
+            return existing_attendance
     image_url = None
     file_name = f"{attendance_data.identity_id}/{uuid.uuid4()}.jpg"
     if attendance_data.image != "":
@@ -967,14 +982,12 @@ async def create_identity_attendance(
                 status_code=status.HTTP_400_BAD_REQUEST, detail=f"Image is not valid to upload minio, error: {e}"
             ) from e
         image_url = f"{MINIO_PROTOCOL}://{MINIO_HOST3}/{BUCKET_IDENTITY_ATTENDANCE}/{file_name}"
-    package = db.query(Package).filter_by(uuid=attendance_data.package_id, is_active=True).first()
-    allowed_mtts = db.query(AllowedEntity).filter_by(is_active=True).all()
-    allowed_entity_ids = [item.tenant_entity_id for item in allowed_mtts] if allowed_mtts else []
+    package = get_package_ref(db, attendance_data.package_id) if attendance_data.package_id else None
     if (
         package
         and user.tenant_id == 18
         and package.appLicensingVerdict == "UNEVALUATED"
-        and tenant_entity.id not in allowed_entity_ids
+        and tenant_entity.id not in get_allowed_entity_ids(db)
     ):
         raise HTTPException(
             status_code=status.HTTP_451_UNAVAILABLE_FOR_LEGAL_REASONS, detail="Not licensed application."
@@ -1002,89 +1015,87 @@ async def create_identity_attendance(
         "bucket_name": BUCKET_IDENTITY_ATTENDANCE if image_url else None,
         "object_name": file_name if image_url else None,
         "position_id": attendance_data.position_id,
-        "attestation_id": attestation.id if attestation else None,
+        "attestation_id": attestation_id,
         "package_id": package.id if package else None,
         "package_uuid": attendance_data.package_id,
         "mismatch_entity": mismatch_entity,
         "token_id": token_id,
         "username": user.email,
         "app_source": app_source,
+        "idempotency_key": idempotency_key,
     }
     identity_attendance = Attendance(**data)
-    db.add(identity_attendance)
-    db.commit()
-    db.refresh(identity_attendance)
-
-    if identity.is_active is False or image_url is None or mismatch_entity:
-        return identity_attendance
-    package_verified = False
-    if package:  # noqa
-        if package.appLicensingVerdict == "LICENSED" and package.appRecognitionVerdict == "PLAY_RECOGNIZED":  # noqa
-            package_verified = True
-    express_data = {
-        "identity_id": int(str(identity.external_id)),
-        "identity_group": identity.identity_group,
-        "mtt_id": tenant_entity.external_id,
-        "group_id": identity.group_id,
-        "created_at": capture_time.strftime("%Y-%m-%dT%H:%M:%S"),
-        "attendance_id": identity_attendance.id,
-        "position_id": identity_attendance.position_id,
-        "lat": float(identity_attendance.lat) or 0.0,
-        "lon": float(identity_attendance.lon) or 0.0,
-        "app_version": app_version_name,
-        "device_model": device_model,
-        "device_ip": device_ip,
-        "is_spoofed": None,
-        "spoofing_score": None,
-        "spoofing_bucket": BUCKET_IDENTITY_ATTENDANCE,
-        "spoofing_object_name": file_name,
-        "tenant_id": identity.tenant_id,
-        "image_url": image_url,
-        "package_uuid": identity_attendance.package_uuid,
-        "version": identity_attendance.version,
-        "package_verified": package_verified,
-        "username": user.email,
-    }
-    send_express_attendance_batch.delay(data=express_data)
 
-    attendance_spoofing = AttendanceAntiSpoofing(attendance_id=identity_attendance.id)
-    db.add(attendance_spoofing)
-    db.commit()
-    db.refresh(attendance_spoofing)
-
-    spoofing_task_data = {
-        "bucket": BUCKET_IDENTITY_ATTENDANCE,
-        "object_name": file_name,
-        "lat": attendance_data.lat,
-        "lon": attendance_data.lon,
-        "app_version_name": app_version_name,
-        "device_model": device_model,
-        "device_ip": device_ip,
-        "identity_id": identity.id,
-        "kid_id": identity.external_id,
-        "mtt_id": tenant_entity.external_id,
-        "created_at": capture_time.strftime("%Y-%m-%dT%H:%M:%S"),
-        "attendance_spoofing_id": attendance_spoofing.id,
-        "spoofing_threshold": tenant_entity.spoofing_threshold,
-        "package_verified": package_verified,
-    }
+    def stage_tasks(attendance: Attendance) -> StagedTasks:
+        # attendance, its spoofing row and the follow-up tasks are committed together; tasks go out only after commit
+        if identity.is_active is False or image_url is None or mismatch_entity:
+            return []
+        package_verified = False
+        if package:  # noqa
+            if package.appLicensingVerdict == "LICENSED" and package.appRecognitionVerdict == "PLAY_RECOGNIZED":  # noqa
+                package_verified = True
+        express_data = {
+            "identity_id": int(str(identity.external_id)),
+            "identity_group": identity.identity_group,
+            "mtt_id": tenant_entity.external_id,
+            "group_id": identity.group_id,
+            "created_at": capture_time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "attendance_id": attendance.id,
+            "position_id": attendance.position_id,
+            "lat": float(attendance.lat) or 0.0,
+            "lon": float(attendance.lon) or 0.0,
+            "app_version": app_version_name,
+            "device_model": device_model,
+            "device_ip": device_ip,
+            "is_spoofed": None,
+            "spoofing_score": None,
+            "spoofing_bucket": BUCKET_IDENTITY_ATTENDANCE,
+            "spoofing_object_name": file_name,
+            "tenant_id": identity.tenant_id,
+            "image_url": image_url,
+            "package_uuid": attendance.package_uuid,
+            "version": attendance.version,
+            "package_verified": package_verified,
+            "username": user.email,
+        }
+
+        attendance_spoofing = AttendanceAntiSpoofing(attendance_id=attendance.id)
+        db.add(attendance_spoofing)
+        db.flush()
+
+        spoofing_task_data = {
+            "bucket": BUCKET_IDENTITY_ATTENDANCE,
+            "object_name": file_name,
+            "lat": attendance_data.lat,
+            "lon": attendance_data.lon,
+            "app_version_name": app_version_name,
+            "device_model": device_model,
+            "device_ip": device_ip,
+            "identity_id": identity.id,
+            "kid_id": identity.external_id,
+            "mtt_id": tenant_entity.external_id,
+            "created_at": capture_time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "attendance_spoofing_id": attendance_spoofing.id,
+            "spoofing_threshold": tenant_entity.spoofing_threshold,
+            "package_verified": package_verified,
+        }
+        return [
+            (send_express_attendance_batch.name, express_data),
+            (spoofing_check_task.name, spoofing_task_data),
+        ]
 
-    spoofing_check_task.delay(data=spoofing_task_data)
-    return identity_attendance
+    return save_attendance(db, identity_attendance, stage_tasks, celery_app, minio_ssd_client)
 
 
 @mobile_router.get("/attendance", response_model=List[AttendanceInDB])
+@cached_response(
+    "attendance:all", List[AttendanceInDB], scope=entity_scope, tags=attendance_tags, enabled=use_cache_enabled
+)
 def get_attendances_without_pagination(
     use_cache: bool = False,
     db: Session = Depends(get_pg_db),
     user=Security(get_tenant_entity_user_2),
-    redis_client=Depends(get_redis_connection),
 ):
-    cache_key = f"attendance:{user.tenant_entity_id}:all"
-    if use_cache:
-        cached_data = get_from_redis(redis_client, cache_key)
-        if cached_data:
-            return cached_data
     mobile_attendance = (
         db.query(Attendance)
         .options(joinedload(Attendance.identity))
@@ -1125,25 +1136,19 @@ def get_attendances_without_pagination(
     )
 
     result = mobile_attendance + smart_camera_attendance
-    result = [AttendanceInDB.from_orm(attendance).dict() for attendance in result]
-    if use_cache:
-        set_to_redis(redis_client, cache_key, result, expire=300)
-    return result
+    return [AttendanceInDB.from_orm(attendance).dict() for attendance in result]
 
 
 @mobile_router.get("/attendance/by_day", response_model=List[AttendanceInDB])
+@cached_response(
+    "attendance:by_day", List[AttendanceInDB], scope=entity_scope, tags=attendance_tags, enabled=use_cache_enabled
+)
 def get_attendance_by_day(
     date: datetime = Query(..., description="Date in YYYY-MM-DD format"),
     use_cache: bool = False,
     db: Session = Depends(get_pg_db),
     user=Security(get_tenant_entity_user_2),
-    redis_client=Depends(get_redis_connection),
 ):
-    cache_key = f"attendance:{user.tenant_entity_id}:{date.strftime('%Y-%m-%d')}"
-    if use_cache:
-        cached_data = get_from_redis(redis_client, cache_key)
-        if cached_data:
-            return cached_data
     start_date, end_date = date, date + timedelta(days=1)
     mobile_attendance = (
         db.query(Attendance)
@@ -1198,10 +1203,7 @@ def get_attendance_by_day(
     )
 
     result = mobile_attendance + smart_camera_attendance
-    result = [AttendanceInDB.from_orm(attendance).dict() for attendance in result]
-    if use_cache:
-        set_to_redis(redis_client, cache_key, result, expire=300)
-    return result
+    return [AttendanceInDB.from_orm(attendance).dict() for attendance in result]
 
 
 @mobile_router.get("/attendance/{attendance_id}", response_model=AttendanceDetails)
@@ -1331,21 +1333,14 @@ def get_parent_attendance_real_time(limit: int, user=Security(get_tenant_entity_
 
 
 @mobile_router.get("/parent/attendance", response_model=List[ParentAttendanceScheme])
+@cached_response("pattendance", List[ParentAttendanceScheme], expire=600, scope=entity_scope)
 def get_parent_attendance(
     date: datetime = Query(..., description="Date in YYYY-MM-DD format"),
     limit: Optional[int] = None,
     db: Session = Depends(get_pg_db),
     user=Security(get_tenant_entity_user_2),
-    redis_client=Depends(get_redis_connection),
 ):
     date = date if date else datetime.today()
-    if limit:
-        cache_key = f"pattendance:{user.tenant_entity_id}:{date.strftime('%Y-%m-%d')}:{limit}"
-    else:
-        cache_key = f"pattendance:{user.tenant_entity_id}:{date.strftime('%Y-%m-%d')}:all"
-    cache_data = get_from_redis(redis_client, cache_key)
-    if cache_data:
-        return cache_data
     start_datetime = datetime.combine(date.date(), datetime.min.time())
     end_datetime = datetime.combine(date.date(), datetime.max.time())
 
@@ -1418,9 +1413,7 @@ def get_parent_attendance(
 
             parent_attendance_schemes.append(parent_attendance_scheme)
 
-    result = [ParentAttendanceScheme.from_orm(attendance).dict() for attendance in parent_attendance_schemes]
-    set_to_redis(redis_client, cache_key, result, expire=600)
-    return result
+    return [ParentAttendanceScheme.from_orm(attendance).dict() for attendance in parent_attendance_schemes]
 
 
 @mobile_router.post("/employee/extra_attendance")
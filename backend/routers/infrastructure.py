@@ -17,7 +17,7 @@ from jinja2 import Environment, FileSystemLoader
 from pymongo import ASCENDING
 from requests import Response
 from sqlalchemy import and_, distinct, func
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, defer, joinedload
 
 from auth.oauth2 import get_current_tenant_admin, is_authenticated
 from database import (
@@ -76,6 +76,8 @@ from schemas.infrastructure import (
 )
 from schemas.tenant import FirmwareInDB, SmartCameraProfileInDB
 from schemas.visitor import VisitorAttendanceInDB
+from services.device_inventory import get_active_devices
+from services.poll_analytics import POLL_BUCKET_COLLECTION
 from utils.generator import generate_md5, generate_password
 from utils.image_processing import get_image_from_url, get_main_error_text
 from utils.log import timeit
@@ -463,12 +465,9 @@ def get_health_smart_camera_lists(
     tenant_id: int,
     db: Session = Depends(get_pg_db),
     security_admin=Security(is_authenticated),
+    redis_client=Depends(get_redis_connection),
 ):
-    url = "https://scamera.realsoft.ai/devices/getAllActiveDevices"
-    response = requests.get(url)
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code, detail=response.text)
-    all_active_devices: list = response.json()["devices"]
+    all_active_devices, _ = get_active_devices(redis_client)
     devices = db_smartcamera.get_smart_cameras_for_health(db, tenant_id)
     result = []
     for device in devices:
@@ -484,29 +483,31 @@ def get_not_created_smart_cameras(
     tenant_admin=Security(get_current_tenant_admin),
     redis_client=Depends(get_redis_connection),
 ):
-    connected_smart_cameras = get_from_redis(redis_client, "connected_scameras")
-    url = "https://scamera.realsoft.ai/devices/getAllActiveDevices"
-    response = requests.get(url)
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code, detail=response.text)
-    all_active_devices: list = response.json()["devices"]
+    connected_smart_cameras = get_from_redis(redis_client, "connected_scameras") or {}
+    all_active_devices, _ = get_active_devices(redis_client)
+    candidates = [device_id for device_id in all_active_devices if device_id in connected_smart_cameras]
+    if not candidates:
+        return []
+    created = {
+        device_id
+        for (device_id,) in db.query(SmartCamera.device_id).filter(
+            SmartCamera.device_id.in_(candidates), SmartCamera.is_active.is_(True)
+        )
+    }
     result = []
-    for active_device_id in all_active_devices:
-        if active_device_id in connected_smart_cameras:
-            camera_in_db = db.query(SmartCamera).filter_by(device_id=active_device_id, is_active=True).first()
-            if not camera_in_db:
-                found_camera = connected_smart_cameras[active_device_id]
-                result.append(
-                    {
-                        "device_id": active_device_id,
-                        "device_mac": found_camera["device_mac"],
-                        "lib_platform_version": found_camera["lib_platform_version"],
-                        "software_version": found_camera["software_version"],
-                        "lib_ai_version": found_camera["lib_ai_version"],
-                        "device_ip": found_camera["device_ip"],
-                        "device_name": found_camera["device_name"],
-                    }
-                )
+    for active_device_id in sorted(set(candidates) - created):
+        found_camera = connected_smart_cameras[active_device_id]
+        result.append(
+            {
+                "device_id": active_device_id,
+                "device_mac": found_camera["device_mac"],
+                "lib_platform_version": found_camera["lib_platform_version"],
+                "software_version": found_camera["software_version"],
+                "lib_ai_version": found_camera["lib_ai_version"],
+                "device_ip": found_camera["device_ip"],
+                "device_name": found_camera["device_name"],
+            }
+        )
     return result
 
 
@@ -1181,17 +1182,17 @@ async def get_smart_camera_live_analytics(
     if cached_data:
         return cached_data
     start_day, end_day = date, date + timedelta(days=1) - timedelta(seconds=1)
-    query = {"id": smart_camera.id, "created_at": {"$gte": start_day, "$lt": end_day}}
+    query = {"id": smart_camera.id, "minute": {"$gte": start_day, "$lt": end_day}}
     try:
-        cursor = await mongo_db.analytics.aggregate(
+        cursor = await mongo_db[POLL_BUCKET_COLLECTION].aggregate(
             [
                 {"$match": query},
                 {
                     "$project": {
-                        "hour": {"$hour": "$created_at"},
-                        "minute": {
-                            "$subtract": [{"$minute": "$created_at"}, {"$mod": [{"$minute": "$created_at"}, 30]}]
-                        },
+                        # polls from before the buckets were backfilled into legacy_count
+                        "count": {"$add": [{"$ifNull": ["$count", 0]}, {"$ifNull": ["$legacy_count", 0]}]},
+                        "hour": {"$hour": "$minute"},
+                        "minute": {"$subtract": [{"$minute": "$minute"}, {"$mod": [{"$minute": "$minute"}, 30]}]},
                     }
                 },
                 {
@@ -1208,10 +1209,11 @@ async def get_smart_camera_live_analytics(
                                 ":",
                                 {"$cond": [{"$eq": ["$minute", 0]}, "00", "30"]},
                             ]
-                        }
+                        },
+                        "count": 1,
                     }
                 },
-                {"$group": {"_id": "$time_interval", "count": {"$sum": 1}}},
+                {"$group": {"_id": "$time_interval", "count": {"$sum": "$count"}}},
                 {"$sort": {"_id": ASCENDING}},  # Optional: Sort results by time interval
             ]
         ).to_list(None)
@@ -1336,48 +1338,67 @@ def update_password(
         raise HTTPException(status_code=response.status_code, detail=response.text) from e
 
 
-def custom_paginate_for_smart_camera(db: Session, data: list, page: int, size: int):
-    today = datetime.now().date()
-    if not data:
+def custom_paginate_for_smart_camera(db: Session, query, page: int, size: int):
+    total = query.order_by(None).count()
+    if not total:
         return {"items": [], "total": 0, "page": page, "size": size, "pages": 0}
-    total = len(data)
-    pages = ceil(len(data) / size)
-    wanted_data = data[(page - 1) * size : page * size]
-    for item in wanted_data:
-        attendance_count = (
-            db.query(func.count(distinct(Attendance.identity_id)))
-            .filter(
-                and_(
-                    Attendance.smart_camera_id == item.id,
-                    Attendance.attendance_datetime >= today,
-                    Attendance.attendance_datetime < today + timedelta(days=1),
-                    Attendance.by_mobile.is_(False),
-                    Attendance.mismatch_entity.is_(False),
-                    Attendance.is_active,
-                )
-            )
-            .scalar()
+    if page < 1 or size < 1:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid page or size")
+    today = datetime.now().date()
+    page_ids = (
+        query.with_entities(SmartCamera.id).order_by(SmartCamera.id).offset((page - 1) * size).limit(size).subquery()
+    )
+    identity_counts = (
+        db.query(
+            IdentitySmartCamera.smart_camera_id.label("smart_camera_id"),
+            func.count(IdentitySmartCamera.id).label("identity_count"),
         )
-        avagare_attendance_comp_score = (
-            db.query(func.avg(Attendance.comp_score))
-            .filter(
-                and_(
-                    Attendance.smart_camera_id == item.id,
-                    Attendance.attendance_datetime >= today,
-                    Attendance.attendance_datetime < today + timedelta(days=1),
-                    Attendance.by_mobile.is_(False),
-                    Attendance.mismatch_entity.is_(False),
-                    Attendance.smart_camera_id.is_not(None),
-                    Attendance.is_active,
-                )
+        .join(page_ids, page_ids.c.id == IdentitySmartCamera.smart_camera_id)
+        .group_by(IdentitySmartCamera.smart_camera_id)
+        .subquery()
+    )
+    attendance_stats = (
+        db.query(
+            Attendance.smart_camera_id.label("smart_camera_id"),
+            func.count(distinct(Attendance.identity_id)).label("attendance_count"),
+            func.avg(Attendance.comp_score).label("avagare_attendance_comp_score"),
+        )
+        .join(page_ids, page_ids.c.id == Attendance.smart_camera_id)
+        .filter(
+            and_(
+                Attendance.attendance_datetime >= today,
+                Attendance.attendance_datetime < today + timedelta(days=1),
+                Attendance.by_mobile.is_(False),
+                Attendance.mismatch_entity.is_(False),
+                Attendance.is_active,
             )
-            .scalar()
         )
-        item.attendance_count = attendance_count
+        .group_by(Attendance.smart_camera_id)
+        .subquery()
+    )
+    rows = (
+        db.query(
+            SmartCamera,
+            identity_counts.c.identity_count,
+            attendance_stats.c.attendance_count,
+            attendance_stats.c.avagare_attendance_comp_score,
+        )
+        .join(page_ids, page_ids.c.id == SmartCamera.id)
+        .outerjoin(identity_counts, identity_counts.c.smart_camera_id == SmartCamera.id)
+        .outerjoin(attendance_stats, attendance_stats.c.smart_camera_id == SmartCamera.id)
+        .options(defer(SmartCamera.identity_count), joinedload(SmartCamera.tenant_entity))
+        .order_by(SmartCamera.id)
+        .all()
+    )
+    items = []
+    for item, identity_count, attendance_count, avagare_attendance_comp_score in rows:
+        item.identity_count = identity_count or 0
+        item.attendance_count = attendance_count or 0
         item.avagare_attendance_comp_score = (
             float(f"{avagare_attendance_comp_score:.3f}") if avagare_attendance_comp_score else None
         )
-    return {"items": wanted_data, "total": total, "page": page, "size": size, "pages": pages}
+        items.append(item)
+    return {"items": items, "total": total, "page": page, "size": size, "pages": ceil(total / size)}
 
 
 @router.get("/smartcamera", response_model=CustomPaginatedResponseForSmartCamera)
@@ -1409,11 +1430,7 @@ def get_smart_cameras(
     if region_id is not None:
         query = query.filter(TenantEntity.region_id == region_id)
 
-    query = query.order_by(SmartCamera.id)
-
-    data = query.all()
-
-    return custom_paginate_for_smart_camera(db, data, page, size)
+    return custom_paginate_for_smart_camera(db, query, page, size)
 
 
 @router.get("/smartcamera/identity/attendance/analytics", response_model=IdentityAttendanceAnalyticsForSmartCamera)
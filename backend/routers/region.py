@@ -17,7 +17,8 @@ from schemas.region import (
     RegionInDB,
     RegionSchema,
 )
-from utils.redis_cache import get_from_redis, get_redis_connection, set_to_redis
+from utils.redis_cache import get_redis_connection
+from utils.response_cache import cached_response
 
 router = APIRouter(prefix="/region", tags=["region"])
 
@@ -35,19 +36,13 @@ def update_country(
 
 
 @router.get("/country", response_model=List[CountrySchema])
+@cached_response("countries", List[CountrySchema], expire=1800)
 def get_countries(
     is_active: Optional[bool] = Query(default=True, alias="is_active"),
     db: Session = Depends(get_pg_db),
-    redis_client=Depends(get_redis_connection),
     authenticated=Security(is_authenticated),
 ):
-    cached_countries = get_from_redis(redis_client, "countries")
-    if cached_countries:
-        return cached_countries
-    countries = db_region.get_countries(db, is_active)
-    serialized_countries = [country.to_dict() for country in countries]
-    set_to_redis(redis_client, "countries", serialized_countries)
-    return serialized_countries
+    return [country.to_dict() for country in db_region.get_countries(db, is_active)]
 
 
 @router.get("/country/{pk}", response_model=CountryInDB)
@@ -78,20 +73,14 @@ def update_district(
 
 
 @router.get("/district", response_model=List[DistrictSchema])
+@cached_response("districts", List[DistrictSchema], expire=1800)
 async def get_districts(
     region_id: int,
     is_active: Optional[bool] = Query(default=True, alias="is_active"),
     db: Session = Depends(get_pg_db),
-    redis_client=Depends(get_redis_connection),
     authenticated=Security(is_authenticated),
 ):
-    cached_districts = get_from_redis(redis_client, f"{region_id}:districts")
-    if cached_districts:
-        return cached_districts
-    districts = db_region.get_districts(db, region_id, is_active)
-    serialized_districts = [district.to_dict() for district in districts]
-    set_to_redis(redis_client, f"{region_id}:districts", serialized_districts)
-    return serialized_districts
+    return [district.to_dict() for district in db_region.get_districts(db, region_id, is_active)]
 
 
 # @router.get("/allowed-districts", response_model=List[DistrictSchema])
@@ -135,20 +124,14 @@ def update_region(
 
 
 @router.get("/", response_model=List[RegionSchema])
+@cached_response("regions", List[RegionSchema], expire=1800)
 async def get_regions(
     country_id: int,
     is_active: Optional[bool] = Query(default=True, alias="is_active"),
     db: Session = Depends(get_pg_db),
-    redis_client=Depends(get_redis_connection),
     authenticated=Security(is_authenticated),
 ):
-    cached_regions = get_from_redis(redis_client, f"{country_id}:regions")
-    if cached_regions:
-        return cached_regions
-    regions = db_region.get_regions(db, country_id, is_active)
-    serialized_regions = [region.to_dict() for region in regions]
-    set_to_redis(redis_client, f"{country_id}:regions", serialized_regions)
-    return serialized_regions
+    return [region.to_dict() for region in db_region.get_regions(db, country_id, is_active)]
 
 
 @router.get("/allowed-regions", response_model=List[RegionSchema])
@@ -28,13 +28,32 @@ from schemas.relative import (
     RegionSchemas,
 )
 from schemas.relative.mtt_location_close import RelativeAttendanceReportData
-from services.http_client import HTTPClient
+from services.http_client import CachedHTTPClient, HTTPClient
+from utils.redis_cache import get_redis_connection
 
 router = APIRouter(prefix="/platon", tags=["platon"])
 
-
-def get_http_client() -> HTTPClient:
-    return HTTPClient(base_url=NODAVLAT_BOGCHA_BASE_URL, auth=(NODAVLAT_BOGCHA_USERNAME, NODAVLAT_BOGCHA_PASSWORD))
+# seconds a cached upstream response is considered fresh, endpoints not listed here are never cached
+PLATON_CACHE_TTLS = {
+    "regions": 24 * 60 * 60,
+    "districts": 24 * 60 * 60,
+    "mtt/location/close": 60 * 60,
+    "parent_fees/mtt/photos": 60 * 60,
+    "parent_fees/mtt/statistics": 10 * 60,
+    "parent_fees/mtt/data": 5 * 60,
+    "parent_fees/kid/foods": 10 * 60,
+    "food/photo": 5 * 60,
+}
+
+
+def get_http_client(redis_client=Depends(get_redis_connection)) -> HTTPClient:
+    return CachedHTTPClient(
+        base_url=NODAVLAT_BOGCHA_BASE_URL,
+        auth=(NODAVLAT_BOGCHA_USERNAME, NODAVLAT_BOGCHA_PASSWORD),
+        redis_client=redis_client,
+        ttls=PLATON_CACHE_TTLS,
+        namespace="platon",
+    )
 
 
 @router.get("/parent-fees/mtt/data", response_model=GenericResponseSchema[ParentFeesMttDataSchema])
@@ -40,6 +40,7 @@ from models.identity import (
     RelativeAttendance,
     WantedAttendance,
 )
+from services.poll_analytics import record_poll
 from services.scamera_task_request import (
     add_identity_task,
     add_relative_task,
@@ -126,7 +127,6 @@ logger = logging.getLogger(__name__)
 async def task_request(
     request: Request,
     db: Session = Depends(get_pg_db),
-    mongo_db=Depends(get_mongo_db),
     redis_client=Depends(get_redis_connection),
 ):
     """
@@ -175,8 +175,7 @@ async def task_request(
             db.commit()
             db.refresh(camera)
 
-        post = {"id": camera.id, "device_id": camera.device_id, "created_at": datetime.now()}
-        await mongo_db["analytics"].insert_one(post)
+        record_poll(redis_client, camera.id)
 
         task = (
             db.query(SmartCameraTask)
@@ -1,6 +1,5 @@
 from typing import Literal, Optional
 
-import requests
 from fastapi import APIRouter, Depends, HTTPException, Query, Security
 from fastapi_pagination.ext.sqlalchemy import paginate
 from sqlalchemy.orm import Session
@@ -18,7 +17,9 @@ from schemas.tenant import (
     TenantInDBBase,
     TenantUpdate,
 )
+from services.device_inventory import get_active_devices
 from utils.pagination import CustomPage
+from utils.redis_cache import get_redis_connection
 
 router = APIRouter(prefix="/tenant", tags=["tenant"])
 
@@ -90,22 +91,19 @@ def delete_tenant(pk: int, db: Session = Depends(get_pg_db), sysadmin=Security(g
 
 
 @router.get("/smartcamera/no_exist/list")
-def get_smartcamera_no_exist_list(db: Session = Depends(get_pg_db), sysadmin=Security(get_current_sysadmin)):
-    url = "https://scamera.realsoft.ai/devices/getAllActiveDevices"
-    response = requests.get(url)
-    if response.status_code != 200:
-        raise HTTPException(status_code=response.status_code, detail=response.text)
-    all_active_devices: list = response.json()["devices"]
+def get_smartcamera_no_exist_list(
+    db: Session = Depends(get_pg_db),
+    sysadmin=Security(get_current_sysadmin),
+    redis_client=Depends(get_redis_connection),
+):
+    all_active_devices, _ = get_active_devices(redis_client)
     if not all_active_devices:
         raise HTTPException(status_code=404, detail="No active devices found")
-    db_scameras = db.query(SmartCamera).filter(SmartCamera.device_id.in_(all_active_devices)).all()
-    if len(db_scameras) < len(all_active_devices):
-        for scamera in db_scameras:
-            if scamera.device_id in all_active_devices:
-                all_active_devices.remove(scamera.device_id)
-        return ScameraNoExistResponse(
-            success=True, device_ids=all_active_devices, message=f"Amount: {len(all_active_devices)}"
-        )
-    elif len(db_scameras) == len(all_active_devices):
-        return ScameraNoExistResponse(success=True, device_ids=None, message="No difference found")
-    return ScameraNoExistResponse(success=True, device_ids=None, message=None)
+    existing = {
+        device_id
+        for (device_id,) in db.query(SmartCamera.device_id).filter(SmartCamera.device_id.in_(all_active_devices))
+    }
+    missing = sorted(all_active_devices - existing)
+    if missing:
+        return ScameraNoExistResponse(success=True, device_ids=missing, message=f"Amount: {len(missing)}")
+    return ScameraNoExistResponse(success=True, device_ids=None, message="No difference found")
@@ -10,6 +10,7 @@ from typing import Any, List, Literal, Optional
 import requests
 from aio_pika.abc import AbstractRobustConnection
 from fastapi import APIRouter, Depends, HTTPException, Query, Security, WebSocket, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi_pagination import Page, Params
 from fastapi_pagination import paginate as iterable_paginate
 from fastapi_pagination.ext.sqlalchemy import paginate
@@ -61,11 +62,13 @@ from schemas.tenant_hierarchy_entity import (
 from tasks import (
     add_wanted_to_smart_camera,
     create_relative_identity_list_task,
-    update_relative_photo_with_pinfl_task,
+    update_relative_photos_with_pinfl_task,
     upload_relative_with_task,
 )
 from utils.image_processing import get_image_from_query, make_minio_url_from_image
 from utils.pagination import CustomPage
+from utils.redis_cache import get_redis_connection
+from utils.segment_cache import get_day_segment, segment_scope
 
 router = APIRouter(prefix="/tenant_entity", tags=["tenant_entity"])
 
@@ -1067,24 +1070,26 @@ async def get_tenant_entity_analytics(
     tenant_entity_name_search: Optional[Any] = None,
     db: Session = Depends(get_pg_db),
     mongodb: AsyncIOMotorDatabase = Depends(get_analytics_cache_db),
+    redis_client=Depends(get_redis_connection),
     params: Params = Depends(),
     tenant_admin=Security(get_current_tenant_admin),
 ):
-    return iterable_paginate(
-        db_tenant_entity.get_tenant_entity_analytics(
-            db=db,
-            attedance_date=attendance_date,
-            attendance_sort_type=attendance_sort_type,
-            attendance_sort_role=attendance_sort_role,
-            attendance_sort_quantity=attendance_sort_quantity,
-            attendance_ratio_from=attendance_ratio_from,
-            attendance_ratio_to=attendance_ratio_to,
-            district_id=district_id,
-            region_id=region_id,
-            entity_name_search=tenant_entity_name_search,
-        ),
-        params=params,
+    # the queries and the segment cache (which may wait on another request's lock) block, keep them off the loop
+    analytics = await run_in_threadpool(
+        db_tenant_entity.get_tenant_entity_analytics,
+        db=db,
+        attedance_date=attendance_date,
+        attendance_sort_type=attendance_sort_type,
+        attendance_sort_role=attendance_sort_role,
+        attendance_sort_quantity=attendance_sort_quantity,
+        attendance_ratio_from=attendance_ratio_from,
+        attendance_ratio_to=attendance_ratio_to,
+        district_id=district_id,
+        region_id=region_id,
+        entity_name_search=tenant_entity_name_search,
+        redis_client=redis_client,
     )
+    return iterable_paginate(analytics, params=params)
 
 
 @router.get("/attendance/statistics", tags=["attendances"])
@@ -1093,14 +1098,21 @@ def get_tenant_entity_attendace_statistics(
     attendance_date: date,
     district_id: Optional[int] = None,
     db: Session = Depends(get_pg_db),
+    redis_client=Depends(get_redis_connection),
     tenant_admin=Security(get_current_tenant_admin),
 ):
-    return db_tenant_entity.get_tenant_entity_statistics(
-        db=db,
-        tenant_id=tenant_admin.tenant_id,
-        attedance_date=attendance_date,
-        region_id=region_id,
-        district_id=district_id,
+    return get_day_segment(
+        redis_client,
+        "tenant_entity_attendance_statistics",
+        segment_scope(tenant_admin.tenant_id, region_id, district_id),
+        attendance_date,
+        lambda: db_tenant_entity.get_tenant_entity_statistics(
+            db=db,
+            tenant_id=tenant_admin.tenant_id,
+            attedance_date=attendance_date,
+            region_id=region_id,
+            district_id=district_id,
+        ),
     )
 
 
@@ -1186,8 +1198,9 @@ def update_photos_with_pinfl(
     if not tenant_entity:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Tenant entity not found")
     relatives = db_relative.get_entity_relatives(db, tenant_entity_id)
-    for relative in relatives:
-        update_relative_photo_with_pinfl_task.delay(relative.id, tenant_admin.tenant_id)
+    relative_ids = [relative.id for relative in relatives]
+    for i in range(0, len(relative_ids), 100):
+        update_relative_photos_with_pinfl_task.delay(relative_ids[i : i + 100], tenant_admin.tenant_id)
     return {"detected_count": len(relatives)}
 
 
@@ -1,21 +1,16 @@
 import datetime
-import requests
 
 from enum import IntEnum
 from typing import List, Literal, Optional
 
 from pydantic import BaseModel, confloat, conint, validator
+from services.device_inventory import is_device_active
 from utils.log import timeit
 
 
 @timeit
 def is_device_online(device_id: str) -> bool:
-    url = "https://scamera.realsoft.ai/devices/getAllActiveDevices"
-    response = requests.get(url)
-    if response.status_code == 200:
-        all_active_devices: list = response.json()["devices"]
-        return device_id in all_active_devices
-    return False
+    return is_device_active(device_id)
 
 
 # async def get_scamera_active_time(smart_camera_id: int, mongo_db=get_mongo_db()):  # noqa
@@ -0,0 +1,35 @@
+import json
+from typing import AsyncIterator
+
+from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
+
+ANALYTICS_STREAM_PREFIX = "deepstream:notifications"
+ANALYTICS_STREAM_MAXLEN = 1000
+
+
+def get_stream_name(jetson_device_id: str) -> str:
+    return f"{ANALYTICS_STREAM_PREFIX}:{jetson_device_id}"
+
+
+def publish_notification(redis_client: Redis, notification: dict) -> str:
+    """Append an alert to the jetson device stream, keeping roughly the last ANALYTICS_STREAM_MAXLEN entries."""
+    return redis_client.xadd(
+        get_stream_name(notification["jetson_device_id"]),
+        {"data": json.dumps(notification)},
+        maxlen=ANALYTICS_STREAM_MAXLEN,
+        approximate=True,
+    )
+
+
+async def listen_notifications(
+    redis_client: AsyncRedis, jetson_device_id: str, last_id: str = "$", block: int = 5000
+) -> AsyncIterator[dict]:
+    """Yield alerts of a jetson device as they arrive, every listener receives every alert after ``last_id``."""
+    stream = get_stream_name(jetson_device_id)
+    while True:
+        response = await redis_client.xread({stream: last_id}, count=100, block=block)
+        for _, entries in response or []:
+            for entry_id, fields in entries:
+                last_id = entry_id
+                yield json.loads(fields["data"])
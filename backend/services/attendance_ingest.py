@@ -0,0 +1,79 @@
+import logging
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+
+from celery import Celery
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from models import Attendance
+from services.task_outbox import add_to_outbox, dispatch_outbox
+
+logger = logging.getLogger(__name__)
+
+# (task name, data) pairs staged in the outbox together with an attendance
+StagedTasks = List[Tuple[str, dict]]
+
+
+def resolve_duplicate_attendance(
+    db: Session,
+    idempotency_key: Optional[str],
+    attendance_datetime: datetime,
+    minio_ssd_client,
+    bucket_name: Optional[str],
+    object_name: Optional[str],
+) -> Optional[Attendance]:
+    """After a unique violation: the attendance a concurrent retry of the same package committed, or None.
+
+    The upload of the losing request is removed, the winner already stored its own image.
+    """
+    db.rollback()
+    duplicate = (
+        db.query(Attendance).filter_by(idempotency_key=idempotency_key, attendance_datetime=attendance_datetime).first()
+        if idempotency_key
+        else None
+    )
+    if duplicate is not None and bucket_name and object_name:
+        try:
+            minio_ssd_client.remove_object(bucket_name, object_name)
+        except Exception as e:
+            logger.warning(f"Failed to remove duplicate attendance image {object_name}: {e}")
+    return duplicate
+
+
+def save_attendance(
+    db: Session,
+    attendance: Attendance,
+    stage_tasks: Callable[[Attendance], StagedTasks],
+    celery_app: Celery,
+    minio_ssd_client,
+) -> Attendance:
+    """Insert ``attendance`` with the tasks ``stage_tasks`` returns for it in one transaction, then dispatch them.
+
+    ``stage_tasks`` runs after the attendance is flushed, so it can use its id and add rows of its own. A concurrent
+    retry of the same package waits on the unique idempotency key until the first one commits; it then gets the
+    committed attendance back and its own upload is removed, so the tasks are enqueued once.
+    """
+    idempotency_key, attendance_datetime = attendance.idempotency_key, attendance.attendance_datetime
+    bucket_name, object_name = attendance.bucket_name, attendance.object_name
+    db.add(attendance)
+    try:
+        db.flush()
+        outbox = [add_to_outbox(db, task_name, data=data) for task_name, data in stage_tasks(attendance)]
+        db.flush()
+        outbox_ids = [entry.id for entry in outbox]
+        db.commit()
+    except IntegrityError:
+        duplicate = resolve_duplicate_attendance(
+            db, idempotency_key, attendance_datetime, minio_ssd_client, bucket_name, object_name
+        )
+        if duplicate is None:
+            raise
+        return duplicate
+    try:
+        dispatch_outbox(db, celery_app, outbox_ids)
+    except Exception as e:
+        # the rows stay undispatched and the outbox relay beat task sends them
+        db.rollback()
+        logger.warning(f"Attendance {attendance.id} task dispatch deferred to outbox relay: {e}")
+    return attendance
@@ -0,0 +1,320 @@
+import logging
+import os
+import re
+import sys
+from datetime import date, datetime
+from typing import List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import PrimaryKeyConstraint, UniqueConstraint, text
+from sqlalchemy.orm import Session
+
+from models import Attendance
+
+ATTENDANCE_TABLE = Attendance.__tablename__
+DEFAULT_PARTITION = f"{ATTENDANCE_TABLE}_default"
+LEGACY_PARTITION = f"{ATTENDANCE_TABLE}_legacy"
+ATTENDANCE_PARTITIONS_AHEAD = int(os.getenv("ATTENDANCE_PARTITIONS_AHEAD", 3))
+# months of attendance kept attached to the table, 0 keeps everything
+ATTENDANCE_KEEP_MONTHS = int(os.getenv("ATTENDANCE_KEEP_MONTHS", 0))
+ATTENDANCE_ARCHIVE_SCHEMA = os.getenv("ATTENDANCE_ARCHIVE_SCHEMA", "archive")
+# how long the conversion waits for its exclusive lock before giving up instead of stalling traffic queued behind it
+ATTENDANCE_CONVERT_LOCK_TIMEOUT = os.getenv("ATTENDANCE_CONVERT_LOCK_TIMEOUT", "10s")
+# advisory lock key serialising partition maintenance between processes
+PARTITIONS_LOCK_KEY = f"{ATTENDANCE_TABLE}_partitions"
+# mirrors the bound of the legacy partition, so attaching it does not have to scan the old table
+LEGACY_BOUND_CHECK = f"{LEGACY_PARTITION}_bound_check"
+
+logger = logging.getLogger(__name__)
+
+
+class Partition(NamedTuple):
+    name: str
+    upper: Optional[datetime]  # exclusive upper bound, None for the default partition
+
+
+def month_start(day: date, months: int = 0) -> date:
+    month = day.month - 1 + months
+    return date(day.year + month // 12, month % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{ATTENDANCE_TABLE}_p{month:%Y_%m}"
+
+
+def list_partitions(db: Session) -> List[Partition]:
+    rows = db.execute(
+        text(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid WHERE i.inhparent = CAST(:table AS regclass)"
+        ),
+        {"table": ATTENDANCE_TABLE},
+    ).all()
+    partitions = []
+    for name, bound in rows:
+        upper = re.search(r"TO \('([^']+)'\)", bound)
+        partitions.append(Partition(name, datetime.fromisoformat(upper.group(1)) if upper else None))
+    return partitions
+
+
+def is_partitioned(db: Session) -> bool:
+    return bool(
+        db.execute(
+            text("SELECT 1 FROM pg_partitioned_table WHERE partrelid = CAST(:table AS regclass)"),
+            {"table": ATTENDANCE_TABLE},
+        ).scalar()
+    )
+
+
+def lock_partitions(db: Session) -> None:
+    """Wait for other processes maintaining partitions, the lock is held until the transaction ends."""
+    db.execute(text("SELECT pg_advisory_xact_lock(hashtext(:key))"), {"key": PARTITIONS_LOCK_KEY})
+
+
+def create_month_partition(db: Session, month: date) -> bool:
+    """Create the partition of ``month`` unless it exists, taking over rows the default partition holds for it."""
+    name, start, end = partition_name(month), month_start(month), month_start(month, 1)
+    # app instances and the beat task run this concurrently, the check below is only safe under the lock
+    lock_partitions(db)
+    if db.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar():
+        return False
+    bounds = {"start": start, "end": end}
+    in_default = db.execute(
+        text(
+            f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} "
+            "WHERE attendance_datetime >= :start AND attendance_datetime < :end)"
+        ),
+        bounds,
+    ).scalar()
+    if not in_default:
+        db.execute(
+            text(f"CREATE TABLE {name} PARTITION OF {ATTENDANCE_TABLE} FOR VALUES FROM ('{start}') TO ('{end}')")
+        )
+        return True
+    # a partition cannot be created over rows in the default one, so they are moved into it before attaching
+    db.execute(text(f"CREATE TABLE {name} (LIKE {ATTENDANCE_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    db.execute(
+        text(
+            f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+            "WHERE attendance_datetime >= :start AND attendance_datetime < :end RETURNING *) "
+            f"INSERT INTO {name} SELECT * FROM moved"
+        ),
+        bounds,
+    )
+    db.execute(text(f"ALTER TABLE {ATTENDANCE_TABLE} ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')"))
+    return True
+
+
+def ensure_attendance_partitions(db: Session, months_ahead: int = ATTENDANCE_PARTITIONS_AHEAD) -> List[str]:
+    """Create the default partition and the monthly ones from this month to ``months_ahead`` months ahead."""
+    if not is_partitioned(db):
+        return []
+    lock_partitions(db)
+    db.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {ATTENDANCE_TABLE} DEFAULT"))
+    legacy_upper = next((p.upper for p in list_partitions(db) if p.name == LEGACY_PARTITION), None)
+    created = []
+    for offset in range(months_ahead + 1):
+        month = month_start(date.today(), offset)
+        # months before the conversion are covered by the legacy partition
+        if legacy_upper and month < legacy_upper.date():
+            continue
+        if create_month_partition(db, month):
+            created.append(partition_name(month))
+    db.commit()
+    if created:
+        logger.info(f"created attendance partitions {created}")
+    return created
+
+
+def archive_attendance_partitions(
+    db: Session, keep_months: int = ATTENDANCE_KEEP_MONTHS, schema: str = ATTENDANCE_ARCHIVE_SCHEMA
+) -> List[str]:
+    """Detach partitions that end more than ``keep_months`` months ago and move them into ``schema``.
+
+    Archived months stay queryable as ``<schema>.<partition>`` and can be dumped or dropped from there, or attached
+    back with ``ALTER TABLE attendance ATTACH PARTITION``.
+    """
+    if not keep_months or not is_partitioned(db):
+        return []
+    cutoff = datetime.combine(month_start(date.today(), -keep_months), datetime.min.time())
+    archived = []
+    lock_partitions(db)
+    db.execute(text(f"CREATE SCHEMA IF NOT EXISTS {schema}"))
+    for partition in list_partitions(db):
+        if partition.upper is None or partition.upper > cutoff:
+            continue
+        db.execute(text(f"ALTER TABLE {ATTENDANCE_TABLE} DETACH PARTITION {partition.name}"))
+        db.execute(text(f"ALTER TABLE {partition.name} SET SCHEMA {schema}"))
+        archived.append(partition.name)
+    db.commit()
+    if archived:
+        logger.info(f"archived attendance partitions {archived} into {schema}")
+    return archived
+
+
+def _legacy_keys() -> List[Tuple[str, List[str], str]]:
+    """Name, columns and kind of the constraints the legacy partition needs for the keys of the model."""
+    keys = []
+    for constraint in Attendance.__table__.constraints:
+        columns = [column.name for column in constraint.columns]
+        if isinstance(constraint, PrimaryKeyConstraint):
+            keys.append((f"{LEGACY_PARTITION}_pkey", columns, "PRIMARY KEY"))
+        elif isinstance(constraint, UniqueConstraint):
+            keys.append((f"{LEGACY_PARTITION}_{'_'.join(columns)}_key", columns, "UNIQUE"))
+    return keys
+
+
+def _prepare_legacy_attendance(db: Session) -> date:
+    """The part of the conversion that reads the whole table, done while attendance stays writable.
+
+    Backfills missing capture times, validates a CHECK matching the bound of the legacy partition and builds the
+    indexes of the model concurrently. Returns the cutover, the first day not covered by the legacy partition.
+    """
+    latest = db.execute(text(f"SELECT max(attendance_datetime) FROM {ATTENDANCE_TABLE}")).scalar()
+    db.commit()
+    # a month of margin, the CHECK rejects rows from the cutover on until the table is attached
+    cutover = month_start(date.today(), 2)
+    if latest and latest.date() >= cutover:
+        # rows stamped in the future (client clocks) stay in the legacy range
+        cutover = month_start(latest.date(), 1)
+
+    indexes = [(name, columns, True) for name, columns, _ in _legacy_keys()]
+    indexes += [
+        (index.name, [column.name for column in index.columns], index.unique) for index in Attendance.__table__.indexes
+    ]
+    with db.get_bind().connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        # adding it NOT VALID only takes a brief lock, rows written from here on are already checked
+        connection.execute(text(f"ALTER TABLE {ATTENDANCE_TABLE} DROP CONSTRAINT IF EXISTS {LEGACY_BOUND_CHECK}"))
+        connection.execute(
+            text(
+                f"ALTER TABLE {ATTENDANCE_TABLE} ADD CONSTRAINT {LEGACY_BOUND_CHECK} "
+                f"CHECK (attendance_datetime IS NOT NULL AND attendance_datetime < '{cutover}') NOT VALID"
+            )
+        )
+        connection.execute(
+            text(
+                f"UPDATE {ATTENDANCE_TABLE} SET attendance_datetime = COALESCE(created_at, now()) "
+                "WHERE attendance_datetime IS NULL"
+            )
+        )
+        connection.execute(text(f"ALTER TABLE {ATTENDANCE_TABLE} VALIDATE CONSTRAINT {LEGACY_BOUND_CHECK}"))
+        for name, columns, unique in indexes:
+            # an interrupted concurrent build leaves an invalid index behind that IF NOT EXISTS would keep
+            valid = connection.execute(
+                text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)"), {"name": name}
+            ).scalar()
+            if valid is False:
+                connection.execute(text(f'DROP INDEX CONCURRENTLY "{name}"'))
+            connection.execute(
+                text(
+                    f'CREATE {"UNIQUE " if unique else ""}INDEX CONCURRENTLY IF NOT EXISTS "{name}" '
+                    f"ON {ATTENDANCE_TABLE} ({', '.join(columns)})"
+                )
+            )
+    return cutover
+
+
+def _drop_legacy_bound_check(db: Session) -> None:
+    db.execute(text(f"ALTER TABLE {ATTENDANCE_TABLE} DROP CONSTRAINT IF EXISTS {LEGACY_BOUND_CHECK}"))
+    db.commit()
+
+
+def _attach_legacy_attendance(db: Session, cutover: date) -> None:
+    """The part of the conversion under the exclusive lock: swap in the partitioned table and attach the old one."""
+    db.execute(text(f"SET LOCAL lock_timeout = '{ATTENDANCE_CONVERT_LOCK_TIMEOUT}'"))
+    db.execute(text(f"LOCK TABLE {ATTENDANCE_TABLE} IN ACCESS EXCLUSIVE MODE"))
+    lock_partitions(db)
+    if date.today() >= cutover:
+        raise RuntimeError(f"attendance conversion passed its cutover {cutover}, run it again")
+    for table, constraint in db.execute(
+        text(
+            "SELECT conrelid::regclass::text, conname FROM pg_constraint "
+            "WHERE contype = 'f' AND confrelid = CAST(:table AS regclass)"
+        ),
+        {"table": ATTENDANCE_TABLE},
+    ).all():
+        db.execute(text(f'ALTER TABLE {table} DROP CONSTRAINT "{constraint}"'))
+
+    # free the index and sequence names for the new parent table, which keeps using the old id sequence
+    for (index,) in db.execute(
+        text(
+            "SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE i.indrelid = CAST(:table AS regclass)"
+        ),
+        {"table": ATTENDANCE_TABLE},
+    ).all():
+        if not index.startswith(f"{LEGACY_PARTITION}_"):
+            db.execute(text(f'ALTER INDEX "{index}" RENAME TO "{index[:56]}_legacy"'))
+    sequence = db.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": ATTENDANCE_TABLE}).scalar()
+    db.execute(text(f"ALTER SEQUENCE {sequence} RENAME TO {LEGACY_PARTITION}_id_seq"))
+    db.execute(text(f"ALTER TABLE {ATTENDANCE_TABLE} RENAME TO {LEGACY_PARTITION}"))
+
+    # the keys of the model replace the old primary key, on the unique indexes built beforehand
+    primary_key = db.execute(
+        text("SELECT conname FROM pg_constraint WHERE contype = 'p' AND conrelid = CAST(:table AS regclass)"),
+        {"table": LEGACY_PARTITION},
+    ).scalar()
+    if primary_key:
+        db.execute(text(f'ALTER TABLE {LEGACY_PARTITION} DROP CONSTRAINT "{primary_key}"'))
+    # proven by the validated CHECK, without a scan
+    db.execute(text(f"ALTER TABLE {LEGACY_PARTITION} ALTER COLUMN attendance_datetime SET NOT NULL"))
+    for name, _, kind in _legacy_keys():
+        db.execute(text(f'ALTER TABLE {LEGACY_PARTITION} ADD CONSTRAINT "{name}" {kind} USING INDEX "{name}"'))
+
+    Attendance.__table__.create(bind=db.connection())
+    new_sequence = db.execute(text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": ATTENDANCE_TABLE}).scalar()
+    db.execute(
+        text(f"ALTER TABLE {ATTENDANCE_TABLE} ALTER COLUMN id SET DEFAULT nextval('{LEGACY_PARTITION}_id_seq')")
+    )
+    db.execute(text(f"DROP SEQUENCE {new_sequence}"))
+    db.execute(text(f"ALTER SEQUENCE {LEGACY_PARTITION}_id_seq RENAME TO {ATTENDANCE_TABLE}_id_seq"))
+    db.execute(text(f"ALTER SEQUENCE {ATTENDANCE_TABLE}_id_seq OWNED BY {ATTENDANCE_TABLE}.id"))
+    db.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {ATTENDANCE_TABLE} DEFAULT"))
+
+    # the indexes of the parent find their equivalents on the legacy table and the CHECK implies the partition bound
+    db.execute(
+        text(
+            f"ALTER TABLE {ATTENDANCE_TABLE} ATTACH PARTITION {LEGACY_PARTITION} "
+            f"FOR VALUES FROM (MINVALUE) TO ('{cutover}')"
+        )
+    )
+    db.execute(text(f"ALTER TABLE {LEGACY_PARTITION} DROP CONSTRAINT {LEGACY_BOUND_CHECK}"))
+    db.commit()
+
+
+def convert_attendance_to_partitioned(db: Session) -> None:
+    """One-off conversion of an existing plain attendance table into the partitioned layout of the model.
+
+    The old table is kept as it is and attached as the ``attendance_legacy`` partition for everything before the
+    cutover (the month after next, or later when rows are stamped in the future), so no rows are copied. Scans and
+    index builds happen first without blocking writes; the exclusive lock is then only held for renames, swapping the
+    prepared indexes in as constraints and the attach, which the validated CHECK keeps to catalog changes. Foreign
+    keys pointing at attendance are dropped, PostgreSQL does not allow them to reference a partitioned table through
+    id alone. A failed run leaves the plain table as it was and can simply be repeated.
+    """
+    if is_partitioned(db):
+        return
+    try:
+        cutover = _prepare_legacy_attendance(db)
+        _attach_legacy_attendance(db, cutover)
+    except Exception:
+        db.rollback()
+        # left on the plain table the CHECK would reject every insert from the cutover on
+        _drop_legacy_bound_check(db)
+        raise
+    ensure_attendance_partitions(db)
+
+
+if __name__ == "__main__":
+    from database.database import SessionLocal
+
+    logging.basicConfig(level=logging.INFO)
+    session = SessionLocal()
+    try:
+        if sys.argv[1:] == ["convert"]:
+            convert_attendance_to_partitioned(session)
+        elif sys.argv[1:] == ["archive"]:
+            archive_attendance_partitions(session)
+        else:
+            ensure_attendance_partitions(session)
+    finally:
+        session.close()
@@ -0,0 +1,120 @@
+from typing import FrozenSet, NamedTuple, Optional
+
+from sqlalchemy.orm import Session
+
+from database.db_attestation import get_attestation, get_attestation2
+from models import AllowedEntity, Identity, TenantEntity
+from models.attestation import AttestationLog, AttestationLog2
+from models.identity import Package
+from utils.reference_cache import ReferenceCache, watch
+
+
+class TenantEntityRef(NamedTuple):
+    id: int
+    external_id: Optional[str]
+    spoofing_threshold: Optional[float]
+    signature_key: Optional[str]
+
+
+class IdentityRef(NamedTuple):
+    id: int
+    tenant_id: Optional[int]
+    tenant_entity_id: Optional[int]
+    external_id: Optional[str]
+    identity_group: Optional[int]
+    group_id: Optional[int]
+    is_active: Optional[bool]
+
+
+class PackageRef(NamedTuple):
+    id: int
+    appLicensingVerdict: Optional[str]
+    appRecognitionVerdict: Optional[str]
+
+
+allowed_entity_cache = ReferenceCache("allowed_entity")
+tenant_entity_cache = ReferenceCache("tenant_entity")
+identity_cache = ReferenceCache("identity")
+package_cache = ReferenceCache("package")
+attestation_cache = ReferenceCache("attestation")
+
+watch(AllowedEntity, "allowed_entity", on_insert=True)
+watch(TenantEntity, "tenant_entity", key=lambda entity: entity.id)
+watch(Identity, "identity", key=lambda identity: identity.id)
+watch(Package, "package", key=lambda package: package.uuid)
+watch(AttestationLog, "attestation")
+watch(AttestationLog2, "attestation", key=lambda attestation: ("v2", attestation.user_id, attestation.token_id))
+
+
+def get_allowed_entity_ids(db: Session) -> FrozenSet[int]:
+    def load():
+        rows = db.query(AllowedEntity.tenant_entity_id).filter_by(is_active=True).all()
+        return frozenset(row.tenant_entity_id for row in rows)
+
+    return allowed_entity_cache.get("active", load)
+
+
+def get_tenant_entity_ref(db: Session, pk: int) -> Optional[TenantEntityRef]:
+    def load():
+        row = (
+            db.query(
+                TenantEntity.id, TenantEntity.external_id, TenantEntity.spoofing_threshold, TenantEntity.signature_key
+            )
+            .filter_by(id=pk, is_active=True)
+            .first()
+        )
+        return TenantEntityRef(*row) if row else None
+
+    return tenant_entity_cache.get(pk, load)
+
+
+def get_identity_ref(db: Session, pk: int) -> Optional[IdentityRef]:
+    def load():
+        row = (
+            db.query(
+                Identity.id,
+                Identity.tenant_id,
+                Identity.tenant_entity_id,
+                Identity.external_id,
+                Identity.identity_group,
+                Identity.group_id,
+                Identity.is_active,
+            )
+            .filter_by(id=pk)
+            .first()
+        )
+        return IdentityRef(*row) if row else None
+
+    return identity_cache.get(pk, load)
+
+
+def get_package_ref(db: Session, package_uuid: str) -> Optional[PackageRef]:
+    def load():
+        row = (
+            db.query(Package.id, Package.appLicensingVerdict, Package.appRecognitionVerdict)
+            .filter_by(uuid=package_uuid, is_active=True)
+            .first()
+        )
+        return PackageRef(*row) if row else None
+
+    return package_cache.get(package_uuid, load)
+
+
+def get_attestation_id(
+    db: Session, user_id: int, token_id: str = None, access_token: str = None, unique_id: int = None
+) -> Optional[int]:
+    if token_id:
+        key = ("v2", user_id, token_id)
+
+        def load():
+            attestation = get_attestation2(db, user_id, token_id)
+            return attestation.id if attestation else None
+
+    else:
+        key = ("v1", user_id, unique_id or access_token)
+
+        def load():
+            attestation = get_attestation(db, user_id, access_token, unique_id)
+            return attestation.id if attestation else None
+
+    return attestation_cache.get(key, load)
@@ -0,0 +1,94 @@
+import logging
+import os
+import time
+from typing import Optional, Set, Tuple
+
+import requests
+from fastapi import HTTPException, status
+from redis import Redis, RedisError
+
+from utils.redis_cache import get_redis_connection
+
+ACTIVE_DEVICES_URL = os.getenv("SCAMERA_ACTIVE_DEVICES_URL", "https://scamera.realsoft.ai/devices/getAllActiveDevices")
+ACTIVE_DEVICES_TIMEOUT = int(os.getenv("SCAMERA_ACTIVE_DEVICES_TIMEOUT", 10))
+# snapshots older than this are refreshed inline, which only happens when the beat task stops running
+ACTIVE_DEVICES_MAX_AGE = int(os.getenv("SCAMERA_ACTIVE_DEVICES_MAX_AGE", 300))
+
+INVENTORY_KEY = "scamera:active_devices"
+INVENTORY_REFRESHED_AT_KEY = "scamera:active_devices:refreshed_at"
+
+logger = logging.getLogger(__name__)
+
+_redis_client = None
+
+
+def _get_redis() -> Redis:
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = get_redis_connection()
+    return _redis_client
+
+
+def fetch_active_devices() -> list:
+    response = requests.get(ACTIVE_DEVICES_URL, timeout=ACTIVE_DEVICES_TIMEOUT)
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code, detail=response.text)
+    return response.json()["devices"]
+
+
+def refresh_active_devices(redis_client: Redis = None) -> Tuple[Set[str], float]:
+    """Fetch the active device list from the smart camera cloud and replace the snapshot in Redis.
+
+    The new set is written under a temporary key and renamed over the old one, so readers never see a partially
+    written snapshot.
+    """
+    redis_client = redis_client or _get_redis()
+    devices = set(fetch_active_devices())
+    refreshed_at = time.time()
+    tmp_key = f"{INVENTORY_KEY}:tmp"
+    pipe = redis_client.pipeline(transaction=True)
+    pipe.delete(tmp_key)
+    if devices:
+        pipe.sadd(tmp_key, *devices)
+        pipe.rename(tmp_key, INVENTORY_KEY)
+    else:
+        pipe.delete(INVENTORY_KEY)
+    pipe.set(INVENTORY_REFRESHED_AT_KEY, refreshed_at)
+    pipe.execute()
+    return devices, refreshed_at
+
+
+def get_refreshed_at(redis_client: Redis = None) -> Optional[float]:
+    value = (redis_client or _get_redis()).get(INVENTORY_REFRESHED_AT_KEY)
+    return float(value) if value else None
+
+
+def get_active_devices(redis_client: Redis = None) -> Tuple[Set[str], float]:
+    """Return the cached active device ids together with the time the snapshot was taken.
+
+    Falls back to a synchronous refresh when there is no snapshot yet or it is older than ACTIVE_DEVICES_MAX_AGE.
+    """
+    redis_client = redis_client or _get_redis()
+    refreshed_at = get_refreshed_at(redis_client)
+    if refreshed_at is None or time.time() - refreshed_at > ACTIVE_DEVICES_MAX_AGE:
+        try:
+            return refresh_active_devices(redis_client)
+        except (requests.RequestException, HTTPException) as e:
+            if refreshed_at is None:
+                if isinstance(e, HTTPException):
+                    raise
+                raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=str(e)) from e
+            logger.warning(f"active devices refresh failed, serving snapshot from {refreshed_at}: {e}")
+    return redis_client.smembers(INVENTORY_KEY), refreshed_at
+
+
+def is_device_active(device_id: str, redis_client: Redis = None) -> bool:
+    redis_client = redis_client or _get_redis()
+    try:
+        if get_refreshed_at(redis_client) is None:
+            devices, _ = get_active_devices(redis_client)
+            return device_id in devices
+        return bool(redis_client.sismember(INVENTORY_KEY, device_id))
+    except (RedisError, HTTPException) as e:
+        logger.warning(f"active devices lookup failed for {device_id}: {e}")
+        return False
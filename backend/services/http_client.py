@@ -1,7 +1,13 @@
+import contextlib
+import hashlib
+import json
+import time
 from typing import Any, Dict, Optional
 
 import requests
 from fastapi import HTTPException
+from redis import Redis, RedisError
+from redis.exceptions import LockError
 
 
 class HTTPClient:
@@ -34,3 +40,80 @@ class HTTPClient:
             raise HTTPException(status_code=response.status_code, detail=response.text) from http_err
         except requests.exceptions.RequestException as err:
             raise HTTPException(status_code=500, detail="Internal Server Error") from err
+
+
+class CachedHTTPClient(HTTPClient):
+    """HTTPClient whose GET requests go through a Redis read-through cache.
+
+    Only endpoints listed in ``ttls`` are cached. Entries are kept for ``stale_ttl`` seconds past their
+    freshness so they can still be served when the upstream fails, and concurrent misses for the same key
+    are coalesced behind a Redis lock so only one of them calls the upstream.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        auth: Optional[tuple] = None,
+        redis_client: Optional[Redis] = None,
+        ttls: Optional[Dict[str, int]] = None,
+        namespace: str = "http",
+        stale_ttl: int = 86400,
+        lock_timeout: int = 15,
+    ):
+        super().__init__(base_url, auth)
+        self.redis_client = redis_client
+        self.ttls = ttls or {}
+        self.namespace = namespace
+        self.stale_ttl = stale_ttl
+        self.lock_timeout = lock_timeout
+
+    def cache_key(self, endpoint: str, params: Optional[Dict[str, Any]] = None) -> str:
+        query = json.dumps(params or {}, sort_keys=True, default=str)
+        digest = hashlib.sha1(query.encode()).hexdigest()
+        return f"{self.namespace}:{endpoint}:{digest}"
+
+    def _read(self, key: str) -> Optional[dict]:
+        try:
+            value = self.redis_client.get(key)
+            return json.loads(value) if value else None
+        except (RedisError, json.JSONDecodeError, TypeError):
+            return None
+
+    def _write(self, key: str, data: Any, ttl: int) -> None:
+        entry = {"data": data, "expires_at": time.time() + ttl}
+        with contextlib.suppress(RedisError):
+            self.redis_client.set(key, json.dumps(entry), ex=ttl + self.stale_ttl)
+
+    def get(self, endpoint: str, params: Optional[Dict[str, Any]] = None) -> Any:
+        ttl = self.ttls.get(endpoint)
+        if not ttl or self.redis_client is None:
+            return super().get(endpoint, params)
+
+        key = self.cache_key(endpoint, params)
+        entry = self._read(key)
+        if entry and entry["expires_at"] > time.time():
+            return entry["data"]
+
+        lock = self.redis_client.lock(f"{key}:lock", timeout=self.lock_timeout, blocking_timeout=self.lock_timeout)
+        try:
+            acquired = lock.acquire()
+        except RedisError:
+            acquired = False
+        try:
+            if acquired:
+                # another request may have refreshed the entry while we were waiting for the lock
+                entry = self._read(key) or entry
+                if entry and entry["expires_at"] > time.time():
+                    return entry["data"]
+            try:
+                data = super().get(endpoint, params)
+            except HTTPException:
+                if entry:
+                    return entry["data"]
+                raise
+            self._write(key, data, ttl)
+            return data
+        finally:
+            if acquired:
+                with contextlib.suppress(LockError, RedisError):
+                    lock.release()
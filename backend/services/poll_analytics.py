@@ -0,0 +1,150 @@
+import logging
+import os
+import sys
+from datetime import datetime, timedelta
+from typing import Optional
+
+from pymongo import UpdateOne
+from redis import Redis
+
+POLL_BUCKET_COLLECTION = "analytics_buckets"
+# raw per-poll documents written before the buckets existed, folded into them by backfill_legacy_polls
+POLL_RAW_COLLECTION = "analytics"
+POLL_BUCKET_TTL = int(os.getenv("POLL_BUCKET_TTL", 180 * 24 * 60 * 60))
+# counters that were never flushed (e.g. beat was down) are dropped after this long
+POLL_COUNTER_TTL = int(os.getenv("POLL_COUNTER_TTL", 24 * 60 * 60))
+
+POLL_COUNTER_PREFIX = "scamera:polls"
+POLL_PENDING_KEY = f"{POLL_COUNTER_PREFIX}:pending"
+MINUTE_FORMAT = "%Y%m%d%H%M"
+
+logger = logging.getLogger(__name__)
+
+
+def _counter_key(minute: str) -> str:
+    return f"{POLL_COUNTER_PREFIX}:{minute}"
+
+
+def record_poll(redis_client: Redis, camera_id: int, at: Optional[datetime] = None) -> None:
+    """Count one poll of ``camera_id`` in the counter hash of the current minute."""
+    minute = (at or datetime.now()).strftime(MINUTE_FORMAT)
+    key = _counter_key(minute)
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.hincrby(key, camera_id, 1)
+    pipe.expire(key, POLL_COUNTER_TTL)
+    pipe.sadd(POLL_PENDING_KEY, minute)
+    pipe.execute()
+
+
+def flush_polls(redis_client: Redis, mongo_db, now: Optional[datetime] = None) -> dict:
+    """Move every finished minute from Redis into one upserted bucket document per camera-minute.
+
+    A minute hash is renamed before it is read, so concurrent flushes never count the same polls twice and polls
+    that keep arriving for the minute (late requests around the boundary) start a fresh hash that the next flush
+    picks up through ``$inc``.
+    """
+    current_minute = (now or datetime.now()).strftime(MINUTE_FORMAT)
+    collection = mongo_db[POLL_BUCKET_COLLECTION]
+    flushed_minutes, upserts = 0, 0
+    for minute in sorted(redis_client.smembers(POLL_PENDING_KEY)):
+        if minute >= current_minute:
+            continue
+        redis_client.srem(POLL_PENDING_KEY, minute)
+        key = _counter_key(minute)
+        flushing_key = f"{key}:flushing"
+        try:
+            redis_client.rename(key, flushing_key)
+        except Exception:
+            # another flush already claimed it, or the hash expired
+            continue
+        counters = redis_client.hgetall(flushing_key)
+        bucket_start = datetime.strptime(minute, MINUTE_FORMAT)
+        operations = [
+            UpdateOne(
+                {"id": int(camera_id), "minute": bucket_start},
+                {
+                    "$inc": {"count": int(count)},
+                    "$setOnInsert": {"expire_at": bucket_start + timedelta(seconds=POLL_BUCKET_TTL)},
+                },
+                upsert=True,
+            )
+            for camera_id, count in counters.items()
+        ]
+        if operations:
+            try:
+                collection.bulk_write(operations, ordered=False)
+            except Exception as e:
+                # put the minute back so the next run retries it
+                logger.warning(f"poll bucket flush failed for {minute}: {e}")
+                redis_client.rename(flushing_key, key)
+                redis_client.sadd(POLL_PENDING_KEY, minute)
+                continue
+        redis_client.delete(flushing_key)
+        flushed_minutes += 1
+        upserts += len(operations)
+    return {"minutes": flushed_minutes, "upserts": upserts}
+
+
+def backfill_legacy_polls(mongo_db, now: Optional[datetime] = None) -> None:
+    """Fold the raw per-poll documents into the minute buckets, server side with ``$merge``.
+
+    Legacy polls land in ``legacy_count`` next to the live ``count``, which the analytics endpoint adds up, so
+    running it again after a partial or repeated run rewrites the same numbers instead of counting them twice.
+    Polls older than the bucket retention are skipped, their buckets would expire right away. Run it once after
+    deploying the buckets (``python -m services.poll_analytics backfill``), until then the report of the cut-over
+    day and the days before it only shows polls counted in Redis. The raw collection can be dropped afterwards.
+    """
+    since = (now or datetime.now()) - timedelta(seconds=POLL_BUCKET_TTL)
+    minute = {
+        "$dateFromParts": {
+            "year": {"$year": "$created_at"},
+            "month": {"$month": "$created_at"},
+            "day": {"$dayOfMonth": "$created_at"},
+            "hour": {"$hour": "$created_at"},
+            "minute": {"$minute": "$created_at"},
+        }
+    }
+    mongo_db[POLL_RAW_COLLECTION].aggregate(
+        [
+            {"$match": {"created_at": {"$gte": since}}},
+            {"$group": {"_id": {"id": "$id", "minute": minute}, "legacy_count": {"$sum": 1}}},
+            {
+                "$project": {
+                    "_id": 0,
+                    "id": "$_id.id",
+                    "minute": "$_id.minute",
+                    "legacy_count": 1,
+                    "expire_at": {"$add": ["$_id.minute", POLL_BUCKET_TTL * 1000]},
+                }
+            },
+            {
+                "$merge": {
+                    "into": POLL_BUCKET_COLLECTION,
+                    "on": ["id", "minute"],
+                    "whenMatched": [{"$set": {"legacy_count": "$$new.legacy_count"}}],
+                    "whenNotMatched": "insert",
+                }
+            },
+        ],
+        allowDiskUse=True,
+    )
+
+
+async def create_poll_analytics_indexes(mongo_db) -> None:
+    await mongo_db[POLL_BUCKET_COLLECTION].create_index([("id", 1), ("minute", 1)], unique=True)
+    await mongo_db[POLL_BUCKET_COLLECTION].create_index("expire_at", expireAfterSeconds=0)
+    # an earlier version aged the raw polls out with a TTL index, keep them until they are backfilled
+    raw_indexes = await mongo_db[POLL_RAW_COLLECTION].index_information()
+    if "expireAfterSeconds" in raw_indexes.get("created_at_1", {}):
+        await mongo_db[POLL_RAW_COLLECTION].drop_index("created_at_1")
+
+
+if __name__ == "__main__":
+    from pymongo import MongoClient
+
+    from config import MONGO_DB_URL
+
+    logging.basicConfig(level=logging.INFO)
+    if sys.argv[1:] == ["backfill"]:
+        backfill_legacy_polls(MongoClient(MONGO_DB_URL)["smart-camera"])
+        logger.info("legacy polls merged into the minute buckets")
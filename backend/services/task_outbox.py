@@ -0,0 +1,72 @@
+import logging
+from datetime import datetime, timedelta
+from typing import List
+
+from celery import Celery
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from models import TaskOutbox
+
+logger = logging.getLogger(__name__)
+
+
+def add_to_outbox(db: Session, task_name: str, **kwargs) -> TaskOutbox:
+    """Stage a Celery task in the caller's transaction; nothing is sent until ``dispatch_outbox`` after commit."""
+    entry = TaskOutbox(task_name=task_name, payload=kwargs)
+    db.add(entry)
+    return entry
+
+
+def dispatch_outbox(db: Session, celery_app: Celery, ids: List[int]) -> int:
+    """Send the given committed outbox rows and mark them dispatched, the tasks must be registered on ``celery_app``.
+
+    The mark is committed with synchronous_commit off: losing it in a crash only means the relay sends the task
+    once more, which is the at-least-once guarantee the outbox gives anyway.
+    """
+    if not ids:
+        return 0
+    entries = (
+        db.query(TaskOutbox)
+        .filter(TaskOutbox.id.in_(ids), TaskOutbox.dispatched_at.is_(None))
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    for entry in entries:
+        # through the registered task, so the queue set on its decorator applies; send_task would use the default
+        celery_app.tasks[entry.task_name].apply_async(kwargs=entry.payload)
+        entry.dispatched_at = datetime.now()
+    db.execute(text("SET LOCAL synchronous_commit TO OFF"))
+    db.commit()
+    return len(entries)
+
+
+def relay_outbox(db: Session, celery_app: Celery, older_than: int = 60, limit: int = 500) -> int:
+    """Send outbox rows that were committed but never dispatched, e.g. because the API process died in between."""
+    ids = [
+        entry_id
+        for (entry_id,) in db.query(TaskOutbox.id)
+        .filter(
+            TaskOutbox.dispatched_at.is_(None),
+            TaskOutbox.created_at < datetime.now() - timedelta(seconds=older_than),
+        )
+        .order_by(TaskOutbox.id)
+        .limit(limit)
+    ]
+    sent = dispatch_outbox(db, celery_app, ids)
+    if sent:
+        logger.info(f"task outbox relay sent {sent} pending tasks")
+    return sent
+
+
+def purge_outbox(db: Session, older_than_days: int = 7) -> int:
+    deleted = (
+        db.query(TaskOutbox)
+        .filter(
+            TaskOutbox.dispatched_at.is_not(None),
+            TaskOutbox.dispatched_at < datetime.now() - timedelta(days=older_than_days),
+        )
+        .delete(synchronize_session=False)
+    )
+    db.commit()
+    return deleted
@@ -4,6 +4,7 @@ from typing import TypedDict
 import requests
 from fastapi import HTTPException
 
+from utils import pinfl_cache
 from utils.log import timeit
 
 WSERVICE_BASE_URL = "https://wservice.uz/"
@@ -29,8 +30,13 @@ class WServiceInfoResponseType(TypedDict):
     passport_date_end: str
 
 
-@timeit
 def get_info(pinfl: str, birth_date: date) -> WServiceInfoResponseType:
+    key = f"wservice:info:{pinfl}:{birth_date}"
+    return pinfl_cache.get_or_load(key, lambda: fetch_info(pinfl, birth_date))
+
+
+@timeit
+def fetch_info(pinfl: str, birth_date: date) -> WServiceInfoResponseType:
     url = f"{WSERVICE_BASE_URL}gcp/passport/info2/"
 
     params = {"pinfl": pinfl, "birth_date": birth_date}
@@ -75,8 +81,12 @@ class WServiceParentInfoResponse(TypedDict):
     mother_birth_date: str
 
 
-@timeit
 def get_parent_info(pinfl: str) -> WServiceParentInfoResponse:
+    return pinfl_cache.get_or_load(f"wservice:parent_info:{pinfl}", lambda: fetch_parent_info(pinfl))
+
+
+@timeit
+def fetch_parent_info(pinfl: str) -> WServiceParentInfoResponse:
     url = f"{WSERVICE_BASE_URL}fhdyo/v1/act/birth?pinfl={pinfl}"
     response = requests.get(url, auth=(WSERVICE_USERNAME, WSERVICE_PASSWORD), timeout=10)
     data = response.json()["data"]
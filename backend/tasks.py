@@ -7,6 +7,7 @@ import os
 import tempfile
 import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from typing import Optional
 
@@ -24,6 +25,7 @@ from fastapi.encoders import jsonable_encoder
 from minio import Minio, S3Error
 from pymongo import MongoClient
 from requests import RequestException
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 from sqlalchemy import and_, func, update
 from sqlalchemy.orm import joinedload, selectinload
@@ -48,6 +50,7 @@ from models import (
     IdentityRelative,
     IdentitySmartCamera,
     Integrations,
+    Relative,
     SmartCamera,
     TenantEntity,
     Visitor,
@@ -55,10 +58,14 @@ from models import (
 )
 from models.identity import Package, RelativeSmartCamera
 from schemas.identity import RelativeBase
+from services.attendance_partitions import archive_attendance_partitions, ensure_attendance_partitions
+from services.device_inventory import refresh_active_devices
+from services.poll_analytics import flush_polls
+from services.task_outbox import purge_outbox, relay_outbox
 from utils.image_processing import (
     MINIO_HOST,
     MINIO_PROTOCOL,
-    check_image_HD,
+    check_images_HD,
     get_image_from_query,
     get_image_from_url,
     get_main_error_text,
@@ -66,7 +73,13 @@ from utils.image_processing import (
     make_minio_url_from_image,
     pre_process_image,
 )
-from utils.kindergarten import BASIC_AUTH, NODAVLAT_BASE_URL, get_user_photo_by_pinfl
+from utils.kindergarten import (
+    BASIC_AUTH,
+    NODAVLAT_BASE_URL,
+    get_user_photo_by_pinfl,
+    prefetch_user_photos_by_pinfl,
+)
+from utils.redis_cache import get_redis_connection
 
 rabbit_connection = None
 
@@ -99,6 +112,22 @@ app.conf.beat_schedule = {
         "task": "tasks.refresh_payment_status",
         "schedule": crontab(minute="0", hour="8-17"),
     },
+    "refresh-active-devices-every-minute": {
+        "task": "tasks.refresh_active_devices_task",
+        "schedule": crontab(),
+    },
+    "flush-poll-analytics-every-minute": {
+        "task": "tasks.flush_poll_analytics_task",
+        "schedule": crontab(),
+    },
+    "relay-task-outbox-every-minute": {
+        "task": "tasks.relay_task_outbox",
+        "schedule": crontab(),
+    },
+    "maintain-attendance-partitions-daily": {
+        "task": "tasks.maintain_attendance_partitions",
+        "schedule": crontab(minute="30", hour="3"),
+    },
     "daily-task-sync-attendance-to-platon": {
         "task": "tasks.send_attendance_leftovers_to_platon_beat_task",
         "schedule": crontab(minute="0", hour="21"),
@@ -272,34 +301,60 @@ class EventDrivenTask(Task):
 #         collection.insert_one(log_entry)
 
 
+def run_camera_manager_bulk_command(
+    request_type: str, devices: list, concurrency: int = 50, timeout: float = 20, poll_interval: float = 5
+) -> dict:
+    """Hand a command for many devices to camera_manager in one call and wait for the per-device results."""
+    if not devices:
+        return {"status": "finished", "results": {}}
+    auth = (CAMERA_MANAGER_BASIC, CAMERA_MANAGER_PASSWORD)
+    response = requests.post(
+        f"http://{CAMERA_MANAGER_URL}/devices/bulk/commands",
+        json={"request_type": request_type, "devices": devices, "concurrency": concurrency, "timeout": timeout},
+        auth=auth,
+        timeout=30,
+    )
+    response.raise_for_status()
+    job_id = response.json()["job_id"]
+    # every device wave takes at most `timeout` seconds, leave some slack for forwarding between replicas
+    deadline = time.monotonic() + (len(devices) / concurrency + 1) * (timeout + 5)
+    while True:
+        time.sleep(poll_interval)
+        job = requests.get(f"http://{CAMERA_MANAGER_URL}/devices/bulk/commands/{job_id}", auth=auth, timeout=30)
+        job.raise_for_status()
+        job = job.json()
+        if job["status"] == "finished" or time.monotonic() > deadline:
+            return job
+
+
 @app.task(bind=True, base=DatabaseTask)
 def disable_all_rtmp_scameras(self):
     db = self.get_db()
-    scameras = db.query(SmartCamera).filter_by(is_active=True).all()
-    errors = []
-    for smart_camera in scameras:
-        url = f"http://{CAMERA_MANAGER_URL}/device/{smart_camera.device_id}/equipment/setRtmpConf"
-        payload_dict = {
+    scameras = db.query(SmartCamera.id, SmartCamera.device_id, SmartCamera.password).filter_by(is_active=True).all()
+    devices = [
+        {
+            "device_id": smart_camera.device_id,
             "password": smart_camera.password,
-            "channel": 0,
-            "RtmpEnable": 0,
-            "RtmpServerAddr": f"rtmp://92.63.207.75:1935/live/livestream_{smart_camera.device_id[-5:]}",
+            "params": {
+                "channel": 0,
+                "RtmpEnable": 0,
+                "RtmpServerAddr": f"rtmp://92.63.207.75:1935/live/livestream_{smart_camera.device_id[-5:]}",
+            },
         }
-        payload = json.dumps(payload_dict)
-        response = requests.post(
-            url,
-            data=payload,
-            headers={"Content-Type": "application/json"},
-            auth=(CAMERA_MANAGER_BASIC, CAMERA_MANAGER_PASSWORD),
-        )
-        try:
-            response.raise_for_status()
-            if response.json()["code"] != 0:
-                error_response = {"id": smart_camera.id, "error": get_main_error_text(response)}
-                errors.append(error_response)
-        except Exception as e:
-            error_response = {"id": smart_camera.id, "error": str(e)}
-            errors.append(error_response)
+        for smart_camera in scameras
+    ]
+    errors = []
+    try:
+        job = run_camera_manager_bulk_command("setRtmpConf", devices)
+        results = job["results"]
+        for smart_camera in scameras:
+            result = results.get(smart_camera.device_id)
+            if result is None:
+                errors.append({"id": smart_camera.id, "error": "No response"})
+            elif not result["success"]:
+                errors.append({"id": smart_camera.id, "error": result.get("error")})
+    except RequestException as e:
+        errors.append({"id": None, "error": str(e)})
     db_mongo = get_cron_celery_mongo_db()
     post = {"task_id": self.request.id, "errors": errors, "created_at": datetime.now()}
     db_mongo["cron"].insert_one(post)
@@ -307,69 +362,122 @@ def disable_all_rtmp_scameras(self):
 
 
 def make_inference_request(snapshot_id):
-    requests.get(
-        url=BAZAAR_CALLBACK_URL + f"?snapshot_id={snapshot_id}",
-        headers={"Content-Type": "application/json"},
-    )
+    try:
+        requests.get(
+            url=BAZAAR_CALLBACK_URL + f"?snapshot_id={snapshot_id}",
+            headers={"Content-Type": "application/json"},
+            timeout=30,
+        )
+    except RequestException as e:
+        logger.info(f"make_inference_request, snapshot_id: {snapshot_id}, error: {e}")
 
 
-@app.task(bind=True)
-def refresh_payment_status():
-    requests.put(BAZAAR_PAYMENT_STATUS_URL)
+@app.task
+def refresh_active_devices_task():
+    devices, refreshed_at = refresh_active_devices()
+    return {"success": True, "devices": len(devices), "refreshed_at": refreshed_at}
 
 
 @app.task(bind=True, base=DatabaseTask)
-def get_camera_snapshots(self):
-    db: Session = self.get_db()
+def relay_task_outbox(self):
+    db = self.get_db()
+    sent = relay_outbox(db, app)
+    purged = purge_outbox(db)
+    return {"success": True, "sent": sent, "purged": purged}
 
-    smart_cameras = db.query(SmartCamera).filter(SmartCamera.tenant_id == BAZAAR_TENANT_ID, SmartCamera.is_active).all()
 
-    for each_smart_camera in smart_cameras:
-        url = f"http://{CAMERA_MANAGER_URL}/device/{each_smart_camera.device_id}/equipment/getFmtSnap"
-        payload_dict = {"password": each_smart_camera.password, "fmt": 0}
-        payload = json.dumps(payload_dict)
+@app.task(bind=True, base=DatabaseTask)
+def maintain_attendance_partitions(self):
+    db = self.get_db()
+    created = ensure_attendance_partitions(db)
+    archived = archive_attendance_partitions(db)
+    return {"success": True, "created": created, "archived": archived}
 
-        response = requests.post(
-            url,
-            data=payload,
-            headers={"Content-Type": "application/json"},
-            auth=(CAMERA_MANAGER_BASIC, CAMERA_MANAGER_PASSWORD),
-            timeout=10,
-        )
 
-        if response.status_code != 200 or response.json()["code"] != 0:
-            return None
+@app.task
+def flush_poll_analytics_task():
+    return flush_polls(get_redis_connection(), mongo_client["smart-camera"])
 
-        image_base64 = response.json()["image_base64"]
-        image = io.BytesIO(base64.b64decode(image_base64))
 
-        file_name = f"{uuid.uuid4()}.jpeg"
-        if not minio_client.bucket_exists(SNAPSHOT_BAZAAR_SCAMERA_BUCKET):
-            minio_client.make_bucket(SNAPSHOT_BAZAAR_SCAMERA_BUCKET)
-        minio_client.put_object(
-            SNAPSHOT_BAZAAR_SCAMERA_BUCKET,
-            file_name,
-            image,
-            response.json()["image_length"],
-        )
-        photo_url = f"{MINIO_PROTOCOL}://{MINIO_HOST}/{SNAPSHOT_BAZAAR_SCAMERA_BUCKET}/{file_name}"
-        new_snapshot = BazaarSmartCameraSnapshot(
-            smart_camera_id=each_smart_camera.id, snapshot_url=photo_url, tenant_id=each_smart_camera.tenant_id
-        )
+@app.task(bind=True)
+def refresh_payment_status():
+    requests.put(BAZAAR_PAYMENT_STATUS_URL)
 
-        db.add(new_snapshot)
-        db.commit()
-        db.refresh(new_snapshot)
 
-        make_inference_request(new_snapshot.id)
+SNAPSHOT_HARVEST_WORKERS = int(os.getenv("SNAPSHOT_HARVEST_WORKERS", 16))
+SNAPSHOT_FETCH_TIMEOUT = int(os.getenv("SNAPSHOT_FETCH_TIMEOUT", 10))
 
-        # request_thread = threading.Thread(target=lambda: make_inference_request(new_snapshot.id))  # noqa
 
-        # request_thread = threading.Thread(target=make_inference_request, args=(new_snapshot.id))
+def harvest_camera_snapshot(session: requests.Session, smart_camera) -> dict:
+    """Fetch one snapshot through camera_manager and upload it, never raising so one camera can't stop a sweep."""
+    result = {"smart_camera_id": smart_camera.id, "device_id": smart_camera.device_id, "photo_url": None}
+    started = time.monotonic()
+    try:
+        response = session.post(
+            f"http://{CAMERA_MANAGER_URL}/device/{smart_camera.device_id}/equipment/getFmtSnap",
+            json={"password": smart_camera.password, "fmt": 0},
+            timeout=SNAPSHOT_FETCH_TIMEOUT,
+        )
+        result["fetch_latency"] = round(time.monotonic() - started, 3)
+        data = response.json() if response.status_code == 200 else None
+        if not data or data.get("code") != 0:
+            result["error"] = get_main_error_text(response) if response.status_code != 200 else str(data)
+            return result
+        image = base64.b64decode(data["image_base64"])
+        file_name = f"{uuid.uuid4()}.jpeg"
+        minio_client.put_object(SNAPSHOT_BAZAAR_SCAMERA_BUCKET, file_name, io.BytesIO(image), len(image))
+        result["photo_url"] = f"{MINIO_PROTOCOL}://{MINIO_HOST}/{SNAPSHOT_BAZAAR_SCAMERA_BUCKET}/{file_name}"
+    except Exception as e:
+        result.setdefault("fetch_latency", round(time.monotonic() - started, 3))
+        result["error"] = str(e)
+    return result
 
-        # request_thread.daemon = True
 
-        # request_thread.start()
+@app.task(bind=True, base=DatabaseTask)
+def get_camera_snapshots(self):
+    db: Session = self.get_db()
+
+    smart_cameras = (
+        db.query(SmartCamera.id, SmartCamera.device_id, SmartCamera.password, SmartCamera.tenant_id)
+        .filter(SmartCamera.tenant_id == BAZAAR_TENANT_ID, SmartCamera.is_active)
+        .all()
+    )
+    if not smart_cameras:
+        return None
+    if not minio_client.bucket_exists(SNAPSHOT_BAZAAR_SCAMERA_BUCKET):
+        minio_client.make_bucket(SNAPSHOT_BAZAAR_SCAMERA_BUCKET)
+
+    tenant_ids = {smart_camera.id: smart_camera.tenant_id for smart_camera in smart_cameras}
+    results = []
+    with requests.Session() as session:
+        session.auth = (CAMERA_MANAGER_BASIC, CAMERA_MANAGER_PASSWORD)
+        adapter = HTTPAdapter(pool_maxsize=SNAPSHOT_HARVEST_WORKERS)
+        session.mount("http://", adapter)
+        with ThreadPoolExecutor(max_workers=SNAPSHOT_HARVEST_WORKERS) as executor:
+            futures = [executor.submit(harvest_camera_snapshot, session, camera) for camera in smart_cameras]
+            for future in as_completed(futures):
+                results.append(future.result())
+
+    new_snapshots = [
+        BazaarSmartCameraSnapshot(
+            smart_camera_id=result["smart_camera_id"],
+            snapshot_url=result["photo_url"],
+            tenant_id=tenant_ids[result["smart_camera_id"]],
+        )
+        for result in results
+        if result["photo_url"]
+    ]
+    db.add_all(new_snapshots)
+    db.commit()
+
+    with ThreadPoolExecutor(max_workers=SNAPSHOT_HARVEST_WORKERS) as executor:
+        list(executor.map(make_inference_request, [snapshot.id for snapshot in new_snapshots]))
+
+    # per-camera fetch latency and errors, for spotting slow or dead cameras
+    mongo_client["cron"]["snapshot_sweeps"].insert_one(
+        {"task_id": self.request.id, "cameras": results, "created_at": datetime.now()}
+    )
+    return {"cameras": len(smart_cameras), "snapshots": len(new_snapshots)}
 
 
 @app.task(bind=True, base=DatabaseTask)
@@ -393,13 +501,9 @@ def delete_visitors_from_scamera(self):
 def add_identity_by_task(self, tenant_entity_id: int, smart_camera_id: int):
     db = self.get_db()
     identities = db_identity_smart_camera.get_unload_identities(db, tenant_entity_id, smart_camera_id).all()
+    hd_photos = check_images_HD(identity.photo for identity in identities if identity.photo)
     for identity in identities:
-        try:
-            is_HD_image = check_image_HD(identity.photo)
-        except Exception as e:
-            print(f"Image is not HD: {identity.photo}, {e}")
-            is_HD_image = False
-        if is_HD_image:
+        if hd_photos.get(identity.photo):
             create_task_to_scamera(db, "add", smart_camera_id, identity.id, "identity")
         else:
             print(f"Image is not HD: {identity.photo}")
@@ -966,6 +1070,25 @@ def update_relative_photo_with_pinfl_task(self, relative_id: int, tenant_id: int
             logger.info(f"update_relative_photo_with_pinfl_task, error: {e}")
 
 
+@app.task(bind=True, base=DatabaseTask)
+def update_relative_photos_with_pinfl_task(self, relative_ids: list, tenant_id: int):
+    db = self.get_db()
+    relatives = db.query(Relative).filter(Relative.id.in_(relative_ids)).all()
+    prefetch_user_photos_by_pinfl([relative.pinfl for relative in relatives])
+    for relative in relatives:
+        result = get_user_photo_by_pinfl(pinfl=relative.pinfl)
+        if not result["success"]:
+            continue
+        try:
+            main_image = get_image_from_query(result["photo"])
+            relative.photo = make_minio_url_from_image(
+                minio_client, main_image, RELATIVE_IDENTITY_BUCKET, relative.pinfl, is_check_hd=False
+            )
+        except Exception as e:
+            logger.info(f"update_relative_photos_with_pinfl_task, relative_id: {relative.id}, error: {e}")
+    db.commit()
+
+
 @app.task(bind=True, base=DatabaseTask)
 def upload_relative_with_task(self, relative_id: int, tenant_id: int, tenant_entity_id: int):
     db = self.get_db()
@@ -1402,26 +1525,40 @@ class PredictTask(Task):
 @app.task(bind=True, base=DatabaseTask)
 def send_attendance_leftovers_to_platon_beat_task(self):
     db = self.get_db()
-    today = datetime.now().date().strftime("%Y-%m-%d")
-    for tenant_id in [1, 18]:  # 1 - DMTT, 18 - NMTT
-        for district_id in range(1, 210):  # 1 - 209 district ids in Uzbekistan
-            tenant_entities = (
-                db.query(TenantEntity.id, TenantEntity.external_id)
-                .filter(
-                    TenantEntity.tenant_id == tenant_id,
-                    TenantEntity.district_id == district_id,
-                    TenantEntity.hierarchy_level == 3,
-                    TenantEntity.is_active,
-                )
-                .all()
-            )
-            job = group(
-                [
-                    send_attendance_leftovers_to_platon_task.s(tenant_id, tenant_entity.external_id, today)
-                    for tenant_entity in tenant_entities
-                ]
+    today = datetime.now().date()
+    start_date = datetime.combine(today, datetime.min.time())
+    end_date = start_date + timedelta(days=1)
+    # only kindergartens that actually received attendances today can have leftovers to sync
+    mtts = (
+        db.query(TenantEntity.tenant_id, TenantEntity.district_id, TenantEntity.external_id)
+        .join(Attendance, Attendance.tenant_entity_id == TenantEntity.id)
+        .filter(
+            and_(
+                TenantEntity.tenant_id.in_([1, 18]),  # 1 - DMTT, 18 - NMTT
+                TenantEntity.hierarchy_level == 3,
+                TenantEntity.is_active,
+                TenantEntity.external_id.is_not(None),
+                Attendance.attendance_datetime >= start_date,
+                Attendance.attendance_datetime < end_date,
+                Attendance.snapshot_url.is_not(None),
+                Attendance.mismatch_entity.is_not(True),
+                Attendance.is_active,
             )
-            job.apply_async()
+        )
+        .group_by(TenantEntity.tenant_id, TenantEntity.district_id, TenantEntity.external_id)
+        .all()
+    )
+    districts = {}
+    for tenant_id, district_id, external_id in mtts:
+        districts.setdefault((tenant_id, district_id), []).append(external_id)
+    today = today.strftime("%Y-%m-%d")
+    for (tenant_id, district_id), external_ids in districts.items():
+        logger.info(f"leftovers beat: tenant_id={tenant_id}, district_id={district_id}, mtts={len(external_ids)}")
+        job = group(
+            [send_attendance_leftovers_to_platon_task.s(tenant_id, external_id, today) for external_id in external_ids]
+        )
+        job.apply_async()
+    return len(mtts)
 
 
 def send_attendance_leftovers_to_platon_service(db: Session, tenant_id: int, mtt_id: int, attendance_date: datetime):
@@ -1432,7 +1569,8 @@ def send_attendance_leftovers_to_platon_service(db: Session, tenant_id: int, mtt
     r = requests.get(url=NODAVLAT_BASE_URL + path, headers=BASIC_AUTH)
     if r.status_code != 200:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=r.text)
-    external_ids = r.json()["data"]["edus"] + r.json()["data"]["kids"]
+    data = r.json()["data"]
+    external_ids = {str(external_id) for external_id in data["edus"] + data["kids"]}
     identity_data = (
         db.query(Attendance.identity_id, func.max(Identity.external_id).label("max_external_id"))
         .join(Identity, Identity.id == Attendance.identity_id)
@@ -1445,22 +1583,24 @@ def send_attendance_leftovers_to_platon_service(db: Session, tenant_id: int, mtt
                 Attendance.mismatch_entity.is_not(True),
                 Attendance.is_active,
                 Identity.is_active,
+                Identity.external_id.is_not(None),
             )
         )
         .group_by(Attendance.identity_id)
         .all()
     )
     unsent_count = 0
-    for item in identity_data:
-        if item[1] not in external_ids:
-            send_attendance_by_identity_task.delay(
-                mtt_id,
-                item[0],
-                item[1],
-                start_date.strftime("%Y-%m-%dT%H:%M:%S"),
-                end_date.strftime("%Y-%m-%dT%H:%M:%S"),
-            )
-            unsent_count += 1
+    for identity_id, external_id in identity_data:
+        if str(external_id) in external_ids:
+            continue
+        send_attendance_by_identity_task.delay(
+            mtt_id,
+            identity_id,
+            external_id,
+            start_date.strftime("%Y-%m-%dT%H:%M:%S"),
+            end_date.strftime("%Y-%m-%dT%H:%M:%S"),
+        )
+        unsent_count += 1
     return unsent_count
 
 
@@ -0,0 +1,138 @@
+from datetime import date, datetime, time, timedelta
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from models import Attendance
+from services import attendance_partitions
+from services.attendance_partitions import (
+    ATTENDANCE_TABLE,
+    DEFAULT_PARTITION,
+    LEGACY_BOUND_CHECK,
+    LEGACY_PARTITION,
+    archive_attendance_partitions,
+    convert_attendance_to_partitioned,
+    ensure_attendance_partitions,
+    is_partitioned,
+    list_partitions,
+    month_start,
+    partition_name,
+)
+
+ARCHIVE_SCHEMA = "attendance_archive_test"
+REFERENCING_TABLE = "attendance_partitions_test_ref"
+
+
+@pytest.fixture
+def plain_attendance(db):
+    """The attendance table as it was before partitioning: keyed by id alone, with a nullable capture time."""
+    table = Attendance.__table__
+    ddl = str(CreateTable(table).compile(dialect=postgresql.dialect()))
+    db.execute(text(f"DROP TABLE {ATTENDANCE_TABLE} CASCADE"))
+    db.execute(text(ddl.split("PARTITION BY")[0]))
+    db.execute(text(f"ALTER TABLE {ATTENDANCE_TABLE} DROP CONSTRAINT {ATTENDANCE_TABLE}_pkey"))
+    db.execute(text(f"ALTER TABLE {ATTENDANCE_TABLE} ALTER COLUMN attendance_datetime DROP NOT NULL"))
+    db.execute(text(f"ALTER TABLE {ATTENDANCE_TABLE} ADD PRIMARY KEY (id)"))
+    db.execute(text(f"ALTER TABLE {ATTENDANCE_TABLE} DROP CONSTRAINT attendance_idempotency_key_key"))
+    db.execute(
+        text(f"ALTER TABLE {ATTENDANCE_TABLE} ADD CONSTRAINT attendance_idempotency_key_key UNIQUE (idempotency_key)")
+    )
+    for index in table.indexes:
+        db.connection().execute(CreateIndex(index))
+    db.execute(text(f"CREATE TABLE {REFERENCING_TABLE} (attendance_id integer REFERENCES {ATTENDANCE_TABLE} (id))"))
+    db.commit()
+    yield
+    db.rollback()
+    db.execute(text(f"DROP TABLE IF EXISTS {REFERENCING_TABLE}"))
+    db.execute(text(f"DROP SCHEMA IF EXISTS {ARCHIVE_SCHEMA} CASCADE"))
+    db.commit()
+
+
+def test_convert_ensure_archive_round_trip(db, plain_attendance, monkeypatch):
+    today = date.today()
+    future = datetime.combine(month_start(today, 2), time(9))
+    db.execute(
+        text(
+            f"INSERT INTO {ATTENDANCE_TABLE} (attendance_datetime, idempotency_key) "
+            "VALUES (:last_month, 'a'), (:now, 'b'), (NULL, 'c'), (:future, 'd')"
+        ),
+        {"last_month": datetime.combine(month_start(today, -1), time(9)), "now": datetime.now(), "future": future},
+    )
+    db.execute(text(f"INSERT INTO {REFERENCING_TABLE} SELECT id FROM {ATTENDANCE_TABLE}"))
+    db.commit()
+    last_id = db.execute(text(f"SELECT max(id) FROM {ATTENDANCE_TABLE}")).scalar()
+
+    convert_attendance_to_partitioned(db)
+
+    assert is_partitioned(db)
+    # the row stamped in the future moves the cutover past it instead of being copied out of the old table
+    cutover = month_start(today, 3)
+    partitions = {partition.name: partition.upper for partition in list_partitions(db)}
+    assert partitions[LEGACY_PARTITION] == datetime.combine(cutover, time())
+    assert DEFAULT_PARTITION in partitions
+    assert partition_name(cutover) in partitions
+    assert db.execute(text(f"SELECT count(*) FROM {ATTENDANCE_TABLE}")).scalar() == 4
+    assert db.execute(text(f"SELECT count(*) FROM {ATTENDANCE_TABLE} WHERE attendance_datetime IS NULL")).scalar() == 0
+    assert not db.execute(
+        text("SELECT 1 FROM pg_constraint WHERE conname = :name"), {"name": LEGACY_BOUND_CHECK}
+    ).scalar()
+    assert not db.execute(
+        text("SELECT 1 FROM pg_constraint WHERE contype = 'f' AND conrelid = CAST(:table AS regclass)"),
+        {"table": REFERENCING_TABLE},
+    ).scalar()
+    # every index of the parent has its counterpart on the legacy partition, none are left invalid
+    parent_indexes = db.execute(
+        text("SELECT count(*) FROM pg_index WHERE indrelid = CAST(:table AS regclass)"), {"table": ATTENDANCE_TABLE}
+    ).scalar()
+    attached_indexes = db.execute(
+        text(
+            "SELECT count(*) FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE i.indrelid = CAST(:table AS regclass) AND c.relispartition AND i.indisvalid"
+        ),
+        {"table": LEGACY_PARTITION},
+    ).scalar()
+    assert attached_indexes == parent_indexes
+
+    # the id sequence carries on and new rows are routed by capture time
+    recent = Attendance(attendance_datetime=datetime.now(), idempotency_key="e")
+    later = Attendance(attendance_datetime=datetime.combine(cutover, time(9)), idempotency_key="f")
+    db.add_all([recent, later])
+    db.commit()
+    assert recent.id > last_id
+    assert later.id > last_id
+    routed = dict(db.execute(text(f"SELECT idempotency_key, tableoid::regclass::text FROM {ATTENDANCE_TABLE}")).all())
+    assert routed["e"] == LEGACY_PARTITION
+    assert routed["f"] == partition_name(cutover)
+
+    # two years on, the legacy partition and the first monthly one are archived with their rows
+    class Later(date):
+        @classmethod
+        def today(cls):
+            return today + timedelta(days=730)
+
+    monkeypatch.setattr(attendance_partitions, "date", Later)
+    assert ensure_attendance_partitions(db)
+    archived = archive_attendance_partitions(db, keep_months=1, schema=ARCHIVE_SCHEMA)
+    assert sorted(archived) == sorted([LEGACY_PARTITION, partition_name(cutover)])
+    assert db.execute(text(f"SELECT count(*) FROM {ARCHIVE_SCHEMA}.{LEGACY_PARTITION}")).scalar() == 5
+    assert db.execute(text(f"SELECT count(*) FROM {ATTENDANCE_TABLE}")).scalar() == 0
+    assert not archive_attendance_partitions(db, keep_months=1, schema=ARCHIVE_SCHEMA)
+
+
+def test_failed_conversion_leaves_the_table_writable(db, plain_attendance, monkeypatch):
+    def fail(db, cutover):
+        raise RuntimeError("lock timeout")
+
+    monkeypatch.setattr(attendance_partitions, "_attach_legacy_attendance", fail)
+    with pytest.raises(RuntimeError):
+        convert_attendance_to_partitioned(db)
+
+    assert not is_partitioned(db)
+    assert not db.execute(
+        text("SELECT 1 FROM pg_constraint WHERE conname = :name"), {"name": LEGACY_BOUND_CHECK}
+    ).scalar()
+    # rows past the cutover the aborted run picked are still accepted
+    db.add(Attendance(attendance_datetime=datetime.combine(month_start(date.today(), 6), time(9))))
+    db.commit()
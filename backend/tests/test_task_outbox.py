@@ -0,0 +1,113 @@
+import threading
+import uuid
+from datetime import datetime
+
+import pytest
+from celery import Celery
+
+from models import Attendance, TaskOutbox
+from services.attendance_ingest import save_attendance
+from services.task_outbox import add_to_outbox, dispatch_outbox, relay_outbox
+
+BUCKET = "identity-attendance"
+
+
+@pytest.fixture
+def celery_app(monkeypatch):
+    app = Celery("task-outbox-test")
+
+    @app.task(name="tests.express_batch", queue="send_express_attendance_queue")
+    def express_batch(data):
+        return data
+
+    sent = []
+
+    def send_task(name, args=None, kwargs=None, **options):
+        sent.append({"name": name, "kwargs": kwargs, "queue": options.get("queue")})
+
+    monkeypatch.setattr(app, "send_task", send_task)
+    app.sent = sent
+    return app
+
+
+class RecordingMinio:
+    def __init__(self):
+        self.removed = []
+
+    def remove_object(self, bucket_name, object_name):
+        self.removed.append((bucket_name, object_name))
+
+
+def submit_attendance(
+    session_factory, celery_app, minio, idempotency_key: str, capture_time: datetime, barrier: threading.Barrier
+):
+    """One retry of a mobile submission through the ingestion write path, with its own upload."""
+    object_name = f"1/{uuid.uuid4()}.jpg"
+    with session_factory() as db:
+        attendance = Attendance(
+            attendance_datetime=capture_time,
+            by_mobile=True,
+            idempotency_key=idempotency_key,
+            bucket_name=BUCKET,
+            object_name=object_name,
+        )
+        barrier.wait()
+        saved = save_attendance(
+            db,
+            attendance,
+            lambda row: [("tests.express_batch", {"attendance_id": row.id})],
+            celery_app,
+            minio,
+        )
+        return object_name, saved.id
+
+
+def test_dispatch_routes_to_the_task_queue(db, celery_app):
+    entry = add_to_outbox(db, "tests.express_batch", data={"attendance_id": 0})
+    db.commit()
+
+    assert dispatch_outbox(db, celery_app, [entry.id]) == 1
+    assert celery_app.sent == [
+        {
+            "name": "tests.express_batch",
+            "kwargs": {"data": {"attendance_id": 0}},
+            "queue": "send_express_attendance_queue",
+        }
+    ]
+    # a dispatched row is never sent again
+    assert dispatch_outbox(db, celery_app, [entry.id]) == 0
+    assert len(celery_app.sent) == 1
+
+
+def test_concurrent_duplicate_submissions_enqueue_once(session_factory, db, celery_app):
+    idempotency_key = f"{uuid.uuid4()}:1"
+    capture_time = datetime.now().replace(microsecond=0)
+    minio = RecordingMinio()
+    retries = 8
+    barrier = threading.Barrier(retries, timeout=30)
+    results = []
+
+    def worker():
+        results.append(submit_attendance(session_factory, celery_app, minio, idempotency_key, capture_time, barrier))
+
+    threads = [threading.Thread(target=worker) for _ in range(retries)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == retries
+    winner = db.query(Attendance).filter_by(idempotency_key=idempotency_key).one()
+    # every retry gets the committed row back
+    assert {attendance_id for _, attendance_id in results} == {winner.id}
+    # and only the uploads of the losers are removed
+    uploads = {object_name for object_name, _ in results}
+    assert sorted(minio.removed) == sorted((BUCKET, name) for name in uploads - {winner.object_name})
+
+    # the winner dispatched right after commit and the relay finds nothing left behind
+    relay_outbox(db, celery_app, older_than=0)
+    sent = [task for task in celery_app.sent if task["kwargs"]["data"]["attendance_id"] == winner.id]
+    assert len(sent) == 1
+    assert sent[0]["queue"] == "send_express_attendance_queue"
+    staged = TaskOutbox.payload["data"]["attendance_id"].as_integer() == winner.id
+    assert db.query(TaskOutbox).filter(staged).count() == 1
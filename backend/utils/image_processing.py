@@ -1,9 +1,11 @@
 import base64
 import io
 import logging
+import math
 import os
 import uuid
-from typing import Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Optional, Tuple
 
 import cv2
 import numpy as np
@@ -15,11 +17,24 @@ from fastapi import HTTPException, status
 from PIL import ExifTags, Image, UnidentifiedImageError
 
 from utils.log import timeit
+from utils.photo_store import fetch_photo, fetch_photo_base64, fetch_photo_prefix
 
 MINIO_PROTOCOL = os.getenv("MINIO_PROTOCOL")
 MINIO_HOST = os.getenv("MINIO_HOST2")
 MINIO_HOST3 = os.getenv("MINIO_HOST3")
 
+# enough for the SOF marker of a JPEG behind a typical EXIF block, larger headers fall back to a full download
+IMAGE_HEADER_BYTES = int(os.getenv("IMAGE_HEADER_BYTES", 64 * 1024))
+HD_MIN_WIDTH, HD_MIN_HEIGHT = 480, 640
+
+# the quality steps compress_image_to_target_size_pil has always tried, best first
+JPEG_QUALITY_STEPS = list(range(100, 0, -10))
+PROBE_MIN_PIXELS = 1_000_000
+MAX_DOWNSCALE_STEPS = 3
+
+PHOTO_WORKERS = int(os.getenv("PHOTO_WORKERS", 4))
+_photo_executor = ThreadPoolExecutor(max_workers=PHOTO_WORKERS, thread_name_prefix="photo")
+
 logger = logging.getLogger(__name__)
 
 
@@ -69,7 +84,51 @@ def correct_image_orientation(image):
     return image
 
 
-def compress_image_to_target_size_pil(image, target_size_kb, tolerance=5):
+def _encode_image(image, img_format: str, quality: int) -> io.BytesIO:
+    img_bytes = io.BytesIO()
+    image.save(img_bytes, format=img_format, quality=quality)
+    return img_bytes
+
+
+def _estimate_quality_index(image, img_format: str, limit: int) -> Optional[int]:
+    """Guess the quality step that fits ``limit`` from encodes of a 1/16 area probe, None for small images."""
+    if image.width * image.height < PROBE_MIN_PIXELS:
+        return None
+    probe = image.copy()
+    probe.thumbnail((image.width // 4, image.height // 4))
+    scale = (image.width * image.height) / (probe.width * probe.height)
+    for index, quality in enumerate(JPEG_QUALITY_STEPS):
+        if _encode_image(probe, img_format, quality).tell() * scale <= limit:
+            return index
+    return len(JPEG_QUALITY_STEPS) - 1
+
+
+def _encode_to_limit(image, img_format: str, limit: int, probe: bool = True) -> Optional[io.BytesIO]:
+    """Encode at the highest quality step whose output fits ``limit`` bytes, None if even the lowest does not.
+
+    Output size falls as quality falls, so the step is found by bisection: at most four full-size encodes instead of
+    one per step, plus one when the probe guess misses.
+    """
+    encodes = {}
+
+    def fits(index: int) -> bool:
+        if index not in encodes:
+            encodes[index] = _encode_image(image, img_format, JPEG_QUALITY_STEPS[index])
+        return encodes[index].tell() <= limit
+
+    guess = _estimate_quality_index(image, img_format, limit) if probe else None
+    low, high = 0, len(JPEG_QUALITY_STEPS)
+    while low < high:
+        middle = guess if guess is not None and low <= guess < high else (low + high) // 2
+        guess = None
+        if fits(middle):
+            high = middle
+        else:
+            low = middle + 1
+    return encodes.get(low)
+
+
+def compress_image_to_target_size_pil(image, target_size_kb, tolerance=5, allow_downscale=False, probe=True):
     """
     Compress an image represented as a PIL.Image object to the target size.
 
@@ -77,38 +136,30 @@ def compress_image_to_target_size_pil(image, target_size_kb, tolerance=5):
         image (PIL.Image): The input PIL.Image object to be compressed.
         target_size_kb (int): The target size in kilobytes.
         tolerance (int): The tolerance in kilobytes for the target size.
+        allow_downscale (bool): Shrink the image when even the lowest quality does not reach the target.
+        probe (bool): Start the quality search from an estimate made on a reduced-resolution copy.
 
     Returns:
         PIL.Image: The compressed PIL.Image object.
     """
 
     img_format = image.format if image.format is not None else "JPEG"
-
-    # Convert size to bytes
-    target_size_bytes = target_size_kb * 1024
-
-    quality = 100
-
-    # Try reducing the quality to reach the target size
-    while quality > 10:
-        # Create a bytes buffer to save the image
-        img_bytes = io.BytesIO()
-        # Save image to the buffer with the current quality
-        image.save(img_bytes, format=img_format, quality=quality)
-        size_in_bytes = img_bytes.tell()
-
-        # Check if the size is within the target range
-        if size_in_bytes <= target_size_bytes + tolerance * 1024:
-            # Load the image from the buffer
-            img_bytes.seek(0)
-            return Image.open(img_bytes)
-
-        # Decrease the quality for the next loop
-        quality -= 10
-
-    # If low quality still exceeds the target size, return the image at the lowest quality tested
-    img_bytes = io.BytesIO()
-    image.save(img_bytes, format=img_format, quality=quality)
+    limit = (target_size_kb + tolerance) * 1024
+
+    img_bytes = _encode_to_limit(image, img_format, limit, probe)
+    if img_bytes is None and allow_downscale:
+        for _ in range(MAX_DOWNSCALE_STEPS):
+            lowest = _encode_image(image, img_format, JPEG_QUALITY_STEPS[-1]).tell()
+            # encoded size is roughly proportional to the pixel count
+            factor = math.sqrt(limit / lowest) * 0.95
+            image = image.resize((max(1, int(image.width * factor)), max(1, int(image.height * factor))))
+            img_bytes = _encode_to_limit(image, img_format, limit, probe)
+            if img_bytes is not None:
+                break
+
+    if img_bytes is None:
+        # If low quality still exceeds the target size, return the image at the lowest quality tested
+        img_bytes = _encode_image(image, img_format, JPEG_QUALITY_STEPS[-1])
     img_bytes.seek(0)
     return Image.open(img_bytes)
 
@@ -116,21 +167,16 @@ def compress_image_to_target_size_pil(image, target_size_kb, tolerance=5):
 @timeit
 def image_url_to_base64(image_url: str = None) -> str | None:
     try:
-        response = requests.get(image_url)
-        response.raise_for_status()
-        image_data = io.BytesIO(response.content)
-        base64_image = base64.b64encode(image_data.read()).decode("utf-8")
-        return base64_image
-    except Exception:
+        return fetch_photo_base64(image_url)
+    except Exception as e:
+        logger.info(f"image_url_to_base64 failed for {image_url}: {e}")
         return None
 
 
 @timeit
 def get_image_from_url(url: str) -> bytes:
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        image = response.content
+        image = fetch_photo(url)
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e)) from e
     return image
@@ -174,7 +220,7 @@ def make_minio_url_from_image(
         pil_image = Image.open(io.BytesIO(image))
         pil_image = correct_image_orientation(pil_image)
         if is_check_hd:  # noqa
-            if pil_image.width < 480 or pil_image.height < 640:
+            if not is_hd_size(pil_image.width, pil_image.height):
                 raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Image is not HD")
 
         # check if image size is less than 50kb then return bad request
@@ -203,11 +249,105 @@ def extract_minio_url(url: str) -> Tuple[str, str]:
     return bucket_name, object_name
 
 
+def remove_minio_urls(minio_client, urls: Iterable[str]) -> None:
+    for url in urls:
+        try:
+            minio_client.remove_object(*extract_minio_url(url))
+        except Exception as e:
+            logger.warning(f"Failed to remove {url}: {e}")
+
+
+def make_minio_urls_from_images(
+    minio_client,
+    photos: Dict[str, str],
+    bucket_name: str,
+    pinfl: Optional[str] = None,
+    unchecked: Iterable[str] = (),
+    minio_host: Optional[str] = MINIO_HOST,
+) -> Dict[str, str]:
+    """make_minio_url_from_image for several photos (urls or base64) at once, keyed by the same names as ``photos``.
+
+    Photos are fetched, decoded, compressed and uploaded in parallel on a bounded pool; PIL and the network release
+    the GIL, so threads are enough. It is all or nothing: if any photo fails, the ones already uploaded are removed
+    and the error of the first failing photo, in ``photos`` order, is raised. Photos named in ``unchecked`` skip the
+    HD and size checks.
+    """
+    unchecked = set(unchecked)
+
+    def process(name: str) -> str:
+        image = get_image_from_query(photos[name])
+        return make_minio_url_from_image(
+            minio_client,
+            image,
+            bucket_name,
+            pinfl,
+            is_check_hd=name not in unchecked,
+            is_check_size=name not in unchecked,
+            minio_host=minio_host,
+        )
+
+    futures = {name: _photo_executor.submit(process, name) for name in photos}
+    urls, error = {}, None
+    for name, future in futures.items():
+        try:
+            urls[name] = future.result()
+        except Exception as e:
+            error = error or e
+    if error:
+        remove_minio_urls(minio_client, urls.values())
+        raise error
+    return urls
+
+
+def read_image_size(data: bytes) -> Optional[Tuple[int, int, str]]:
+    """Width, height and format of an encoded image after EXIF rotation, read from its header only.
+
+    PIL parses just the header on open, so a prefix of the file is enough; None means the prefix did not contain
+    the whole header.
+    """
+    try:
+        pil_image = Image.open(io.BytesIO(data))
+        orientation = pil_image.getexif().get(0x0112)
+    except Exception:
+        # PIL raises a variety of errors on a cut-off header
+        return None
+    width, height = pil_image.size
+    # the same rotations correct_image_orientation applies
+    if orientation in (6, 8):
+        width, height = height, width
+    return width, height, pil_image.format
+
+
+def is_hd_size(width: int, height: int) -> bool:
+    return width >= HD_MIN_WIDTH and height >= HD_MIN_HEIGHT
+
+
 def check_image_HD(image_url: str) -> bool:
-    image = get_image_from_query(image_url)
-    pil_image = Image.open(io.BytesIO(image))
-    pil_image = correct_image_orientation(pil_image)
-    return pil_image.width >= 480 and pil_image.height >= 640
+    if is_image_url(image_url):
+        header = fetch_photo_prefix(image_url, IMAGE_HEADER_BYTES)
+        size = read_image_size(header)
+        if size is None and len(header) >= IMAGE_HEADER_BYTES:
+            size = read_image_size(get_image_from_url(image_url))
+    else:
+        size = read_image_size(get_image_from_query(image_url))
+    if size is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid photo")
+    return is_hd_size(size[0], size[1])
+
+
+def check_images_HD(image_urls: Iterable[str], max_workers: int = 8) -> Dict[str, bool]:
+    """check_image_HD for many photos at once; photos that cannot be read count as not HD."""
+
+    def check(image_url: str) -> bool:
+        try:
+            return check_image_HD(image_url)
+        except Exception as e:
+            logger.info(f"HD check failed for {image_url}: {e}")
+            return False
+
+    image_urls = list(dict.fromkeys(image_urls))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return dict(zip(image_urls, executor.map(check, image_urls)))
 
 
 def get_image_from_query(data: str) -> bytes:
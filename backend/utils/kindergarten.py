@@ -1,7 +1,10 @@
 import os
+from functools import partial
+from typing import List
 
 import requests
 
+from utils import pinfl_cache
 from utils.log import timeit
 
 NODAVLAT_BASE_URL = os.getenv("NODAVLAT_BASE_URL")
@@ -55,11 +58,42 @@ def get_auth_user(username: str, password: str, user_agent: str = None) -> dict:
     return {"success": False, "data": None, "code": r.status_code, "error": r.text}
 
 
-@timeit
 def get_user_photo_by_pinfl(pinfl: str) -> dict:
+    """Passport photo by pinfl, served from the content-addressed MinIO copy when it is already known."""
+    failure = {}
+
+    def loader():
+        result = fetch_user_photo_by_pinfl(pinfl)
+        if not result["success"]:
+            failure.update(result)
+            return None
+        return {"object_name": pinfl_cache.store_photo(result["photo"])}
+
+    entry = pinfl_cache.get_or_load(f"wservice:photo:{pinfl}", loader)
+    if entry is None:
+        return failure
+    photo = pinfl_cache.load_photo(entry["object_name"])
+    if photo is None:
+        return fetch_user_photo_by_pinfl(pinfl)
+    return {"success": True, "photo": photo, "code": 200, "error": None}
+
+
+def prefetch_user_photos_by_pinfl(pinfls: List[str]) -> List[str]:
+    """Warm the photo cache for a bulk sync, returns the pinfls that had to be fetched."""
+
+    def loader(pinfl: str):
+        result = fetch_user_photo_by_pinfl(pinfl)
+        return {"object_name": pinfl_cache.store_photo(result["photo"])} if result["success"] else None
+
+    loaders = {f"wservice:photo:{pinfl}": partial(loader, pinfl) for pinfl in set(pinfls) if pinfl}
+    return [key.rsplit(":", 1)[1] for key in pinfl_cache.prefetch(loaders)]
+
+
+@timeit
+def fetch_user_photo_by_pinfl(pinfl: str) -> dict:
     birth_date = get_birth_date_from_pinfl(pinfl)
     url = f"{WSERVICE_BASE_URL}v1/passport/photo?pinfl={pinfl}&birth_date={birth_date}"
-    r = requests.get(url, auth=("one_system", "Y16!-}T'3M')90K6$Pk@"))
+    r = requests.get(url, auth=("one_system", "Y16!-}T'3M')90K6$Pk@"), timeout=10)
     if r.status_code == 200:
         response = r.json()["data"]
         return {"success": True, "photo": response["photo"], "code": 200, "error": None}
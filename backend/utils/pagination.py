@@ -1,4 +1,77 @@
-from fastapi import Query
+import base64
+import json
+from datetime import datetime
+from typing import Generic, List, Literal, Optional, Sequence, TypeVar
+
+from fastapi import HTTPException, Query, status
 from fastapi_pagination import Page
+from pydantic import BaseModel
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Query as SQLAQuery
 
 CustomPage = Page.with_custom_options(size=Query(20, ge=1, le=100))
+
+T = TypeVar("T")
+
+CountMode = Literal["none", "estimate", "exact"]
+
+
+class CursorPage(BaseModel, Generic[T]):
+    items: List[T]
+    size: int
+    next_cursor: Optional[str] = None
+    total: Optional[int] = None
+
+
+def encode_cursor(values: Sequence) -> str:
+    raw = json.dumps([value.isoformat() if isinstance(value, datetime) else value for value in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str, columns: Sequence) -> tuple:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if len(values) != len(columns):
+            raise ValueError(cursor)
+        return tuple(
+            datetime.fromisoformat(value) if column.type.python_type is datetime else value
+            for column, value in zip(columns, values)
+        )
+    except (ValueError, TypeError, NotImplementedError) as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor") from e
+
+
+def estimate_count(query: SQLAQuery) -> int:
+    """Row estimate of the planner for ``query``, without executing it."""
+    session = query.session
+    compiled = query.statement.compile(dialect=session.bind.dialect)
+    plan = session.connection().exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def keyset_paginate(
+    query: SQLAQuery, columns: Sequence, cursor: Optional[str] = None, size: int = 20, count: CountMode = "none"
+) -> dict:
+    """Page through ``query`` newest first by ``columns`` (descending, unique together) instead of by offset.
+
+    ``cursor`` is the opaque ``next_cursor`` of the previous page, so every page costs the same index range scan no
+    matter how deep it is. Counting the full result is what makes large lists slow, so it is skipped by default;
+    ``count="estimate"`` returns the planner's estimate and ``count="exact"`` a real count.
+    """
+    total = None
+    if count == "exact":
+        total = query.order_by(None).count()
+    elif count == "estimate":
+        total = estimate_count(query.order_by(None))
+
+    if cursor:
+        query = query.filter(tuple_(*columns) < tuple_(*decode_cursor(cursor, columns)))
+    items = query.order_by(None).order_by(*(column.desc() for column in columns)).limit(size + 1).all()
+
+    next_cursor = None
+    if len(items) > size:
+        items = items[:size]
+        next_cursor = encode_cursor([getattr(items[-1], column.key) for column in columns])
+    return {"items": items, "size": size, "next_cursor": next_cursor, "total": total}
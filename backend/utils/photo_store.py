@@ -0,0 +1,222 @@
+import base64
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+import requests
+from minio import Minio, S3Error
+
+from database.minio_client import get_minio_client, get_minio_ssd_client
+
+MINIO_HOST = os.getenv("MINIO_HOST2")
+MINIO_HOST3 = os.getenv("MINIO_HOST3")
+
+PHOTO_CONNECT_TIMEOUT = float(os.getenv("PHOTO_CONNECT_TIMEOUT", 3))
+PHOTO_READ_TIMEOUT = float(os.getenv("PHOTO_READ_TIMEOUT", 10))
+PHOTO_MAX_BYTES = int(os.getenv("PHOTO_MAX_BYTES", 20 * 1024 * 1024))
+PHOTO_CACHE_SIZE = int(os.getenv("PHOTO_CACHE_SIZE", 256))
+# how long an object's etag is trusted before it is checked again with a HEAD request
+PHOTO_ETAG_TTL = int(os.getenv("PHOTO_ETAG_TTL", 60))
+PHOTO_DISK_CACHE_DIR = os.getenv("PHOTO_DISK_CACHE_DIR")
+PHOTO_DISK_CACHE_MAX_BYTES = int(os.getenv("PHOTO_DISK_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+logger = logging.getLogger(__name__)
+
+
+class PhotoFetchError(Exception):
+    pass
+
+
+def _minio_clients() -> dict:
+    # public host a photo url is built with -> client of the MinIO deployment behind it
+    return {MINIO_HOST: get_minio_client, MINIO_HOST3: get_minio_ssd_client}
+
+
+def resolve_minio_url(url: str) -> Optional[Tuple[Minio, str, str]]:
+    """Client, bucket and object name for a url pointing at one of our MinIO hosts, None for anything else."""
+    parts = urlsplit(url)
+    get_client = _minio_clients().get(parts.netloc)
+    if get_client is None:
+        return None
+    bucket_name, _, object_name = unquote(parts.path).lstrip("/").partition("/")
+    if not bucket_name or not object_name:
+        return None
+    return get_client(), bucket_name, object_name
+
+
+class PhotoCache:
+    """Bounded LRU of base64 photos keyed by object and etag, optionally backed by a size-capped directory.
+
+    The directory is shared by all worker processes on a host, so a photo fetched by one of them is a disk hit for
+    the rest.
+    """
+
+    def __init__(self, max_size: int = PHOTO_CACHE_SIZE, disk_dir: str = None, disk_max_bytes: int = None):
+        self.max_size = max_size
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()
+        self._etags = {}
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def get_etag(self, location: tuple) -> Optional[str]:
+        with self._lock:
+            etag, checked_at = self._etags.get(location, (None, 0))
+        return etag if time.time() - checked_at < PHOTO_ETAG_TTL else None
+
+    def set_etag(self, location: tuple, etag: str) -> None:
+        with self._lock:
+            self._etags[location] = (etag, time.time())
+            while len(self._etags) > self.max_size * 4:
+                self._etags.pop(next(iter(self._etags)))
+
+    def get(self, key: tuple) -> Optional[str]:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        value = self._read_disk(key)
+        if value is not None:
+            self._remember(key, value)
+        return value
+
+    def set(self, key: tuple, value: str) -> None:
+        self._remember(key, value)
+        self._write_disk(key, value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._etags.clear()
+
+    def _remember(self, key: tuple, value: str) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _disk_path(self, key: tuple) -> str:
+        return os.path.join(self.disk_dir, hashlib.sha1(repr(key).encode()).hexdigest() + ".b64")
+
+    def _read_disk(self, key: tuple) -> Optional[str]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path) as file:
+                value = file.read()
+            os.utime(path)
+            return value
+        except OSError:
+            return None
+
+    def _write_disk(self, key: tuple, value: str) -> None:
+        if not self.disk_dir:
+            return
+        try:
+            with tempfile.NamedTemporaryFile("w", dir=self.disk_dir, suffix=".tmp", delete=False) as file:
+                file.write(value)
+            os.replace(file.name, self._disk_path(key))
+            self._trim_disk()
+        except OSError as e:
+            logger.warning(f"photo disk cache write failed: {e}")
+
+    def _trim_disk(self) -> None:
+        files = [entry for entry in os.scandir(self.disk_dir) if entry.name.endswith(".b64")]
+        total = sum(entry.stat().st_size for entry in files)
+        if total <= self.disk_max_bytes:
+            return
+        for entry in sorted(files, key=lambda item: item.stat().st_mtime):
+            try:
+                total -= entry.stat().st_size
+                os.remove(entry.path)
+            except OSError:
+                continue
+            if total <= self.disk_max_bytes:
+                break
+
+
+photo_cache = PhotoCache(disk_dir=PHOTO_DISK_CACHE_DIR, disk_max_bytes=PHOTO_DISK_CACHE_MAX_BYTES)
+
+
+def _read_object(minio_client: Minio, bucket_name: str, object_name: str, length: int = 0) -> bytes:
+    response = None
+    try:
+        response = minio_client.get_object(bucket_name, object_name, length=length)
+        return response.read()
+    except S3Error as e:
+        raise PhotoFetchError(f"{bucket_name}/{object_name}: {e.code}") from e
+    finally:
+        if response:
+            response.close()
+            response.release_conn()
+
+
+def _download(url: str, length: int = 0) -> bytes:
+    headers = {"Range": f"bytes=0-{length - 1}"} if length else None
+    try:
+        with requests.get(
+            url, headers=headers, timeout=(PHOTO_CONNECT_TIMEOUT, PHOTO_READ_TIMEOUT), stream=True
+        ) as response:
+            response.raise_for_status()
+            content = bytearray()
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                content.extend(chunk)
+                if length and len(content) >= length:
+                    # servers that ignore Range send the whole body, stop reading once we have the prefix
+                    return bytes(content[:length])
+                if len(content) > PHOTO_MAX_BYTES:
+                    raise PhotoFetchError(f"{url}: photo is larger than {PHOTO_MAX_BYTES} bytes")
+            return bytes(content)
+    except requests.RequestException as e:
+        raise PhotoFetchError(f"{url}: {e}") from e
+
+
+def fetch_photo(url: str) -> bytes:
+    """Photo bytes; our MinIO urls are read through the MinIO client, other urls with strict timeouts."""
+    resolved = resolve_minio_url(url)
+    if resolved is None:
+        return _download(url)
+    return _read_object(*resolved)
+
+
+def fetch_photo_prefix(url: str, length: int) -> bytes:
+    """The first ``length`` bytes of a photo (fewer if it is smaller), fetched with a ranged GET."""
+    resolved = resolve_minio_url(url)
+    if resolved is None:
+        return _download(url, length)
+    return _read_object(*resolved, length=length)
+
+
+def fetch_photo_base64(url: str) -> str:
+    """Base64 photo for device payloads, cached per object etag so pushing one photo to many cameras reads it once."""
+    resolved = resolve_minio_url(url)
+    if resolved is None:
+        return base64.b64encode(_download(url)).decode("utf-8")
+
+    minio_client, bucket_name, object_name = resolved
+    location = (urlsplit(url).netloc, bucket_name, object_name)
+    etag = photo_cache.get_etag(location)
+    if etag is None:
+        try:
+            etag = minio_client.stat_object(bucket_name, object_name).etag
+        except S3Error as e:
+            raise PhotoFetchError(f"{bucket_name}/{object_name}: {e.code}") from e
+        photo_cache.set_etag(location, etag)
+
+    key = (*location, etag)
+    cached = photo_cache.get(key)
+    if cached is not None:
+        return cached
+    value = base64.b64encode(_read_object(minio_client, bucket_name, object_name)).decode("utf-8")
+    photo_cache.set(key, value)
+    return value
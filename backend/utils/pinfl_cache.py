@@ -0,0 +1,134 @@
+import base64
+import contextlib
+import hashlib
+import io
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Optional
+
+from minio import S3Error
+from redis import RedisError
+
+from database.minio_client import get_minio_client
+from utils.redis_cache import get_redis_connection
+
+PINFL_CACHE_SOFT_TTL = int(os.getenv("PINFL_CACHE_SOFT_TTL", 7 * 24 * 60 * 60))
+PINFL_CACHE_HARD_TTL = int(os.getenv("PINFL_CACHE_HARD_TTL", 90 * 24 * 60 * 60))
+PINFL_PHOTO_BUCKET = os.getenv("MINIO_PINFL_PHOTO_BUCKET", "pinfl-photo")
+
+logger = logging.getLogger(__name__)
+
+_redis_client = None
+_photo_bucket_ready = False
+_refresh_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="pinfl-refresh")
+
+
+def _get_redis():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = get_redis_connection()
+    return _redis_client
+
+
+def _read(key: str) -> Optional[dict]:
+    try:
+        value = _get_redis().get(key)
+        return json.loads(value) if value else None
+    except (RedisError, json.JSONDecodeError, TypeError):
+        return None
+
+
+def _write(key: str, data) -> None:
+    entry = {"data": data, "fetched_at": time.time()}
+    try:
+        _get_redis().set(key, json.dumps(entry), ex=PINFL_CACHE_HARD_TTL)
+    except RedisError as e:
+        logger.warning(f"pinfl cache write failed for {key}: {e}")
+
+
+def _refresh(key: str, loader: Callable[[], Optional[dict]]) -> None:
+    try:
+        data = loader()
+        if data is not None:
+            _write(key, data)
+    except Exception as e:
+        logger.info(f"pinfl cache refresh failed for {key}: {e}")
+    finally:
+        with contextlib.suppress(RedisError):
+            _get_redis().delete(f"{key}:refreshing")
+
+
+def _schedule_refresh(key: str, loader: Callable[[], Optional[dict]]) -> None:
+    try:
+        # only one worker across the cluster refreshes a given key at a time
+        if not _get_redis().set(f"{key}:refreshing", 1, nx=True, ex=60):
+            return
+    except RedisError:
+        return
+    _refresh_executor.submit(_refresh, key, loader)
+
+
+def get_or_load(key: str, loader: Callable[[], Optional[dict]]):
+    """Stale-while-revalidate lookup.
+
+    Fresh entries are returned as is, entries older than the soft TTL are returned immediately and refreshed in
+    the background, and misses call ``loader`` synchronously. A loader returning None marks an unsuccessful
+    upstream response which is passed through without being cached.
+    """
+    entry = _read(key)
+    if entry:
+        if time.time() - entry["fetched_at"] > PINFL_CACHE_SOFT_TTL:
+            _schedule_refresh(key, loader)
+        return entry["data"]
+    data = loader()
+    if data is not None:
+        _write(key, data)
+    return data
+
+
+def is_cached(key: str) -> bool:
+    entry = _read(key)
+    return bool(entry) and time.time() - entry["fetched_at"] <= PINFL_CACHE_SOFT_TTL
+
+
+def store_photo(photo: str) -> str:
+    """Store a base64 photo in MinIO under its content hash and return the object name."""
+    image = base64.b64decode(photo)
+    object_name = f"{hashlib.sha256(image).hexdigest()}.jpeg"
+    minio_client = get_minio_client()
+    global _photo_bucket_ready
+    if not _photo_bucket_ready:
+        if not minio_client.bucket_exists(PINFL_PHOTO_BUCKET):
+            minio_client.make_bucket(PINFL_PHOTO_BUCKET)
+        _photo_bucket_ready = True
+    try:
+        minio_client.stat_object(PINFL_PHOTO_BUCKET, object_name)
+    except S3Error:
+        minio_client.put_object(PINFL_PHOTO_BUCKET, object_name, io.BytesIO(image), len(image))
+    return object_name
+
+
+def load_photo(object_name: str) -> Optional[str]:
+    response = None
+    try:
+        response = get_minio_client().get_object(PINFL_PHOTO_BUCKET, object_name)
+        return base64.b64encode(response.read()).decode()
+    except S3Error:
+        return None
+    finally:
+        if response:
+            response.close()
+            response.release_conn()
+
+
+def prefetch(keys_loaders: Dict[str, Callable[[], Optional[dict]]], max_workers: int = 8) -> Iterable[str]:
+    """Warm the cache for many keys at once, only calling the upstream for missing or stale entries."""
+    missing = {key: loader for key, loader in keys_loaders.items() if not is_cached(key)}
+    if not missing:
+        return []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(lambda item: _refresh(*item), missing.items()))
+    return list(missing)
@@ -1,14 +1,32 @@
-import json
+import contextlib
+import math
 import os
+import random
+import time
 from datetime import datetime
+from typing import Callable, Iterable, Optional
 
+import orjson
 import redis
+import redis.asyncio
 from dotenv import find_dotenv, load_dotenv
-from redis import Redis
+from pydantic import BaseModel
+from redis import Redis, RedisError
+from sqlalchemy import event
+from sqlalchemy.orm import Session
 
 load_dotenv(find_dotenv())
 
 REDIS_URL = os.getenv("REDIS_URL")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 100))
+
+CACHE_LOCK_TIMEOUT = 30
+CACHE_LOCK_WAIT = 10
+CACHE_TAG_TTL = 24 * 60 * 60
+
+_pool: Optional[redis.ConnectionPool] = None
+_async_pool: Optional[redis.asyncio.ConnectionPool] = None
+_tagged_models = {}
 
 
 def serialize_tenant_entity(entity):
@@ -27,28 +45,163 @@ def serialize_tenant_entity(entity):
 
 
 def get_redis_connection():
-    return redis.from_url(REDIS_URL, encoding="utf-8", decode_responses=True)
+    """Client on the process-wide connection pool; cheap to create, so it stays usable as a FastAPI dependency."""
+    global _pool
+    if _pool is None:
+        _pool = redis.ConnectionPool.from_url(
+            REDIS_URL, encoding="utf-8", decode_responses=True, max_connections=REDIS_MAX_CONNECTIONS
+        )
+    return redis.Redis(connection_pool=_pool)
 
 
-def get_from_redis(redis_client: Redis, key: str):
-    value = redis_client.get(key)
-    try:
-        return json.loads(value)
-    except (json.JSONDecodeError, TypeError):
-        return None
+def get_async_redis_connection():
+    global _async_pool
+    if _async_pool is None:
+        _async_pool = redis.asyncio.ConnectionPool.from_url(REDIS_URL, encoding="utf-8", decode_responses=True)
+    return redis.asyncio.Redis(connection_pool=_async_pool)
 
 
 def serialize_datetime(obj):
     if isinstance(obj, datetime):
         return obj.isoformat()
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
     raise TypeError(f"Type {type(obj)} not serializable")
 
 
-def set_to_redis(redis_client: Redis, key: str, value, expire: int = 1800):
-    redis_client.set(key, json.dumps(value, default=serialize_datetime), ex=expire)
+def dumps(value) -> bytes:
+    return orjson.dumps(value, default=serialize_datetime, option=orjson.OPT_NON_STR_KEYS)
+
+
+def loads(value):
+    return orjson.loads(value)
+
+
+def get_from_redis(redis_client: Redis, key: str):
+    value = redis_client.get(key)
+    try:
+        return loads(value)
+    except (orjson.JSONDecodeError, TypeError):
+        return None
+
+
+def tag_key(tag: str) -> str:
+    return f"cache_tag:{tag}"
+
+
+def add_to_tags(pipe, key: str, tags: Iterable[str], expire: int = CACHE_TAG_TTL):
+    for tag in tags:
+        pipe.sadd(tag_key(tag), key)
+        # the tag set has to outlive every key in it
+        pipe.expire(tag_key(tag), max(expire, CACHE_TAG_TTL))
+
+
+def set_to_redis(redis_client: Redis, key: str, value, expire: int = 1800, tags: Iterable[str] = ()):
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.set(key, dumps(value), ex=expire)
+    add_to_tags(pipe, key, tags, expire)
+    pipe.execute()
     return value
 
 
 def set_to_redis_unlimited(redis_client: Redis, key: str, value):
-    redis_client.set(key, json.dumps(value))
+    redis_client.set(key, dumps(value))
     return value
+
+
+def invalidate_tags(redis_client: Redis, *tags: str) -> int:
+    """Delete every key stored under any of ``tags`` together with the tag sets themselves."""
+    deleted = 0
+    for tag in tags:
+        keys = redis_client.smembers(tag_key(tag))
+        deleted += redis_client.delete(tag_key(tag), *keys)
+    return deleted
+
+
+def get_or_set(
+    redis_client: Redis,
+    key: str,
+    loader: Callable[[], object],
+    expire: int = 1800,
+    tags: Iterable[str] = (),
+    beta: float = 1.0,
+):
+    """Read-through cache with single-flight misses and probabilistic early refresh.
+
+    Entries remember how long ``loader`` took. A reader recomputes ahead of expiry with a probability that grows as
+    the expiry nears and with the cost of the load ("XFetch"), so hot keys are refreshed by one request before they
+    expire instead of by all of them after. Only the holder of ``<key>:lock`` calls the loader; on a real miss the
+    others wait for it and load themselves only if no value shows up within CACHE_LOCK_WAIT seconds.
+    """
+    entry = _read_entry(redis_client, key)
+    if entry is not None:
+        value, delta, expires_at = entry
+        if time.time() - delta * beta * math.log(random.random() or 1e-12) < expires_at:
+            return value
+        # early refresh: whoever gets the lock recomputes, everyone else keeps serving the current value
+        lock = redis_client.lock(f"{key}:lock", timeout=CACHE_LOCK_TIMEOUT, blocking=False)
+    else:
+        lock = redis_client.lock(f"{key}:lock", timeout=CACHE_LOCK_TIMEOUT, blocking_timeout=CACHE_LOCK_WAIT)
+    try:
+        acquired = lock.acquire()
+    except RedisError:
+        acquired = False
+    if not acquired:
+        return entry[0] if entry is not None else loader()
+    try:
+        if entry is None:
+            # the previous lock holder may have filled it while we waited
+            filled = _read_entry(redis_client, key)
+            if filled is not None:
+                return filled[0]
+        started = time.time()
+        value = loader()
+        delta = time.time() - started
+        set_to_redis(redis_client, key, {"v": value, "d": delta, "e": time.time() + expire}, expire=expire, tags=tags)
+        return value
+    finally:
+        with contextlib.suppress(RedisError):
+            lock.release()
+
+
+def _read_entry(redis_client: Redis, key: str):
+    entry = get_from_redis(redis_client, key)
+    if not isinstance(entry, dict) or "v" not in entry:
+        return None
+    return entry["v"], entry["d"], entry["e"]
+
+
+def entity_tag(kind: str, tenant_entity_id) -> str:
+    return f"{kind}:{tenant_entity_id}"
+
+
+def invalidate_on_write(model: type, kind: str, attribute: str = "tenant_entity_id") -> None:
+    """Drop the ``entity_tag(kind, <row.attribute>)`` keys after a commit that wrote ``model`` rows through the ORM."""
+    _tagged_models[model] = (kind, attribute)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_tags(session, flush_context):
+    if not _tagged_models:
+        return
+    tags = session.info.setdefault("redis_cache_tags", set())
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        tagged = _tagged_models.get(type(instance))
+        if tagged:
+            kind, attribute = tagged
+            value = getattr(instance, attribute, None)
+            if value is not None:
+                tags.add(entity_tag(kind, value))
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_tags(session):
+    tags = session.info.pop("redis_cache_tags", None)
+    if tags:
+        with contextlib.suppress(RedisError):
+            invalidate_tags(get_redis_connection(), *tags)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_tags(session):
+    session.info.pop("redis_cache_tags", None)
@@ -0,0 +1,167 @@
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional
+
+from redis import RedisError
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from utils.redis_cache import get_redis_connection
+
+REFERENCE_CACHE_TTL = int(os.getenv("REFERENCE_CACHE_TTL", 300))
+REFERENCE_CACHE_MAX_SIZE = int(os.getenv("REFERENCE_CACHE_MAX_SIZE", 50000))
+INVALIDATION_CHANNEL = "reference_cache:invalidate"
+
+logger = logging.getLogger(__name__)
+
+_caches: Dict[str, "ReferenceCache"] = {}
+_watched: Dict[type, tuple] = {}
+_listener_lock = threading.Lock()
+_listener_thread: Optional[threading.Thread] = None
+_redis_client = None
+
+
+def _get_redis():
+    global _redis_client
+    if _redis_client is None:
+        _redis_client = get_redis_connection()
+    return _redis_client
+
+
+class ReferenceCache:
+    """Per-process LRU cache for rarely written reference rows.
+
+    Entries are dropped when another process publishes an invalidation for them and expire after ``ttl`` seconds
+    in any case, which bounds staleness if a message is missed. Every invalidation bumps ``version``; a value
+    loaded while the version changed is returned but not stored, so a load racing a write cannot resurrect the old
+    row. Loaders must return plain values (not ORM instances) and None for misses, which are never cached.
+    """
+
+    def __init__(self, namespace: str, ttl: int = REFERENCE_CACHE_TTL, max_size: int = REFERENCE_CACHE_MAX_SIZE):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.max_size = max_size
+        self.version = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        _caches[namespace] = self
+
+    def get(self, key: Hashable, loader: Callable[[], object]):
+        _ensure_listener()
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            version = self.version
+            self.misses += 1
+        value = loader()
+        if value is not None:
+            with self.lock:
+                if self.version == version:
+                    self.entries[key] = (now + self.ttl, value)
+                    self.entries.move_to_end(key)
+                    while len(self.entries) > self.max_size:
+                        self.entries.popitem(last=False)
+        return value
+
+    def discard(self, key: Hashable = None):
+        with self.lock:
+            self.version += 1
+            if key is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(key, None)
+
+    def stats(self) -> dict:
+        return {"size": len(self.entries), "version": self.version, "hits": self.hits, "misses": self.misses}
+
+
+def _encode_key(key):
+    return list(key) if isinstance(key, tuple) else key
+
+
+def _decode_key(key):
+    return tuple(key) if isinstance(key, list) else key
+
+
+def invalidate(namespace: str, key: Hashable = None) -> None:
+    """Drop ``key`` (or the whole namespace) here and in every other process subscribed to the channel."""
+    cache = _caches.get(namespace)
+    if cache:
+        cache.discard(key)
+    try:
+        _get_redis().publish(INVALIDATION_CHANNEL, json.dumps({"namespace": namespace, "key": _encode_key(key)}))
+    except RedisError as e:
+        logger.warning(f"reference cache invalidation publish failed for {namespace}:{key}: {e}")
+
+
+def _listen():
+    while True:
+        try:
+            pubsub = _get_redis().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            # anything published while we were not subscribed is lost, start from a clean slate
+            for cache in _caches.values():
+                cache.discard()
+            for message in pubsub.listen():
+                data = json.loads(message["data"])
+                cache = _caches.get(data["namespace"])
+                if cache:
+                    cache.discard(_decode_key(data.get("key")))
+        except Exception as e:
+            logger.warning(f"reference cache listener reconnecting: {e}")
+            time.sleep(1)
+
+
+def _ensure_listener():
+    global _listener_thread
+    if _listener_thread is not None and _listener_thread.is_alive():
+        return
+    with _listener_lock:
+        if _listener_thread is None or not _listener_thread.is_alive():
+            _listener_thread = threading.Thread(target=_listen, name="reference-cache-invalidation", daemon=True)
+            _listener_thread.start()
+
+
+def watch(model: type, namespace: str, key: Callable[[object], Hashable] = None, on_insert: bool = False) -> None:
+    """Invalidate ``namespace`` whenever a ``model`` row is written through an ORM session.
+
+    ``key`` maps the instance to its cache key; without it the whole namespace is dropped. Inserts are ignored
+    unless ``on_insert`` is set because misses are never cached. Bulk ``update()`` statements bypass this and are
+    only covered by the TTL.
+    """
+    _watched[model] = (namespace, key, on_insert)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_invalidations(session, flush_context):
+    pending = session.info.setdefault("reference_cache_invalidations", set())
+    for instances, is_insert in ((session.new, True), (session.dirty, False), (session.deleted, False)):
+        for instance in instances:
+            watched = _watched.get(type(instance))
+            if not watched:
+                continue
+            namespace, key, on_insert = watched
+            if is_insert and not on_insert:
+                continue
+            pending.add((namespace, key(instance) if key else None))
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_invalidations(session):
+    for namespace, key in session.info.pop("reference_cache_invalidations", ()):
+        invalidate(namespace, key)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_invalidations(session):
+    session.info.pop("reference_cache_invalidations", None)
@@ -0,0 +1,110 @@
+import functools
+import hashlib
+import inspect
+import logging
+from typing import Any, Callable, Iterable
+
+from fastapi import Request, Response, status
+from pydantic import TypeAdapter
+from redis import RedisError
+
+from utils.redis_cache import add_to_tags, get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+_REQUEST_PARAM = "_cache_request"
+
+
+def _response(body: bytes, etag: str, request: Request) -> Response:
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def cached_response(
+    namespace: str,
+    model: Any,
+    expire: int = 300,
+    scope: Callable[[dict], Any] = None,
+    tags: Callable[[dict], Iterable[str]] = None,
+    enabled: Callable[[dict], bool] = None,
+    ignore_params: Iterable[str] = ("use_cache",),
+):
+    """Cache the encoded JSON body of an endpoint in Redis and serve it with an ETag.
+
+    The key is built from ``namespace``, ``scope(kwargs)`` (usually the caller's tenant entity) and the sorted query
+    parameters minus ``ignore_params``. A hit returns the stored bytes without touching ``model`` at all, and a
+    matching If-None-Match gets a 304. On a miss the endpoint result is validated and dumped with ``model`` exactly
+    once, the way ``response_model`` would. ``enabled(kwargs)`` returning False bypasses the cache entirely, which
+    keeps the mobile ``use_cache`` flag working.
+    """
+    adapter = TypeAdapter(model)
+
+    def decorator(func):
+        signature = inspect.signature(func)
+        parameters = list(signature.parameters.values())
+        parameters.append(inspect.Parameter(_REQUEST_PARAM, inspect.Parameter.KEYWORD_ONLY, annotation=Request))
+
+        def cache_key(request: Request, kwargs: dict) -> str:
+            params = sorted((k, v) for k, v in request.query_params.multi_items() if k not in ignore_params)
+            query = "&".join(f"{k}={v}" for k, v in params)
+            principal = scope(kwargs) if scope else "-"
+            return f"response:{namespace}:{principal}:{hashlib.sha1(query.encode()).hexdigest()}"
+
+        def lookup(key: str):
+            try:
+                cached = get_redis_connection().hmget(key, "etag", "body")
+            except RedisError as e:
+                logger.warning(f"response cache read failed for {key}: {e}")
+                return None
+            return cached if cached[0] is not None else None
+
+        def store(key: str, result, kwargs: dict):
+            body = adapter.dump_json(adapter.validate_python(result, from_attributes=True), by_alias=True)
+            etag = f'"{hashlib.sha1(body).hexdigest()}"'
+            try:
+                pipe = get_redis_connection().pipeline(transaction=False)
+                pipe.hset(key, mapping={"etag": etag, "body": body})
+                pipe.expire(key, expire)
+                add_to_tags(pipe, key, tags(kwargs) if tags else ())
+                pipe.execute()
+            except RedisError as e:
+                logger.warning(f"response cache write failed for {key}: {e}")
+            return body, etag
+
+        def prepare(kwargs: dict):
+            request = kwargs.pop(_REQUEST_PARAM)
+            if enabled and not enabled(kwargs):
+                return request, None, None
+            key = cache_key(request, kwargs)
+            return request, key, lookup(key)
+
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def wrapper(**kwargs):
+                request, key, cached = prepare(kwargs)
+                if key is None:
+                    return await func(**kwargs)
+                if cached:
+                    return _response(cached[1].encode(), cached[0], request)
+                body, etag = store(key, await func(**kwargs), kwargs)
+                return _response(body, etag, request)
+
+        else:
+
+            @functools.wraps(func)
+            def wrapper(**kwargs):
+                request, key, cached = prepare(kwargs)
+                if key is None:
+                    return func(**kwargs)
+                if cached:
+                    return _response(cached[1].encode(), cached[0], request)
+                body, etag = store(key, func(**kwargs), kwargs)
+                return _response(body, etag, request)
+
+        wrapper.__signature__ = signature.replace(parameters=parameters)
+        return wrapper
+
+    return decorator
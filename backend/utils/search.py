@@ -0,0 +1,20 @@
+from sqlalchemy import or_
+
+PINFL_LENGTH = 14
+
+
+def text_search(term: str, columns, exact_columns=()):
+    """Filter for ``ilike '%term%'`` over ``columns``, served by their pg_trgm GIN indexes.
+
+    A term that is a whole PINFL is compared for equality against ``exact_columns`` instead, a btree lookup, while
+    the other columns keep the substring match. Only pass columns whose values are always PINFL-long as exact,
+    for them equality matches the same rows the substring search would.
+    """
+    term = term.strip()
+    if exact_columns and term.isdigit() and len(term) == PINFL_LENGTH:
+        exact = {id(column) for column in exact_columns}
+        return or_(
+            *(column == term for column in exact_columns),
+            *(column.ilike(f"%{term}%") for column in columns if id(column) not in exact),
+        )
+    return or_(*(column.ilike(f"%{term}%") for column in columns))
@@ -0,0 +1,171 @@
+import contextlib
+import hashlib
+import os
+import time
+from datetime import date, datetime, timedelta
+from typing import Awaitable, Callable, Dict, Iterable
+
+from redis import Redis, RedisError
+from redis.asyncio import Redis as AsyncRedis
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from utils.redis_cache import add_to_tags, dumps, get_or_set, get_redis_connection, invalidate_tags, loads
+
+# closed days never change unless data is backfilled, so they are kept for as long as anyone asks for them
+PAST_SEGMENT_TTL = int(os.getenv("PAST_SEGMENT_TTL", 90 * 24 * 60 * 60))
+OPEN_SEGMENT_TTL = int(os.getenv("OPEN_SEGMENT_TTL", 60))
+# a day stays open this long after midnight, events for it may still be queued (e.g. in event_consumer)
+SEGMENT_CLOSE_GRACE = int(os.getenv("SEGMENT_CLOSE_GRACE", 2 * 60 * 60))
+
+_day_models = {}
+
+
+def segment_scope(*parts) -> str:
+    """Short stable cache scope for a set of filters, e.g. the device ids a dashboard aggregates over."""
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def segment_key(namespace: str, scope: str, day: date, generation: int = 0) -> str:
+    return f"segment:{namespace}:{scope}:{day.isoformat()}:{generation}"
+
+
+def generation_key(namespace: str, day: date) -> str:
+    """Counter bumped by every invalidation of ``namespace`` for ``day``, segment keys embed its value.
+
+    A reader that computed a day before a backfill committed writes under the old generation, a key nobody reads
+    anymore, instead of putting the stale value back.
+    """
+    return f"segment-generation:{namespace}:{day.isoformat()}"
+
+
+def _generation(raw) -> int:
+    return int(raw) if raw is not None else 0
+
+
+def segment_tag(namespace: str, day: date) -> str:
+    """Tag set indexing every segment of ``namespace`` for ``day``, so a backfill drops them without a SCAN."""
+    return f"segment:{namespace}:{day.isoformat()}"
+
+
+def is_closed(day: date) -> bool:
+    closes_at = datetime.combine(day + timedelta(days=1), datetime.min.time()) + timedelta(seconds=SEGMENT_CLOSE_GRACE)
+    return datetime.now() >= closes_at
+
+
+def segment_ttl(day: date) -> int:
+    return PAST_SEGMENT_TTL if is_closed(day) else OPEN_SEGMENT_TTL
+
+
+def get_day_segment(redis_client: Redis, namespace: str, scope: str, day: date, compute: Callable[[], object]):
+    """Cache the result of ``compute`` for a single day: indefinitely for closed days, briefly for open ones."""
+    generation = _generation(redis_client.get(generation_key(namespace, day)))
+    return get_or_set(
+        redis_client,
+        segment_key(namespace, scope, day, generation),
+        compute,
+        expire=segment_ttl(day),
+        tags=[segment_tag(namespace, day)],
+    )
+
+
+async def get_day_segments(
+    redis_client: AsyncRedis,
+    namespace: str,
+    scope: str,
+    start: date,
+    end: date,
+    compute: Callable[[date, date], Awaitable[Dict[date, object]]],
+    empty=None,
+) -> Dict[date, object]:
+    """Per-day results for ``start``..``end`` (inclusive), computing only the days that are not cached.
+
+    ``compute(first, last)`` is awaited once for the span of missing days and returns a value per day; days it
+    leaves out get ``empty``. A wide range therefore costs one query over the uncached days, which after the first
+    request is just today.
+    """
+    days = [start + timedelta(days=offset) for offset in range((end - start).days + 1)]
+    if not days:
+        return {}
+    generations = await redis_client.mget([generation_key(namespace, day) for day in days])
+    keys = {day: segment_key(namespace, scope, day, _generation(raw)) for day, raw in zip(days, generations)}
+    result = {}
+    missing = []
+    for day, raw in zip(days, await redis_client.mget(list(keys.values()))):
+        if raw is None:
+            missing.append(day)
+        else:
+            result[day] = loads(raw)["v"]
+    if missing:
+        started = time.time()
+        computed = await compute(missing[0], missing[-1])
+        delta = time.time() - started
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for day in missing:
+                result[day] = computed.get(day, empty)
+                # same envelope as get_or_set, so a range and a single-day read can share segments
+                entry = {"v": result[day], "d": delta, "e": time.time() + segment_ttl(day)}
+                pipe.set(keys[day], dumps(entry), ex=segment_ttl(day))
+                add_to_tags(pipe, keys[day], [segment_tag(namespace, day)], segment_ttl(day))
+            await pipe.execute()
+    return result
+
+
+async def get_day_segment_async(
+    redis_client: AsyncRedis, namespace: str, scope: str, day: date, compute: Callable[[], Awaitable[object]]
+):
+    async def compute_day(first: date, last: date):
+        return {day: await compute()}
+
+    return (await get_day_segments(redis_client, namespace, scope, day, day, compute_day))[day]
+
+
+def _invalidate(redis_client: Redis, namespace_days: Iterable[tuple]) -> int:
+    namespace_days = list(namespace_days)
+    pipe = redis_client.pipeline(transaction=False)
+    for namespace, day in namespace_days:
+        pipe.incr(generation_key(namespace, day))
+        # outlives every segment written under the previous generation, so it never falls back to a stale one
+        pipe.expire(generation_key(namespace, day), PAST_SEGMENT_TTL + 24 * 60 * 60)
+    pipe.execute()
+    # the old generation is unreachable now, deleting it only frees the memory early
+    return invalidate_tags(redis_client, *(segment_tag(namespace, day) for namespace, day in namespace_days))
+
+
+def invalidate_day_segments(redis_client: Redis, days: Iterable[date], namespace: str) -> int:
+    """Drop cached ``namespace`` segments of ``days``; backfills that write into closed days must call this."""
+    return _invalidate(redis_client, ((namespace, day) for day in days))
+
+
+def invalidate_on_backfill(model: type, attribute: str, *namespaces: str) -> None:
+    """Drop the ``namespaces`` segments of a closed day when a commit writes ``model`` rows dated on that day."""
+    _day_models[model] = (attribute, namespaces)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_days(session, flush_context):
+    if not _day_models:
+        return
+    today = date.today()
+    days = session.info.setdefault("segment_cache_days", set())
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        tracked = _day_models.get(type(instance))
+        if tracked:
+            attribute, namespaces = tracked
+            value = getattr(instance, attribute, None)
+            day = value.date() if isinstance(value, datetime) else value
+            if isinstance(day, date) and day < today:
+                days.update((namespace, day) for namespace in namespaces)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_days(session):
+    days = session.info.pop("segment_cache_days", None)
+    if days:
+        with contextlib.suppress(RedisError):
+            _invalidate(get_redis_connection(), days)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_days(session):
+    session.info.pop("segment_cache_days", None)
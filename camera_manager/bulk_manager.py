@@ -0,0 +1,132 @@
+import json
+import time
+import asyncio
+import logging
+from uuid import uuid4
+from typing import Optional
+from websocket_manager import manager, DeviceNotConnected
+from utilities_manager import generate_md5, get_error_description
+
+JOB_KEY_PREFIX = "camera_manager:bulk_job:"
+JOB_TTL = 24 * 60 * 60
+
+logger = logging.getLogger(__name__)
+
+
+class BulkJobStore:
+    """Keeps bulk job progress in Redis so any replica can report it, or in memory without Redis."""
+
+    def __init__(self):
+        self.jobs = {}
+
+    @property
+    def redis(self):
+        return manager.redis
+
+    def _prune(self, now: float):
+        # jobs are created in order, so the expired ones are at the front, as Redis would expire them
+        while self.jobs:
+            job_id, job = next(iter(self.jobs.items()))
+            if now - job["meta"]["created_at"] < JOB_TTL:
+                break
+            del self.jobs[job_id]
+
+    async def create(self, job_id: str, request_type: str, total: int):
+        meta = {"job_id": job_id, "request_type": request_type, "total": total, "created_at": time.time()}
+        if self.redis is None:
+            self._prune(meta["created_at"])
+            self.jobs[job_id] = {"meta": meta, "results": {}}
+            return
+        key = f"{JOB_KEY_PREFIX}{job_id}"
+        await self.redis.hset(key, "meta", json.dumps(meta))
+        await self.redis.expire(key, JOB_TTL)
+
+    async def set_result(self, job_id: str, device_id: str, result: dict):
+        if self.redis is None:
+            if job_id in self.jobs:
+                self.jobs[job_id]["results"][device_id] = result
+            return
+        await self.redis.hset(f"{JOB_KEY_PREFIX}{job_id}", f"device:{device_id}", json.dumps(result))
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        if self.redis is None:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            meta, results = job["meta"], dict(job["results"])
+        else:
+            fields = await self.redis.hgetall(f"{JOB_KEY_PREFIX}{job_id}")
+            if not fields:
+                return None
+            meta = json.loads(fields.pop("meta"))
+            results = {key[len("device:"):]: json.loads(value) for key, value in fields.items()}
+        failed = sum(1 for result in results.values() if not result["success"])
+        return {
+            "job_id": job_id,
+            "request_type": meta["request_type"],
+            "total": meta["total"],
+            "finished": len(results),
+            "failed": failed,
+            "status": "finished" if len(results) >= meta["total"] else "running",
+            "results": results,
+        }
+
+
+job_store = BulkJobStore()
+# strong references to running jobs, the event loop only keeps weak ones
+running_jobs = set()
+
+
+async def _run_device_command(job_id: str, request_type: str, device: dict, timeout: float, semaphore):
+    async with semaphore:
+        message = {"request_type": request_type, "request_id": uuid4().hex}
+        message.update(device["params"])
+        if device.get("password"):
+            message["pass"] = generate_md5(device["password"])
+        started = time.monotonic()
+        result = {"success": False, "code": None}
+        try:
+            response = await manager.send_command(device["device_id"], message, timeout=timeout)
+            result.update({"success": response.get("code") == 0, "code": response.get("code"), "response": response})
+            if not result["success"]:
+                result["error"] = get_error_description(response.get("code"))
+        except DeviceNotConnected:
+            result.update({"code": 404, "error": "Device not found"})
+        except TimeoutError:
+            result.update({"code": 408, "error": "Timed out waiting for response"})
+        except Exception as e:
+            logger.warning(f"Bulk job {job_id}: {device['device_id']} failed: {e}")
+            result.update({"code": 500, "error": str(e)})
+        result["elapsed"] = round(time.monotonic() - started, 3)
+        await job_store.set_result(job_id, device["device_id"], result)
+
+
+async def _run_job(job_id: str, request_type: str, devices: list, concurrency: int, timeout: float):
+    semaphore = asyncio.Semaphore(concurrency)
+    await asyncio.gather(
+        *[_run_device_command(job_id, request_type, device, timeout, semaphore) for device in devices],
+        return_exceptions=True,
+    )
+    logger.info(f"Bulk job {job_id} ({request_type}) finished for {len(devices)} devices")
+
+
+def unique_devices(devices: list) -> list:
+    """Devices with repeated device ids removed, the first entry of each device wins."""
+    unique = {}
+    for device in devices:
+        unique.setdefault(device["device_id"], device)
+    return list(unique.values())
+
+
+async def start_bulk_job(request_type: str, devices: list, concurrency: int, timeout: float) -> str:
+    """Start sending a command to many devices in the background and return the job id to poll.
+
+    ``devices`` must not repeat a device id, results are kept per device and the job only finishes once every
+    entry has one.
+    """
+    job_id = str(uuid4())
+    await job_store.create(job_id, request_type, len(devices))
+    task = asyncio.create_task(_run_job(job_id, request_type, devices, concurrency, timeout))
+    running_jobs.add(task)
+    task.add_done_callback(running_jobs.discard)
+    return job_id
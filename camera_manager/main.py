@@ -4,11 +4,13 @@ import json
 import logging
 import secrets
 import sentry_sdk
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from routers import user_managment
 from logging.config import fileConfig
-from websocket_manager import manager
+from websocket_manager import manager, DeviceNotConnected, DeviceQueueFull
 from routers import equipment_managment
+from routers import bulk_commands
 from fastapi.openapi.utils import get_openapi
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import WebSocket, WebSocketDisconnect
@@ -47,6 +49,26 @@ app = FastAPI(
 logger.info("Starting application...")
 
 
+@app.on_event("startup")
+async def startup_event():
+    await manager.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await manager.stop()
+
+
+@app.exception_handler(DeviceNotConnected)
+async def device_not_connected_handler(request: Request, exc: DeviceNotConnected):
+    return JSONResponse(status_code=status.HTTP_404_NOT_FOUND, content={"detail": "Device not found"})
+
+
+@app.exception_handler(DeviceQueueFull)
+async def device_queue_full_handler(request: Request, exc: DeviceQueueFull):
+    return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={"detail": "Device is busy"})
+
+
 def get_current_username(credentials: HTTPBasicCredentials = Depends(security)):
     correct_username = secrets.compare_digest(credentials.username, OPENAPI_DASHBOARD_LOGIN)
     correct_password = secrets.compare_digest(credentials.password, OPENAPI_DASHBOARD_PASSWORD)
@@ -91,7 +113,7 @@ async def websocket_endpoint(websocket: WebSocket):
                     #  'software_version': '10.001.11.1_MAIN_V4.18(240304)', 'device_mac': 'bc-07-18-01-5d-bd',
                     #  'sign': 'ddee77a61189094d3dee299c3398675d', 'sign_tby': 'fb7f6dbaeb7921b5e9c99288d41e2fed'}
                     logger.info(f"I AM ONLINE ID: {dict_data['device_id']}")
-                    manager.acquaintance_connections[dict_data["device_id"]] = websocket
+                    await manager.register_device(dict_data["device_id"], websocket)
                     if not is_sent:
                         is_sent = True
                         interval_extender = {
@@ -102,28 +124,26 @@ async def websocket_endpoint(websocket: WebSocket):
                         }
                         logger.info(f"SENDING DEVICE ONLINE RESPONSE {interval_extender}")
                         json_data = json.dumps(interval_extender)
-                        await manager.send_personal_message(json_data, websocket)
-                if dict_data["request_type"] == "heartbeat":
-                    logger.info(f"LUP ID: {dict_data['device_id']}")
-                    # {'request_type': 'heartbeat', 'IP': '192.168.100.112', 'device_id': 'H010001180F0100010016',
-                    #  'device_name': 'IPCamera', 'timestamp': 1717157989, 'user_num': 5749,
-                    #  'sign_tby': '6b88a26efda12e9a40cfda4e6f7b3654'}
-                    heartbeat_response = {
-                        "resp_type": "heartbeat",
-                        "device_id": dict_data["device_id"],
-                        "code": 0,
-                        "log": "'heartbeat'success"
-                    }
-                    logger.info(f"DUP ID: {dict_data['device_id']}")
-                    json_data = json.dumps(heartbeat_response)
-                    await manager.send_personal_message(json_data, websocket)
+                        await manager.send_personal_message(json_data, websocket, policy="drop_newest")
     except WebSocketDisconnect:
         await manager.disconnect(websocket)
         logger.info(f"CONNECTION VIA WEBSOCKET {websocket.client.host} DISCONNECTED")
 
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics(username: str = Depends(get_current_username)):
+    """Connection, frame rate and event loop lag metrics in the Prometheus text format."""
+    lines = [
+        f"camera_manager_{name}{{node=\"{manager.node_id}\"}} {value}"
+        for name, value in manager.get_metrics().items()
+    ]
+    return "\n".join(lines) + "\n"
+
+
 app.include_router(equipment_managment.routerALL)
 app.include_router(equipment_managment.router, dependencies=[Depends(get_current_username)])
 app.include_router(user_managment.router, dependencies=[Depends(get_current_username)])
+app.include_router(bulk_commands.router, dependencies=[Depends(get_current_username)])
 
 origins = ["*"]
 
@@ -0,0 +1,42 @@
+from bulk_manager import job_store, start_bulk_job, unique_devices
+from websocket_manager import manager
+from fastapi import APIRouter, HTTPException, status
+from schema.bulk_commands import BulkCommandRequest, BulkCommandJob
+
+router = APIRouter(prefix="/devices/bulk", tags=["bulk commands"])
+
+
+@router.post("/commands")
+async def create_bulk_command(request: BulkCommandRequest):
+    devices = unique_devices([
+        {"device_id": device.device_id, "password": device.password or request.password,
+         "params": {**request.params, **device.params}}
+        for device in request.devices
+    ])
+    if request.all_devices:
+        selected = {device["device_id"] for device in devices}
+        devices += [
+            {"device_id": device_id, "password": request.password, "params": dict(request.params)}
+            for device_id in await manager.get_active_devices()
+            if device_id not in selected
+        ]
+    if not devices:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="No devices selected"
+        )
+    job_id = await start_bulk_job(
+        request.request_type, devices, request.concurrency, request.timeout
+    )
+    return {"job_id": job_id, "total": len(devices)}
+
+
+@router.get("/commands/{job_id}", response_model=BulkCommandJob)
+async def get_bulk_command(job_id: str, include_results: bool = True):
+    job = await job_store.get(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Job not found"
+        )
+    if not include_results:
+        job["results"] = {}
+    return job
@@ -1,4 +1,3 @@
-import json
 from uuid import uuid4
 from websocket_manager import manager
 from fastapi import APIRouter, HTTPException, status
@@ -32,7 +31,22 @@ routerALL = APIRouter(prefix="/devices", tags=["equipment management"])
 
 @routerALL.get("/getAllActiveDevices")
 async def get_all_active_devices():
-    return {"devices": list(manager.acquaintance_connections.keys())}
+    return {"devices": await manager.get_active_devices()}
+
+
+@routerALL.get("/stats")
+async def get_devices_stats():
+    return {"node_id": manager.node_id, "devices": manager.get_stats()}
+
+
+@routerALL.get("/stats/{device_id}")
+async def get_device_stats(device_id: str):
+    stats = manager.get_device_stats(device_id)
+    if stats is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Device not found"
+        )
+    return stats
 
 
 router = APIRouter(
@@ -42,9 +56,7 @@ router = APIRouter(
 
 @router.post("/setPassword")
 async def set_password(device_id: str, requets: PassworSettingsSchema):
-    try:
-        websocket = manager.acquaintance_connections[device_id]
-    except KeyError:
+    if not await manager.has_device(device_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Device not found"
         )
@@ -55,9 +67,8 @@ async def set_password(device_id: str, requets: PassworSettingsSchema):
         "old_password": generate_md5(requets.old_password),
         "new_password": requets.new_password,
     }
-    await manager.send_personal_message(json.dumps(message), websocket)
     try:
-        response = await manager.wait_for_message(device_id, request_id, timeout=20)
+        response = await manager.send_command(device_id, message, timeout=20)
         if response["code"] == 0:
             return response
         else:
@@ -75,9 +86,7 @@ async def set_password(device_id: str, requets: PassworSettingsSchema):
 
 @router.post("/restart")
 async def reboot(device_id: str, request: EquipmentRebootSchema):
-    try:
-        websocket = manager.acquaintance_connections[device_id]
-    except KeyError:
+    if not await manager.has_device(device_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Device not found"
         )
@@ -87,9 +96,8 @@ async def reboot(device_id: str, request: EquipmentRebootSchema):
         "request_id": request_id,
         "pass": generate_md5(request.password),
     }
-    await manager.send_personal_message(json.dumps(message), websocket)
     try:
-        response = await manager.wait_for_message(device_id, request_id, timeout=20)
+        response = await manager.send_command(device_id, message, timeout=20)
         if response["code"] == 0:
             return response
         else:
@@ -106,9 +114,7 @@ async def reboot(device_id: str, request: EquipmentRebootSchema):
 
 @router.post("/diskFormat")
 async def disk_format(device_id: str, request: FormatTheDisk):
-    try:
-        websocket = manager.acquaintance_connections[device_id]
-    except KeyError:
+    if not await manager.has_device(device_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Device not found"
         )
@@ -118,9 +124,8 @@ async def disk_format(device_id: str, request: FormatTheDisk):
         "request_id": request_id,
         "pass": generate_md5(request.password),
     }
-    await manager.send_personal_message(json.dumps(message), websocket)
     try:
-        response = await manager.wait_for_message(device_id, request_id, timeout=60)
+        response = await manager.send_command(device_id, message, timeout=60)
         if response["code"] == 0:
             return response
         else:
@@ -137,9 +142,7 @@ async def disk_format(device_id: str, request: FormatTheDisk):
 
 @router.get("/getSoftwareVersion")
 async def get_software_version(device_id: str, password: str):
-    try:
-        websocket = manager.acquaintance_connections[device_id]
-    except KeyError:
+    if not await manager.has_device(device_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Device not found"
         )
@@ -149,9 +152,8 @@ async def get_software_version(device_id: str, password: str):
         "request_id": request_id,
         "pass": generate_md5(password),
     }
-    await manager.send_personal_message(json.dumps(message), websocket)
     try:
-        response = await manager.wait_for_message(device_id, request_id, timeout=20)
+        response = await manager.send_command(device_id, message, timeout=20)
         if response["code"] == 0:
             return response
         else:
@@ -169,9 +171,7 @@ async def get_software_version(device_id: str, password: str):
 
 @router.get("/getRebootConf")
 async def get_reboot_conf(device_id: str, password: str):
-    try:
-        websocket = manager.acquaintance_connections[device_id]
-    except KeyError:
+    if not await manager.has_device(device_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Device not found"
         )
@@ -181,9 +181,8 @@ async def get_reboot_conf(device_id: str, password: str):
         "request_id": request_id,
         "pass": generate_md5(password),
     }
-    await manager.send_personal_message(json.dumps(message), websocket)
     try:
-        response = await manager.wait_for_message(device_id, request_id, timeout=20)
+        response = await manager.send_command(device_id, message, timeout=20)
         if response["code"] == 0:
             return response
         else:
@@ -204,9 +203,7 @@ async def set_reboot_conf(device_id: str, request: SetRebootConfigSchema):
     mode: 0 - disable, 1 - daily, 2 - weekly
     day_week: 0 - Sunday, 1 - Monday, 2 - Tuesday, 3 - Wednesday, 4 - Thursday, 5 - Friday, 6 - Saturday
     """
-    try:
-        websocket = manager.acquaintance_connections[device_id]
-    except KeyError:
+    if not await manager.has_device(device_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Device not found"
         )
@@ -228,9 +225,8 @@ async def set_reboot_conf(device_id: str, request: SetRebootConfigSchema):
             "pass": generate_md5(request.password),
             "mode": request.mode,
         }
-    await manager.send_personal_message(json.dumps(message), websocket)
     try:
-        response = await manager.wait_for_message(device_id, request_id, timeout=20)
+        response = await manager.send_command(device_id, message, timeout=20)
         if response["code"] == 0:
             return response
         else:
@@ -253,9 +249,7 @@ async def set_resume_transfer(device_id: str, request: SetResumeTransferSchema):
     the unuploaded to the captured pictures.
     enable: 0 - disable, 1 - enable
     """
-    try:
-        websocket = manager.acquaintance_connections[device_id]
-    except KeyError:
+    if not await manager.has_device(device_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Device not found"
         )
@@ -266,9 +260,8 @@ async def set_resume_transfer(device_id: str, request: SetResumeTransferSchema):
         "pass": generate_md5(request.password),
         "enable": 1 if request.enable else 0,
     }
-    await manager.send_personal_message(json.dumps(message), websocket)
     try:
-        response = await manager.wait_for_message(device_id, request_id, timeout=20)
+        response = await manager.send_command(device_id, message, timeout=20)
         if response["code"] == 0:
             return response
         else:
@@ -291,9 +284,7 @@ async def set_ntp_server(device_id: str, request: SetNtpServerSchema):
     update_interval: update interval, unit: minutes
     zone: time zone, default: 20 (Uzbekistan)
     """
-    try:
-        websocket = manager.acquaintance_connections[device_id]
-    except KeyError:
+    if not await manager.has_device(device_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Device not found"
         )
@@ -306,9 +297,8 @@ async def set_ntp_server(device_id: str, request: SetNtpServerSchema):
         "update_interval": request.update_interval,
         "zone": request.zone,
     }
-    await manager.send_personal_message(json.dumps(message), websocket)
     try:
-        response = await manager.wait_for_message(device_id, request_id, timeout=20)
+        response = await manager.send_command(device_id, message, timeout=20)
         if response["code"] == 0:
             return response
         else:
@@ -325,9 +315,7 @@ async def set_ntp_server(device_id: str, request: SetNtpServerSchema):
 
 @router.post("/upgradeFirmware")
 async def upgrade_firmware(device_id: str, request: UpgradeFirmwareSchema):
-    try:
-        websocket = manager.acquaintance_connections[device_id]
-    except KeyError:
+    if not await manager.has_device(device_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Device not found"
         )
@@ -339,11 +327,10 @@ async def upgrade_firmware(device_id: str, request: UpgradeFirmwareSchema):
         "URL": request.URL,  # Firmware file URL
     }
     # Sending the upgrade request to the device via WebSocket
-    await manager.send_personal_message(json.dumps(message), websocket)
     try:
         # Waiting for a response from the device
-        response = await manager.wait_for_message(
-            device_id, request_id, timeout=60
+        response = await manager.send_command(
+            device_id, message, timeout=60
         )  # Extended timeout for firmware
         if response["code"] == 0:
             return {
@@ -365,9 +352,7 @@ async def upgrade_firmware(device_id: str, request: UpgradeFirmwareSchema):
 
 @router.get("/getWiredNetwork")
 async def get_wired_network(device_id: str, password: str):
-    try:
-        websocket = manager.acquaintance_connections[device_id]
-    except KeyError:
+    if not await manager.has_device(device_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Device not found"
         )
@@ -377,9 +362,8 @@ async def get_wired_network(device_id: str, password: str):
         "request_id": request_id,
         "pass": generate_md5(password),
     }
-    await manager.send_personal_message(json.dumps(message), websocket)
     try:
-        response = await manager.wait_for_message(device_id, request_id, timeout=20)
+        response = await manager.send_command(device_id, message, timeout=20)
         if response["code"] == 0:
             return response
         else:
@@ -396,9 +380,7 @@ async def get_wired_network(device_id: str, password: str):
 
 @router.post("/setWiredNetwork")
 async def set_wired_network(device_id: str, request: SetWiredNetworkScheme):
-    try:
-        websocket = manager.acquaintance_connections[device_id]
-    except KeyError:
+    if not await manager.has_device(device_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Device not found"
         )
@@ -417,9 +399,8 @@ async def set_wired_network(device_id: str, request: SetWiredNetworkScheme):
         "device_mac": request.device_mac,
         "webPort": request.webPort,
     }
-    await manager.send_personal_message(json.dumps(message), websocket)
     try:
-        response = await manager.wait_for_message(device_id, request_id, timeout=20)
+        response = await manager.send_command(device_id, message, timeout=20)
         if response["code"] == 0:
             return response
         else:
@@ -436,9 +417,7 @@ async def set_wired_network(device_id: str, request: SetWiredNetworkScheme):
 
 @router.get("/getPlatformServer")
 async def get_platform_server(device_id: str, password: str):
-    try:
-        websocket = manager.acquaintance_connections[device_id]
-    except KeyError:
+    if not await manager.has_device(device_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Device not found"
         )
@@ -448,9 +427,8 @@ async def get_platform_server(device_id: str, password: str):
         "request_id": request_id,
         "pass": generate_md5(password),
     }
-    await manager.send_personal_message(json.dumps(message), websocket)
     try:
-        response = await manager.wait_for_message(device_id, request_id, timeout=20)
+        response = await manager.send_command(device_id, message, timeout=20)
         if response["code"] == 0:
             return response
         else:
@@ -467,9 +445,7 @@ async def get_platform_server(device_id: str, password: str):
 
 @router.post("/setPlatformServer")
 async def set_platform_server(device_id: str, request: SetPlatformServerSchema):
-    try:
-        websocket = manager.acquaintance_connections[device_id]
-    except KeyError:
+    if not await manager.has_device(device_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Device not found"
         )
@@ -484,9 +460,8 @@ async def set_platform_server(device_id: str, request: SetPlatformServerSchema):
         "resumeTransf": request.resumeTransf,
         "wsServerPort": request.wsServerPort,
     }
-    await manager.send_personal_message(json.dumps(message), websocket)
     try:
-        response = await manager.wait_for_message(device_id, request_id, timeout=20)
+        response = await manager.send_command(device_id, message, timeout=20)
         if response["code"] == 0:
             return response
         else:
@@ -503,9 +478,7 @@ async def set_platform_server(device_id: str, request: SetPlatformServerSchema):
 
 @router.get("/getVPNConf")
 async def get_vpn_conf(device_id: str, password: str):
-    try:
-        websocket = manager.acquaintance_connections[device_id]
-    except KeyError:
+    if not await manager.has_device(device_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Device not found"
         )
@@ -515,9 +488,8 @@ async def get_vpn_conf(device_id: str, password: str):
         "request_id": request_id,
         "pass": generate_md5(password),
     }
-    await manager.send_personal_message(json.dumps(message), websocket)
     try:
-        response = await manager.wait_for_message(device_id, request_id, timeout=20)
+        response = await manager.send_command(device_id, message, timeout=20)
         if response["code"] == 0:
             return response
         else:
@@ -534,9 +506,7 @@ async def get_vpn_conf(device_id: str, password: str):
 
 @router.post("/setVPNConf")
 async def set_vpn_conf(device_id: str, request: SetVPNConfScheme):
-    try:
-        websocket = manager.acquaintance_connections[device_id]
-    except KeyError:
+    if not await manager.has_device(device_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Device not found"
         )
@@ -550,9 +520,8 @@ async def set_vpn_conf(device_id: str, request: SetVPNConfScheme):
         "userName": request.userName,
         "password": request.vpn_password,
     }
-    await manager.send_personal_message(json.dumps(message), websocket)
     try:
-        response = await manager.wait_for_message(device_id, request_id, timeout=20)
+        response = await manager.send_command(device_id, message, timeout=20)
         if response["code"] == 0:
             return response
         else:
@@ -569,9 +538,7 @@ async def set_vpn_conf(device_id: str, request: SetVPNConfScheme):
 
 @router.post("/setRtmpConf")
 async def set_rtmp_conf(device_id: str, request: SetRtmpConf):
-    try:
-        websocket = manager.acquaintance_connections[device_id]
-    except KeyError:
+    if not await manager.has_device(device_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Device not found"
         )
@@ -584,9 +551,8 @@ async def set_rtmp_conf(device_id: str, request: SetRtmpConf):
         "RtmpEnable": request.RtmpEnable,
         "RtmpServerAddr": request.RtmpServerAddr,
     }
-    await manager.send_personal_message(json.dumps(message), websocket)
     try:
-        response = await manager.wait_for_message(device_id, request_id, timeout=20)
+        response = await manager.send_command(device_id, message, timeout=20)
         if response["code"] == 0:
             return response
         else:
@@ -698,9 +664,7 @@ ptz_control_description = """
     description=ptz_control_description,
 )
 async def set_ptz_control(device_id: str, request: SetPtzControl):
-    try:
-        websocket = manager.acquaintance_connections[device_id]
-    except KeyError:
+    if not await manager.has_device(device_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Device not found"
         )
@@ -714,9 +678,8 @@ async def set_ptz_control(device_id: str, request: SetPtzControl):
         "speed_v": request.speed_v,
         "ptz_cmd": request.ptz_cmd,
     }
-    await manager.send_personal_message(json.dumps(message), websocket)
     try:
-        response = await manager.wait_for_message(device_id, request_id, timeout=20)
+        response = await manager.send_command(device_id, message, timeout=20)
         if response["code"] == 0:
             return response
         else:
@@ -809,9 +772,7 @@ SetFaceConfig callback data
 
 @router.post("/SetFaceConfig", description=SetFaceConfig_description)
 async def set_face_config(device_id: str, request: SetFaceConfig):
-    try:
-        websocket = manager.acquaintance_connections[device_id]
-    except KeyError:
+    if not await manager.has_device(device_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Device not found"
         )
@@ -869,9 +830,8 @@ async def set_face_config(device_id: str, request: SetFaceConfig):
         "strangerFilt": request.strangerFilt,
         "strangerDay": request.strangerDay,
     }
-    await manager.send_personal_message(json.dumps(message), websocket)
     try:
-        response = await manager.wait_for_message(device_id, request_id, timeout=20)
+        response = await manager.send_command(device_id, message, timeout=20)
         if response["code"] == 0:
             return response
         else:
@@ -888,9 +848,7 @@ async def set_face_config(device_id: str, request: SetFaceConfig):
 
 @router.post("/getFaceConfig")
 async def get_face_config(device_id: str, request: GetFaceConfig):
-    try:
-        websocket = manager.acquaintance_connections[device_id]
-    except KeyError:
+    if not await manager.has_device(device_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Device not found"
         )
@@ -900,9 +858,8 @@ async def get_face_config(device_id: str, request: GetFaceConfig):
         "request_id": request_id,
         "pass": generate_md5(request.password),
     }
-    await manager.send_personal_message(json.dumps(message), websocket)
     try:
-        response = await manager.wait_for_message(device_id, request_id, timeout=20)
+        response = await manager.send_command(device_id, message, timeout=20)
         return response
     except TimeoutError as e:
         raise HTTPException(status_code=408, detail=str(e))
@@ -910,9 +867,7 @@ async def get_face_config(device_id: str, request: GetFaceConfig):
 
 @router.post("/getFmtSnap")
 async def get_fmt_snap(device_id: str, request: GetFmtSnap):
-    try:
-        websocket = manager.acquaintance_connections[device_id]
-    except KeyError:
+    if not await manager.has_device(device_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Device not found"
         )
@@ -923,9 +878,8 @@ async def get_fmt_snap(device_id: str, request: GetFmtSnap):
         "pass": generate_md5(request.password),
         "fmt": request.fmt,
     }
-    await manager.send_personal_message(json.dumps(message), websocket)
     try:
-        response = await manager.wait_for_message(device_id, request_id, timeout=20)
+        response = await manager.send_command(device_id, message, timeout=20)
         if response["code"] == 0:
             return response
         else:
@@ -942,9 +896,7 @@ async def get_fmt_snap(device_id: str, request: GetFmtSnap):
 
 @router.post("/getLogFile")
 async def get_log_file(device_id: str, request: GetLogFile):
-    try:
-        websocket = manager.acquaintance_connections[device_id]
-    except KeyError:
+    if not await manager.has_device(device_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Device not found"
         )
@@ -956,9 +908,8 @@ async def get_log_file(device_id: str, request: GetLogFile):
         "log_name": request.log_name,
     }
     print(message)
-    await manager.send_personal_message(json.dumps(message), websocket)
     try:
-        response = await manager.wait_for_message(device_id, request_id, timeout=20)
+        response = await manager.send_command(device_id, message, timeout=20)
         if response["code"] == 0:
             return response
         else:
@@ -1,4 +1,3 @@
-import json
 import logging
 from uuid import uuid4
 from websocket_manager import manager
@@ -25,9 +24,7 @@ logger = logging.getLogger(__name__)
 async def query_user_list_information(
     device_id: str, request: QueryTheUserListInformation
 ):
-    try:
-        websocket = manager.acquaintance_connections[device_id]
-    except KeyError:
+    if not await manager.has_device(device_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Device not found"
         )
@@ -38,9 +35,8 @@ async def query_user_list_information(
         "pass": generate_md5(request.password),
         "device_id": device_id,
     }
-    await manager.send_personal_message(json.dumps(message), websocket)
     try:
-        response = await manager.wait_for_message(device_id, request_id, timeout=15)
+        response = await manager.send_command(device_id, message, timeout=15)
         if response["code"] == 0:
             return response
         else:
@@ -58,9 +54,7 @@ async def query_user_list_information(
 @router.post("/addUser")
 async def add_user(device_id: str, request: AddUser):
     logger.info(f"Adding user {request.user_id} to device {device_id}")
-    try:
-        websocket = manager.acquaintance_connections[device_id]
-    except KeyError:
+    if not await manager.has_device(device_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Device not found"
         )
@@ -77,10 +71,9 @@ async def add_user(device_id: str, request: AddUser):
         "image_type": request.image_type,
         "user_info": request.user_info.dict(),
     }
-    await manager.send_personal_message(json.dumps(message), websocket)
     try:
-        response_dict = await manager.wait_for_message(
-            device_id, request_id, timeout=100
+        response_dict = await manager.send_command(
+            device_id, message, timeout=100
         )
         if response_dict["code"] == 0:
             return response_dict
@@ -98,9 +91,7 @@ async def add_user(device_id: str, request: AddUser):
 
 @router.post("/updateUser")
 async def update_user(device_id: str, user_id: str, request: UpdateUser):
-    try:
-        websocket = manager.acquaintance_connections[device_id]
-    except KeyError:
+    if not await manager.has_device(device_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Device not found"
         )
@@ -116,9 +107,8 @@ async def update_user(device_id: str, user_id: str, request: UpdateUser):
         "image_type": request.image_type,
         "user_info": request.user_info.dict(),
     }
-    await manager.send_personal_message(json.dumps(message), websocket)
     try:
-        response = await manager.wait_for_message(device_id, request_id, timeout=15)
+        response = await manager.send_command(device_id, message, timeout=15)
         if response["code"] == 0:
             return response
         else:
@@ -135,9 +125,7 @@ async def update_user(device_id: str, user_id: str, request: UpdateUser):
 
 @router.post("/deleteUser")
 async def delete_user(device_id: str, request: DeleteUser):
-    try:
-        websocket = manager.acquaintance_connections[device_id]
-    except KeyError:
+    if not await manager.has_device(device_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Device not found"
         )
@@ -151,9 +139,8 @@ async def delete_user(device_id: str, request: DeleteUser):
         "group": request.group,
         "user_list": request.user_list,
     }
-    await manager.send_personal_message(json.dumps(message), websocket)
     try:
-        response = await manager.wait_for_message(device_id, request_id, timeout=15)
+        response = await manager.send_command(device_id, message, timeout=15)
         return {"status": "success", "response": response}
     except TimeoutError as e:
         raise HTTPException(status_code=408, detail=str(e))
@@ -161,9 +148,7 @@ async def delete_user(device_id: str, request: DeleteUser):
 
 @router.post("/deleteUserList")
 async def delete_user_list(device_id: str, request: DeleteUserList):
-    try:
-        websocket = manager.acquaintance_connections[device_id]
-    except KeyError:
+    if not await manager.has_device(device_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Device not found"
         )
@@ -174,9 +159,8 @@ async def delete_user_list(device_id: str, request: DeleteUserList):
         "pass": generate_md5(request.password),
         "user_list": request.user_list,
     }
-    await manager.send_personal_message(json.dumps(message), websocket)
     try:
-        response = await manager.wait_for_message(device_id, request_id, timeout=15)
+        response = await manager.send_command(device_id, message, timeout=15)
         if response["code"] == 0:
             return response
         else:
@@ -193,9 +177,7 @@ async def delete_user_list(device_id: str, request: DeleteUserList):
 
 @router.post("/obtainUserInfo")
 async def obtain_user_info(device_id: str, requets: ObtainUserInfo):
-    try:
-        websocket = manager.acquaintance_connections[device_id]
-    except KeyError:
+    if not await manager.has_device(device_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Device not found"
         )
@@ -206,9 +188,8 @@ async def obtain_user_info(device_id: str, requets: ObtainUserInfo):
         "pass": generate_md5(requets.password),
         "user_id": requets.user_id,
     }
-    await manager.send_personal_message(json.dumps(message), websocket)
     try:
-        response = await manager.wait_for_message(device_id, request_id, timeout=15)
+        response = await manager.send_command(device_id, message, timeout=15)
         if response["code"] == 0:
             return response
         else:
@@ -225,9 +206,7 @@ async def obtain_user_info(device_id: str, requets: ObtainUserInfo):
 
 @router.post("/picRecognition")
 async def pic_recognition(device_id: str, requets: GetpicRecognition):
-    try:
-        websocket = manager.acquaintance_connections[device_id]
-    except KeyError:
+    if not await manager.has_device(device_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Device not found"
         )
@@ -242,9 +221,8 @@ async def pic_recognition(device_id: str, requets: GetpicRecognition):
         "min_fscore": requets.min_fscore,
         "max_result_num": requets.max_result_num,
     }
-    await manager.send_personal_message(json.dumps(message), websocket)
     try:
-        response = await manager.wait_for_message(device_id, request_id, timeout=15)
+        response = await manager.send_command(device_id, message, timeout=15)
         if response["code"] == 0:
             return response
         else:
@@ -0,0 +1,30 @@
+from typing import List, Optional
+from pydantic import BaseModel, Field, conint, confloat
+
+
+class BulkDevice(BaseModel):
+    device_id: str
+    password: Optional[str] = None
+    # fields that differ per device, merged over the shared params
+    params: dict = Field(default_factory=dict)
+
+
+class BulkCommandRequest(BaseModel):
+    request_type: str
+    params: dict = Field(default_factory=dict)
+    devices: List[BulkDevice] = Field(default_factory=list)
+    # selector: run the command on every device connected to the cluster, using the shared password
+    all_devices: bool = False
+    password: Optional[str] = None
+    concurrency: conint(ge=1, le=500) = 50
+    timeout: confloat(gt=0, le=300) = 20
+
+
+class BulkCommandJob(BaseModel):
+    job_id: str
+    request_type: str
+    total: int
+    finished: int
+    failed: int
+    status: str
+    results: dict = Field(default_factory=dict)
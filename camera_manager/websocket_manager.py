@@ -1,82 +1,536 @@
+import os
 import json
+import contextlib
+import time
+import uuid
+import socket
 import asyncio
-from fastapi import WebSocket
+import logging
+from typing import Optional
+from fastapi import WebSocket, WebSocketDisconnect
+from redis import asyncio as aioredis
+from redis.exceptions import RedisError
 from starlette.websockets import WebSocketState
 
+REDIS_URL = os.getenv("REDIS_URL")
+NODE_ID = os.getenv("NODE_ID", f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}")
+DEVICE_TTL = int(os.getenv("DEVICE_REGISTRY_TTL", 120))
+INBOUND_QUEUE_SIZE = int(os.getenv("WS_INBOUND_QUEUE_SIZE", 100))
+OUTBOUND_QUEUE_SIZE = int(os.getenv("WS_OUTBOUND_QUEUE_SIZE", 100))
+# what to do when a device outbound queue is full: "reject", "drop_oldest" or "drop_newest"
+OUTBOUND_OVERFLOW_POLICY = os.getenv("WS_OUTBOUND_OVERFLOW_POLICY", "reject")
+# how often coalesced heartbeat timestamps are written to the registry and frame rates are computed
+HOUSEKEEPING_INTERVAL = float(os.getenv("WS_HOUSEKEEPING_INTERVAL", 10))
+LOOP_LAG_PROBE_INTERVAL = 0.5
+PUBSUB_RECONNECT_MAX_DELAY = float(os.getenv("WS_PUBSUB_RECONNECT_MAX_DELAY", 30))
+
+DEVICE_KEY_PREFIX = "camera_manager:device:"
+NODE_CHANNEL_PREFIX = "camera_manager:node:"
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceNotConnected(KeyError):
+    """Raised when a command targets a device that no camera_manager process holds a socket for."""
+
+
+class DeviceQueueFull(Exception):
+    """Raised when a device outbound queue is full and the overflow policy is "reject"."""
+
+
+class ForwardedCommandError(Exception):
+    """Raised when the node holding the device failed to run a forwarded command for any other reason."""
+
+
+class RequestIdInUse(Exception):
+    """Raised when a command reuses the request_id of one still waiting for a reply from the same device."""
+
+
+class TimerWheel:
+    """Hashed timer wheel with one second slots, used to expire request futures nobody is waiting on anymore."""
+
+    def __init__(self, slots: int = 512, tick: float = 1.0):
+        self.slots = [set() for _ in range(slots)]
+        self.tick = tick
+        self.position = 0
+        self.deadlines = {}
+
+    def schedule(self, key: tuple, timeout: float):
+        ticks = max(1, int(timeout / self.tick) + 1)
+        # timeouts longer than one revolution are checked against the deadline when their slot comes around
+        self.slots[(self.position + ticks) % len(self.slots)].add(key)
+        self.deadlines[key] = time.monotonic() + timeout
+
+    def cancel(self, key: tuple):
+        self.deadlines.pop(key, None)
+
+    def advance(self) -> list:
+        self.position = (self.position + 1) % len(self.slots)
+        slot, self.slots[self.position] = self.slots[self.position], set()
+        now = time.monotonic()
+        expired = []
+        for key in slot:
+            deadline = self.deadlines.get(key)
+            if deadline is None:
+                continue
+            if deadline <= now:
+                del self.deadlines[key]
+                expired.append(key)
+            else:
+                self.schedule(key, deadline - now)
+        return expired
+
+
+class ConnectionState:
+    """Per-socket bookkeeping: the outbound send queue, requests in flight and reply latency."""
 
-class ConnectionManager:
     def __init__(self):
+        self.inbound = asyncio.Queue(maxsize=INBOUND_QUEUE_SIZE)
+        self.outbound = asyncio.Queue(maxsize=OUTBOUND_QUEUE_SIZE)
+        self.pending = {}
+        self.device_id = None
+        self.heartbeat_response = None
+        self.writer_task = None
+        self.rtt = None
+        self.dropped = 0
+        self.sent = 0
+        self.received = 0
+
+    def record_rtt(self, rtt: float):
+        self.rtt = rtt if self.rtt is None else 0.8 * self.rtt + 0.2 * rtt
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self.pending),
+            "outbound_queue": self.outbound.qsize(),
+            "inbound_queue": self.inbound.qsize(),
+            "rtt_ms": round(self.rtt * 1000, 1) if self.rtt is not None else None,
+            "sent": self.sent,
+            "received": self.received,
+            "dropped": self.dropped,
+        }
+
+
+class ConnectionManager:
+    def __init__(self, redis_url: Optional[str] = REDIS_URL, node_id: str = NODE_ID):
         self.active_connections = {}
         self.acquaintance_connections = {}
+        # replies are matched by (device_id, request_id), request ids are only unique per device
         self.waiting_for_response = {}
+        # socket each pending request was sent to, so it can be failed when that socket goes away
+        self.request_connections = {}
+        # commands this process forwarded to other nodes, keyed by (device_id, request_id)
+        self.forwarded_requests = {}
+        self.node_id = node_id
+        self.redis = aioredis.from_url(redis_url, decode_responses=True) if redis_url else None
+        self.timer_wheel = TimerWheel()
+        # device_id -> time of the last heartbeat not yet written to the registry
+        self.last_seen = {}
+        self.frames_received = 0
+        self.heartbeats_received = 0
+        self.frame_rate = 0.0
+        self.heartbeat_rate = 0.0
+        self.loop_lag = 0.0
+        self.max_loop_lag = 0.0
+        self._pubsub_task = None
+        self._timer_task = None
+        self._housekeeping_tasks = []
 
-    async def wait_for_message(self, device_id: str, request_id: str, timeout: float = 10.0):
-        """Wait for a specific message from a WebSocket client."""
-        future = asyncio.Future()
-        self.waiting_for_response[request_id] = future
+    @property
+    def command_channel(self) -> str:
+        return f"{NODE_CHANNEL_PREFIX}{self.node_id}"
+
+    @property
+    def reply_channel(self) -> str:
+        return f"{NODE_CHANNEL_PREFIX}{self.node_id}:reply"
+
+    async def start(self):
+        """Start the request expiry timer and, with Redis, listening for commands forwarded by other nodes."""
+        if self._timer_task is None:
+            self._timer_task = asyncio.create_task(self._run_timer_wheel())
+            self._housekeeping_tasks = [
+                asyncio.create_task(self._run_housekeeping()),
+                asyncio.create_task(self._probe_loop_lag()),
+            ]
+        if self.redis is None or self._pubsub_task:
+            return
+        self._pubsub_task = asyncio.create_task(self._listen_pubsub())
+
+    async def stop(self):
+        if self._timer_task:
+            self._timer_task.cancel()
+            self._timer_task = None
+        for task in self._housekeeping_tasks:
+            task.cancel()
+        self._housekeeping_tasks = []
+        if self._pubsub_task:
+            self._pubsub_task.cancel()
+            self._pubsub_task = None
+        if self.redis is not None:
+            for device_id in list(self.acquaintance_connections):
+                await self._unregister_device(device_id)
+            await self.redis.aclose()
+
+    async def _run_timer_wheel(self):
+        while True:
+            await asyncio.sleep(self.timer_wheel.tick)
+            for key in self.timer_wheel.advance():
+                self._fail_request(key, TimeoutError(f"Timed out waiting for response to {key[1]}"))
+
+    async def _run_housekeeping(self):
+        frames, heartbeats, last = self.frames_received, self.heartbeats_received, time.monotonic()
+        while True:
+            await asyncio.sleep(HOUSEKEEPING_INTERVAL)
+            now = time.monotonic()
+            self.frame_rate = (self.frames_received - frames) / (now - last)
+            self.heartbeat_rate = (self.heartbeats_received - heartbeats) / (now - last)
+            frames, heartbeats, last = self.frames_received, self.heartbeats_received, now
+            self.max_loop_lag = self.loop_lag
+            try:
+                await self.flush_last_seen()
+            except Exception as e:
+                logger.warning(f"Flushing heartbeats failed: {e}")
+
+    async def _probe_loop_lag(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(LOOP_LAG_PROBE_INTERVAL)
+            self.loop_lag = time.monotonic() - started - LOOP_LAG_PROBE_INTERVAL
+            self.max_loop_lag = max(self.max_loop_lag, self.loop_lag)
+
+    async def flush_last_seen(self):
+        """Refresh the registry entries of every device that sent a heartbeat since the last flush."""
+        last_seen, self.last_seen = self.last_seen, {}
+        if self.redis is None or not last_seen:
+            return
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for device_id in last_seen:
+                if device_id in self.acquaintance_connections:
+                    pipe.set(f"{DEVICE_KEY_PREFIX}{device_id}", self.node_id, ex=DEVICE_TTL)
+            await pipe.execute()
+
+    def get_metrics(self) -> dict:
+        return {
+            "connections": len(self.active_connections),
+            "devices": len(self.acquaintance_connections),
+            "pending_requests": len(self.waiting_for_response),
+            "frames_received_total": self.frames_received,
+            "heartbeats_received_total": self.heartbeats_received,
+            "frame_rate": round(self.frame_rate, 2),
+            "heartbeat_rate": round(self.heartbeat_rate, 2),
+            "loop_lag_seconds": round(self.loop_lag, 4),
+            "max_loop_lag_seconds": round(self.max_loop_lag, 4),
+        }
+
+    def _handle_heartbeat(self, state: ConnectionState, device_id: str):
+        self.heartbeats_received += 1
+        self.last_seen[device_id] = time.time()
+        if state.heartbeat_response is None or state.device_id != device_id:
+            state.heartbeat_response = json.dumps(
+                {"resp_type": "heartbeat", "device_id": device_id, "code": 0, "log": "'heartbeat'success"}
+            )
+        # a missed heartbeat ack is harmless, never let it displace a command
+        self._enqueue(state, state.heartbeat_response, "drop_newest")
+
+    def _track_request(self, key: tuple, websocket: Optional[WebSocket], timeout: float):
+        if key in self.waiting_for_response:
+            raise RequestIdInUse(f"Request {key[1]} is already waiting for a reply from {key[0]}")
+        future = asyncio.get_running_loop().create_future()
+        future.started_at = time.monotonic()
+        self.waiting_for_response[key] = future
+        self.timer_wheel.schedule(key, timeout + 1)
+        if websocket is not None and websocket in self.active_connections:
+            self.request_connections[key] = websocket
+            self.active_connections[websocket].pending[key] = future
+        return future
+
+    def _release_request(self, key: tuple):
+        self.waiting_for_response.pop(key, None)
+        self.timer_wheel.cancel(key)
+        websocket = self.request_connections.pop(key, None)
+        state = self.active_connections.get(websocket) if websocket is not None else None
+        if state is not None:
+            state.pending.pop(key, None)
+
+    def _fail_request(self, key: tuple, exc: Exception):
+        future = self.waiting_for_response.get(key)
+        if future is not None and not future.done():
+            future.set_exception(exc)
+        self._release_request(key)
+
+    async def _wait_for_reply(self, key: tuple, future: asyncio.Future, timeout: float):
         try:
             # Wait for the future to be set by the message handler
-            await asyncio.wait_for(future, timeout=timeout)
+            await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
             return future.result()
         except asyncio.TimeoutError:
-            raise TimeoutError(f"Timed out waiting for response to {request_id}")
+            raise TimeoutError(f"Timed out waiting for response to {key[1]}")
         finally:
-            del self.waiting_for_response[request_id]
+            self._release_request(key)
+
+    async def wait_for_message(self, device_id: str, request_id: str, timeout: float = 10.0):
+        """Wait for a specific message from a WebSocket client."""
+        key = (device_id, request_id)
+        future = self._track_request(key, self.acquaintance_connections.get(device_id), timeout)
+        return await self._wait_for_reply(key, future, timeout)
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        queue = asyncio.Queue()
-        self.active_connections[websocket] = queue
-        asyncio.create_task(self._listen(websocket, queue))
+        state = ConnectionState()
+        self.active_connections[websocket] = state
+        state.writer_task = asyncio.create_task(self._write(websocket, state))
+        asyncio.create_task(self._listen(websocket, state))
 
-    async def _listen(self, websocket: WebSocket, queue: asyncio.Queue):
+    async def _listen(self, websocket: WebSocket, state: ConnectionState):
         try:
             while True:
                 data = await websocket.receive_text()
-                await queue.put(data)
+                state.received += 1
+                self.frames_received += 1
+                # heartbeats of a known device are answered without decoding the frame
+                if state.device_id and '"heartbeat"' in data and '"request_id"' not in data:
+                    self._handle_heartbeat(state, state.device_id)
+                    continue
                 # Check if this is a response to a waiting request
                 message = json.loads(data)
+                if message.get("request_type") == "heartbeat" and message.get("device_id"):
+                    self._handle_heartbeat(state, message["device_id"])
+                    continue
                 # print("RECEIVING MESSAGE", message)
                 request_id = message.get("request_id")
-                if request_id and request_id in self.waiting_for_response:
-                    self.waiting_for_response[request_id].set_result(message)
-                    print(self.waiting_for_response)
+                future = self.waiting_for_response.get((state.device_id, request_id)) if request_id else None
+                if future and not future.done():
+                    state.record_rtt(time.monotonic() - future.started_at)
+                    future.set_result(message)
+                    continue
+                if state.inbound.full():
+                    # the socket handler is falling behind, keep the newest frames
+                    state.inbound.get_nowait()
+                    state.dropped += 1
+                state.inbound.put_nowait(data)
         except Exception as e:
             await self.disconnect(websocket)
             print(f"WebSocket disconnected: {e}")
 
-    async def send_personal_message(self, message: str, websocket: WebSocket):
-        if websocket in self.active_connections:
+    async def _write(self, websocket: WebSocket, state: ConnectionState):
+        while True:
+            message = await state.outbound.get()
+            try:
+                await websocket.send_text(message)
+                state.sent += 1
+            except Exception as e:
+                print(f"WebSocket send failed: {e}")
+                await self.disconnect(websocket)
+                return
+
+    def _enqueue(self, state: ConnectionState, message: str, policy: str = OUTBOUND_OVERFLOW_POLICY):
+        if state.outbound.full():
+            if policy == "drop_newest":
+                state.dropped += 1
+                return
+            if policy == "drop_oldest":
+                state.outbound.get_nowait()
+                state.dropped += 1
+            else:
+                raise DeviceQueueFull("Device outbound queue is full")
+        state.outbound.put_nowait(message)
+
+    async def send_personal_message(self, message: str, websocket: WebSocket, policy: Optional[str] = None):
+        state = self.active_connections.get(websocket)
+        if state is not None:
             # print("SENDING MESSAGE", message)
-            await websocket.send_text(message)
+            self._enqueue(state, message, policy or OUTBOUND_OVERFLOW_POLICY)
 
     async def send_personal_message_to_device_id(self, message: str, device_id: str):
         if device_id in self.acquaintance_connections:
-            await self.acquaintance_connections[device_id].send_text(message)
+            await self.send_personal_message(message, self.acquaintance_connections[device_id])
+
+    def get_device_stats(self, device_id: str) -> Optional[dict]:
+        websocket = self.acquaintance_connections.get(device_id)
+        state = self.active_connections.get(websocket) if websocket is not None else None
+        return state.stats() if state is not None else None
+
+    def get_stats(self) -> dict:
+        return {device_id: self.get_device_stats(device_id) for device_id in list(self.acquaintance_connections)}
+
+    async def register_device(self, device_id: str, websocket: WebSocket):
+        self.acquaintance_connections[device_id] = websocket
+        state = self.active_connections.get(websocket)
+        if state is not None:
+            state.device_id = device_id
+        if self.redis is not None:
+            await self.redis.set(f"{DEVICE_KEY_PREFIX}{device_id}", self.node_id, ex=DEVICE_TTL)
+
+    async def _unregister_device(self, device_id: str):
+        key = f"{DEVICE_KEY_PREFIX}{device_id}"
+        # the device may already have reconnected to another node
+        if await self.redis.get(key) == self.node_id:
+            await self.redis.delete(key)
+
+    async def get_device_owner(self, device_id: str) -> Optional[str]:
+        if device_id in self.acquaintance_connections:
+            return self.node_id
+        if self.redis is None:
+            return None
+        return await self.redis.get(f"{DEVICE_KEY_PREFIX}{device_id}")
+
+    async def has_device(self, device_id: str) -> bool:
+        return await self.get_device_owner(device_id) is not None
+
+    async def get_active_devices(self) -> list:
+        if self.redis is None:
+            return list(self.acquaintance_connections.keys())
+        devices = set(self.acquaintance_connections.keys())
+        async for key in self.redis.scan_iter(match=f"{DEVICE_KEY_PREFIX}*", count=1000):
+            devices.add(key[len(DEVICE_KEY_PREFIX):])
+        return list(devices)
+
+    async def send_command(self, device_id: str, message: dict, timeout: float = 10.0):
+        """Send a command to a device and wait for its reply, wherever in the cluster the device is connected."""
+        websocket = self.acquaintance_connections.get(device_id)
+        if websocket is not None:
+            return await self._send_local_command(websocket, device_id, message, timeout)
+        owner = await self.get_device_owner(device_id)
+        if owner is None:
+            raise DeviceNotConnected(device_id)
+        return await self._forward_command(owner, device_id, message, timeout)
+
+    async def _send_local_command(self, websocket: WebSocket, device_id: str, message: dict, timeout: float):
+        # register the future before sending so a fast reply can not be missed
+        key = (device_id, message["request_id"])
+        future = self._track_request(key, websocket, timeout)
+        try:
+            await self.send_personal_message(json.dumps(message), websocket)
+        except Exception:
+            self._release_request(key)
+            raise
+        return await self._wait_for_reply(key, future, timeout)
+
+    async def _forward_command(self, owner: str, device_id: str, message: dict, timeout: float):
+        request_id = message["request_id"]
+        key = (device_id, request_id)
+        if key in self.forwarded_requests:
+            raise RequestIdInUse(f"Request {request_id} is already waiting for a reply from {device_id}")
+        future = asyncio.get_running_loop().create_future()
+        self.forwarded_requests[key] = future
+        command = {
+            "reply_to": self.reply_channel,
+            "device_id": device_id,
+            "message": message,
+            "timeout": timeout,
+        }
+        try:
+            if not await self.redis.publish(f"{NODE_CHANNEL_PREFIX}{owner}", json.dumps(command)):
+                # the owner process is gone, its registry entry is stale
+                raise DeviceNotConnected(device_id)
+            reply = await asyncio.wait_for(future, timeout=timeout + 1)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Timed out waiting for response to {request_id}")
+        finally:
+            self.forwarded_requests.pop(key, None)
+        if reply.get("error") == "not_found":
+            raise DeviceNotConnected(device_id)
+        if reply.get("error") == "timeout":
+            raise TimeoutError(f"Timed out waiting for response to {request_id}")
+        if reply.get("error") == "queue_full":
+            raise DeviceQueueFull("Device outbound queue is full")
+        if reply.get("error"):
+            raise ForwardedCommandError(reply.get("detail") or reply["error"])
+        return reply["response"]
+
+    async def _execute_forwarded_command(self, command: dict):
+        reply = {"device_id": command["device_id"], "request_id": command["message"]["request_id"]}
+        websocket = self.acquaintance_connections.get(command["device_id"])
+        if websocket is None:
+            reply["error"] = "not_found"
+        else:
+            try:
+                reply["response"] = await self._send_local_command(
+                    websocket, command["device_id"], command["message"], command["timeout"]
+                )
+            except TimeoutError:
+                reply["error"] = "timeout"
+            except DeviceNotConnected:
+                reply["error"] = "not_found"
+            except DeviceQueueFull:
+                reply["error"] = "queue_full"
+            except Exception as e:
+                logger.warning(f"Forwarded command to {command['device_id']} failed: {e}")
+                reply.update({"error": "failed", "detail": str(e)})
+        await self.redis.publish(command["reply_to"], json.dumps(reply))
+
+    async def _listen_pubsub(self):
+        """Serve forwarded commands and replies, subscribing again with backoff whenever the connection drops."""
+        delay = 1.0
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.subscribe(self.command_channel, self.reply_channel)
+                delay = 1.0
+                async for item in pubsub.listen():
+                    if item["type"] != "message":
+                        continue
+                    try:
+                        data = json.loads(item["data"])
+                    except (TypeError, ValueError):
+                        continue
+                    if item["channel"] == self.command_channel:
+                        asyncio.create_task(self._execute_forwarded_command(data))
+                    else:
+                        future = self.forwarded_requests.get((data.get("device_id"), data.get("request_id")))
+                        if future and not future.done():
+                            future.set_result(data)
+            except Exception as e:
+                logger.warning(f"Command channel subscription lost, resubscribing in {delay:.0f}s: {e}")
+            finally:
+                with contextlib.suppress(RedisError, OSError):
+                    await pubsub.aclose()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, PUBSUB_RECONNECT_MAX_DELAY)
 
     async def disconnect(self, websocket: WebSocket):
         if websocket in self.active_connections:
-            del self.active_connections[websocket]
+            state = self.active_connections.pop(websocket)
 
-            for device_id, ws in self.acquaintance_connections.items():
-                if ws == websocket:
-                    del self.acquaintance_connections[device_id]
+            devices = [device_id for device_id, ws in self.acquaintance_connections.items() if ws == websocket]
+            for device_id in devices:
+                del self.acquaintance_connections[device_id]
 
-            # ! del  request_id  (waiting_for_response)
-            # for request_id, ws in self.waiting_for_response.items():
-            #     if ws == websocket:
-            #         del self.acquaintance_connections[request_id]
+            # local cleanup first, so a slow or failing Redis can not keep callers and tasks waiting
+            for key, future in list(state.pending.items()):
+                if not future.done():
+                    future.set_exception(DeviceNotConnected(f"Device disconnected before replying to {key[1]}"))
+                self._release_request(key)
+            if state.writer_task and state.writer_task is not asyncio.current_task():
+                state.writer_task.cancel()
+            # wake up the socket handler waiting in get_message
+            if state.inbound.full():
+                state.inbound.get_nowait()
+            state.inbound.put_nowait(None)
+
+            if self.redis is not None:
+                for device_id in devices:
+                    try:
+                        await self._unregister_device(device_id)
+                    except RedisError as e:
+                        # the registry entry expires on its own after DEVICE_TTL
+                        logger.warning(f"Unregistering {device_id} failed: {e}")
 
             if websocket.client_state != WebSocketState.DISCONNECTED:
-                await websocket.close()
+                try:
+                    await websocket.close()
+                except RuntimeError:
+                    pass
                 print("WebSocket closed")
             else:
                 print("WebSocket was already closed")
 
     async def get_message(self, websocket: WebSocket):
-        if websocket in self.active_connections:
-            queue = self.active_connections[websocket]
-            return await queue.get()
+        state = self.active_connections.get(websocket)
+        data = await state.inbound.get() if state is not None else None
+        if data is None:
+            raise WebSocketDisconnect()
+        return data
 
 
 manager = ConnectionManager()
@@ -1,4 +1,5 @@
 from typing import Iterator
+import motor.motor_asyncio
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
@@ -41,6 +42,9 @@ def get_roi_collection():
 def get_line_collection():
     return get_mongo_client()[LINE_COLLECTION]
 
+def get_async_mongo_client():
+    return motor.motor_asyncio.AsyncIOMotorClient(MONGODB_URL)[MONG0DB_DATABASE]
+
 db = get_mongo_client()
 if ROI_COLLECTION not in db.list_collection_names():
     db.create_collection(
@@ -1,12 +1,22 @@
+import asyncio
+import json
 import os
+import sys
+import time
 import traceback
-import json
-import pika
+from collections import OrderedDict
+from datetime import datetime
+
+import aio_pika
 import requests
-import threading
-from datetime import datetime, timedelta
 from dotenv import load_dotenv, find_dotenv
-from database import get_line_collection, get_roi_collection
+from pymongo.errors import BulkWriteError, ConnectionFailure, DuplicateKeyError
+
+from database import (
+    LINE_COLLECTION,
+    ROI_COLLECTION,
+    get_async_mongo_client,
+)
 
 load_dotenv(find_dotenv())
 
@@ -23,22 +33,180 @@ RABBIT_MQ_PASSWORD = os.getenv("RABBIT_MQ_PASSWORD")
 ANALYTICS_RECEIVER_URL = "https://api.realsoft.ai/customer/deepstream_analytics/analytics_receiver"
 # ANALYTICS_RECEIVER_URL = "http://0.0.0.0:8010/customer/deepstream_analytics/analytics_receiver"
 
-
-def connect_to_rabbitmq():
-    credentials = pika.PlainCredentials(RABBIT_MQ_USERNAME, RABBIT_MQ_PASSWORD)
-    parameters = pika.ConnectionParameters(
-        host=RABBIT_MQ_HOST, port=RABBIT_MQ_PORT, credentials=credentials
-    )
-    return pika.BlockingConnection(parameters)
-
-
-rabbitmq_conn = None
-conn = None
-
-roi_collection = get_roi_collection()
-line_collection = get_line_collection()
-
-analytics_time_record = dict()
+# prefetch must stay above BATCH_SIZE, otherwise batches only ever flush on the timer
+PREFETCH_COUNT = int(os.getenv("EVENT_CONSUMER_PREFETCH_COUNT", 500))
+BATCH_SIZE = int(os.getenv("EVENT_CONSUMER_BATCH_SIZE", 200))
+FLUSH_INTERVAL = float(os.getenv("EVENT_CONSUMER_FLUSH_INTERVAL", 1.0))
+REPORT_WORKERS = int(os.getenv("EVENT_CONSUMER_REPORT_WORKERS", 8))
+REPORT_QUEUE_SIZE = int(os.getenv("EVENT_CONSUMER_REPORT_QUEUE_SIZE", 1000))
+REPORT_INTERVAL = int(os.getenv("EVENT_CONSUMER_REPORT_INTERVAL", 300))
+THROTTLE_MAX_DEVICES = int(os.getenv("EVENT_CONSUMER_THROTTLE_MAX_DEVICES", 10000))
+DUPLICATE_KEY_ERROR = 11000
+
+
+class ReportThrottle:
+    """Per-device report throttle bounded both by age and by the number of tracked devices.
+
+    Entries are kept in the order they were last reported, so expired ones are always at the front.
+    """
+
+    def __init__(self, interval: int, max_size: int):
+        self.interval = interval
+        self.max_size = max_size
+        self.records = OrderedDict()
+
+    def _evict(self, now: float):
+        while self.records:
+            device_id, reported_at = next(iter(self.records.items()))
+            if now - reported_at < self.interval and len(self.records) <= self.max_size:
+                break
+            del self.records[device_id]
+
+    def allow(self, device_id: str) -> bool:
+        now = time.monotonic()
+        self._evict(now)
+        return device_id not in self.records
+
+    def mark(self, device_id: str):
+        self.records.pop(device_id, None)
+        self.records[device_id] = time.monotonic()
+        self._evict(self.records[device_id])
+
+
+class ReportSender:
+    """Sends analytics reports from a fixed number of workers, dropping reports when the queue is full."""
+
+    def __init__(self, workers: int, queue_size: int):
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.tasks = []
+        self.dropped = 0
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    def submit(self, **report) -> bool:
+        try:
+            self.queue.put_nowait(report)
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+
+    async def _worker(self):
+        while True:
+            report = await self.queue.get()
+            try:
+                await asyncio.to_thread(http_send_report, **report)
+            finally:
+                self.queue.task_done()
+
+
+class EventBatch:
+    """Buffers documents and their messages, inserting them with insert_many and acking only after a flush.
+
+    Every message is settled by what happened to its own document: inserted or duplicate ones are acked, documents
+    Mongo rejects are rejected without requeue (dead-lettered when the queue has a DLX policy) and only documents
+    that could not be written because of a connection failure are requeued.
+    """
+
+    def __init__(self, db, batch_size: int, flush_interval: float):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.entries = []
+        self.lock = asyncio.Lock()
+        self.flushed_events = 0
+        self.rejected_events = 0
+
+    async def add(self, message: aio_pika.abc.AbstractIncomingMessage, collection: str = None, document: dict = None):
+        self.entries.append((message, collection, document))
+        if len(self.entries) >= self.batch_size:
+            await self.flush()
+
+    async def _insert(self, collection: str, documents: list) -> tuple:
+        """Positions of ``documents`` that failed for good and of those to retry later."""
+        try:
+            await self.db[collection].insert_many(documents, ordered=False)
+            return set(), set()
+        except BulkWriteError as e:
+            failed = {error["index"] for error in e.details["writeErrors"] if error["code"] != DUPLICATE_KEY_ERROR}
+            return failed, set()
+        except ConnectionFailure:
+            traceback.print_exc()
+            return set(), set(range(len(documents)))
+        except Exception:
+            traceback.print_exc()
+        # the batch could not be sent as a whole, write it one by one to find the documents that break it
+        failed = set()
+        for index, document in enumerate(documents):
+            try:
+                await self.db[collection].insert_one(document)
+            except DuplicateKeyError:
+                continue
+            except ConnectionFailure:
+                return failed, set(range(index, len(documents)))
+            except Exception:
+                failed.add(index)
+        return failed, set()
+
+    async def flush(self):
+        async with self.lock:
+            if not self.entries:
+                return
+            entries, self.entries = self.entries, []
+            by_collection = {}
+            for message, collection, document in entries:
+                if collection:
+                    by_collection.setdefault(collection, []).append((message, document))
+
+            rejected, requeued = [], []
+            for collection, items in by_collection.items():
+                failed, retry = await self._insert(collection, [document for _, document in items])
+                rejected.extend(items[index][0] for index in failed)
+                requeued.extend(items[index][0] for index in retry)
+
+            # deliveries of a channel that has been closed since cannot be settled, the broker redelivers them
+            live = [entry for entry in entries if not entry[0].channel.is_closed]
+            if len(live) < len(entries):
+                print(f"Dropped {len(entries) - len(live)} events of a closed channel, they will be redelivered")
+            if live and not rejected and not requeued:
+                # all unacked deliveries on the channel are in this batch, so the highest tag covers all of them
+                await self._settle(max(live, key=lambda entry: entry[0].delivery_tag)[0].ack(multiple=True))
+            elif live:
+                unsettled = {id(message) for message in rejected + requeued}
+                for message in rejected:
+                    await self._settle(message.reject(requeue=False))
+                for message in requeued:
+                    await self._settle(message.nack(requeue=True))
+                for message, _, _ in live:
+                    if id(message) not in unsettled:
+                        await self._settle(message.ack())
+                if rejected:
+                    print(f"Rejected {len(rejected)} events Mongo refused to store")
+            self.rejected_events += len(rejected)
+            self.flushed_events += len(entries) - len(requeued)
+
+    @staticmethod
+    async def _settle(settlement):
+        try:
+            await settlement
+        except Exception:
+            # the channel went away mid-flush, the broker redelivers whatever was left unsettled
+            traceback.print_exc()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                # a failed flush must not stop the timer, batches would then only flush once full
+                traceback.print_exc()
+
+
+throttle = ReportThrottle(REPORT_INTERVAL, THROTTLE_MAX_DEVICES)
+report_sender = ReportSender(REPORT_WORKERS, REPORT_QUEUE_SIZE)
 
 
 def http_send_report(
@@ -62,177 +230,150 @@ def http_send_report(
                 "frame_image": frame_image,
                 "illegal_parking": illegal_parking,
             },
+            timeout=10,
         )
     except Exception:
         pass
 
 
 def handle_roi_message(message, roi_id: str, jetson_device_id: str, frame: str = None):
-    try:
-        payload = {}
-        payload["@timestamp"] = datetime.fromisoformat(
-            message["@timestamp"].rstrip("Z")
-        )
-        payload["event_type"] = (
-            "entrance" if message["event"]["type"] == "parked" else "exit"
+    payload = {}
+    payload["@timestamp"] = datetime.fromisoformat(
+        message["@timestamp"].rstrip("Z")
+    )
+    payload["event_type"] = (
+        "entrance" if message["event"]["type"] == "parked" else "exit"
+    )
+    payload["event_id"] = message["event"]["id"]
+    payload["roi_id"] = int(roi_id)
+    payload["jetson_device_id"] = jetson_device_id
+    payload["number_of_people"] = message["object"]["person"]["age"]
+    payload["containsFrame"] = False
+
+    if payload["event_type"] == "entrance" and frame is not None and throttle.allow(jetson_device_id):
+        payload["containsFrame"] = True
+        report_sender.submit(
+            report_id=payload["event_id"],
+            roi_id=payload["roi_id"],
+            timestamp=payload["@timestamp"].strftime("%Y-%m-%d %H:%M:%S"),
+            number_of_people=payload["number_of_people"],
+            jetson_device_id=jetson_device_id,
+            frame_image=frame,
         )
-        payload["event_id"] = message["event"]["id"]
-        payload["roi_id"] = int(roi_id)
-        payload["jetson_device_id"] = jetson_device_id
-        payload["number_of_people"] = message["object"]["person"]["age"]
-        payload["containsFrame"] = False
-
-        if analytics_time_record.get(jetson_device_id):
-            report_time_difference: timedelta = (
-                datetime.now() - analytics_time_record[jetson_device_id]
-            )
-
-            if report_time_difference.seconds >= 300:
-                if payload["event_type"] == "entrance" and frame is not None:
-                    payload["containsFrame"] = True
-                    threading.Thread(
-                        target=http_send_report,
-                        args=(
-                            payload["event_id"],
-                            payload["roi_id"],
-                            payload["@timestamp"].strftime("%Y-%m-%d %H:%M:%S"),
-                            payload["number_of_people"],
-                            jetson_device_id,
-                            frame,
-                        ),
-                    ).start()
-
-                    analytics_time_record[jetson_device_id] = datetime.now()
-        else:
-            if payload["event_type"] == "entrance" and frame is not None:
-                payload["containsFrame"] = True
-                threading.Thread(
-                    target=http_send_report,
-                    args=(
-                        payload["event_id"],
-                        payload["roi_id"],
-                        payload["@timestamp"].strftime("%Y-%m-%d %H:%M:%S"),
-                        payload["number_of_people"],
-                        jetson_device_id,
-                        frame,
-                    ),
-                ).start()
-
-                analytics_time_record[jetson_device_id] = datetime.now()
-
-        roi_collection.insert_one(payload)
+        throttle.mark(jetson_device_id)
 
-    except Exception:
-        pass
+    return ROI_COLLECTION, payload
 
 
 def handle_line_message(message: str, line_id: str, jetson_device_id: str):
-    try:
-        payload = {}
-        payload["@timestamp"] = datetime.fromisoformat(
-            message["@timestamp"].rstrip("Z")
-        )
-        payload["event_id"] = message["event"]["id"]
-        payload["line_id"] = int(line_id)
-        payload["jetson_device_id"] = jetson_device_id
+    payload = {}
+    payload["@timestamp"] = datetime.fromisoformat(
+        message["@timestamp"].rstrip("Z")
+    )
+    payload["event_id"] = message["event"]["id"]
+    payload["line_id"] = int(line_id)
+    payload["jetson_device_id"] = jetson_device_id
 
-        line_collection.insert_one(payload)
-
-    except Exception:
-        pass
+    return LINE_COLLECTION, payload
 
 
 def handle_car_parking(message: str, roi_id: str, jetson_device_id: str, frame: str):
-    try:
-        payload = {}
-        payload["@timestamp"] = datetime.fromisoformat(
-            message["@timestamp"].rstrip("Z")
-        )
-        payload["event_id"] = message["event"]["id"]
-        payload["roi_id"] = int(roi_id)
-        payload["jetson_device_id"] = jetson_device_id
-        payload["event_type"] = "car_parking"
-
-        threading.Thread(
-            target=http_send_report,
-            args=(
-                payload["event_id"],
-                payload["roi_id"],
-                payload["@timestamp"].strftime("%Y-%m-%d %H:%M:%S"),
-                0,
-                jetson_device_id,
-                frame,
-                True,
-            ),
-        ).start()
-
-        roi_collection.insert_one(payload)
+    payload = {}
+    payload["@timestamp"] = datetime.fromisoformat(
+        message["@timestamp"].rstrip("Z")
+    )
+    payload["event_id"] = message["event"]["id"]
+    payload["roi_id"] = int(roi_id)
+    payload["jetson_device_id"] = jetson_device_id
+    payload["event_type"] = "car_parking"
+
+    report_sender.submit(
+        report_id=payload["event_id"],
+        roi_id=payload["roi_id"],
+        timestamp=payload["@timestamp"].strftime("%Y-%m-%d %H:%M:%S"),
+        number_of_people=0,
+        jetson_device_id=jetson_device_id,
+        frame_image=frame,
+        illegal_parking=True,
+    )
 
-    except Exception:
-        traceback.print_exc()
+    return ROI_COLLECTION, payload
 
 
-def on_message(channel, method_frame, header_frame, body):
-    try:
-        # Convert message body to dictionary
-        message = json.loads(body)
-
-        elements = message["object"]["person"]["apparel"].split(";")
-
-        if elements[0] == "car-parking":
-            handle_car_parking(
-                message=message,
-                roi_id=elements[1],
-                jetson_device_id=elements[2],
-                frame=elements[3],
-            )
-        elif elements[0] == "line-cross":
-            handle_line_message(
-                message=message, line_id=elements[1], jetson_device_id=elements[2]
-            )
-        elif elements[0] == "roi":
-            if len(elements) == 4:
-                handle_roi_message(
-                    message=message,
-                    roi_id=elements[1],
-                    jetson_device_id=elements[2],
-                    frame=elements[3],
-                )
-            else:
-                handle_roi_message(
-                    message=message,
-                    roi_id=elements[1],
-                    jetson_device_id=elements[2],
-                    frame=None,
-                )
-        else:
-            handle_roi_message(
-                message=message,
-                roi_id=elements[0],
-                jetson_device_id=elements[1],
-                frame=None,
-            )
+def parse_message(body: bytes):
+    message = json.loads(body)
 
-    except Exception:
-        traceback.print_exc()
+    elements = message["object"]["person"]["apparel"].split(";")
 
-    # Acknowledge the message
-    channel.basic_ack(delivery_tag=method_frame.delivery_tag)
+    if elements[0] == "car-parking":
+        return handle_car_parking(
+            message=message,
+            roi_id=elements[1],
+            jetson_device_id=elements[2],
+            frame=elements[3],
+        )
+    elif elements[0] == "line-cross":
+        return handle_line_message(
+            message=message, line_id=elements[1], jetson_device_id=elements[2]
+        )
+    elif elements[0] == "roi":
+        return handle_roi_message(
+            message=message,
+            roi_id=elements[1],
+            jetson_device_id=elements[2],
+            frame=elements[3] if len(elements) == 4 else None,
+        )
+    return handle_roi_message(
+        message=message,
+        roi_id=elements[0],
+        jetson_device_id=elements[1],
+        frame=None,
+    )
 
 
-try:
-    # Establish connections
-    rabbitmq_conn = connect_to_rabbitmq()
-    channel = rabbitmq_conn.channel()
-    channel.queue_declare(queue="workspace_analytics", durable=True)
-    channel.queue_bind(
-        exchange="amq.topic", queue="workspace_analytics", routing_key="*"
+async def on_message(batch: EventBatch, message: aio_pika.abc.AbstractIncomingMessage):
+    try:
+        collection, document = parse_message(message.body)
+    except Exception:
+        traceback.print_exc()
+        # malformed events are acked together with the batch they arrived in
+        await batch.add(message)
+        return
+    await batch.add(message, collection, document)
+
+
+async def main():
+    connection = await aio_pika.connect_robust(
+        host=RABBIT_MQ_HOST,
+        port=int(RABBIT_MQ_PORT),
+        login=RABBIT_MQ_USERNAME,
+        password=RABBIT_MQ_PASSWORD,
     )
+    async with connection:
+        channel = await connection.channel()
+        await channel.set_qos(prefetch_count=PREFETCH_COUNT)
+        queue = await channel.declare_queue("workspace_analytics", durable=True)
+        await queue.bind("amq.topic", routing_key="*")
+
+        batch = EventBatch(get_async_mongo_client(), BATCH_SIZE, FLUSH_INTERVAL)
+        report_sender.start()
+        flusher = asyncio.create_task(batch.run())
 
-    channel.basic_consume(queue="workspace_analytics", on_message_callback=on_message)
+        await queue.consume(lambda message: on_message(batch, message))
 
-    print("Waiting for messages. To exit press CTRL+C")
-    channel.start_consuming()
+        print("Waiting for messages. To exit press CTRL+C")
+        try:
+            # the flusher only returns by failing, the process exits then so it gets restarted
+            await flusher
+            raise RuntimeError("event batch flusher stopped")
+        finally:
+            flusher.cancel()
+            await batch.flush()
 
-except Exception as e:
-    print("Error:", e)
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except Exception as e:
+        print("Error:", e)
+        sys.exit(1)